@@ -1,9 +1,10 @@
 import os
 import base64
-import requests
-import tiktoken
-from openai import OpenAI
-from typing import Optional, List, Dict, Union, Any
+from typing import Optional, List, Dict, Union, Any, TYPE_CHECKING
+
+# openai, tiktoken and requests are imported on first use, they cost a good part of a second at startup
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 # --- Utility Functions ---
@@ -20,6 +21,7 @@ def num_tokens_from_string(text: str, model_name: str) -> int:
         int: The number of tokens in the string.
     """
     try:
+        import tiktoken
         encoding = tiktoken.encoding_for_model(model_name)
         num_tokens = len(encoding.encode(text))
         return num_tokens
@@ -44,7 +46,7 @@ def _encode_bytes_to_base64(content_bytes: bytes) -> str:
 # --- Internal AI Call Helper ---
 
 def _make_api_call(
-        client: OpenAI,
+        client: "OpenAI",
         model: str,
         messages: List[Dict[str, Any]],
         stream: bool = False,
@@ -132,6 +134,7 @@ def call_text_model(
     Returns:
         Optional[str]: The generated text response.
     """
+    from openai import OpenAI
     client = OpenAI(api_key=api_key, base_url=base_url)
 
     messages = []
@@ -166,6 +169,7 @@ def call_image_model(
     Returns:
         Optional[str]: The VLM's analysis of the image.
     """
+    from openai import OpenAI
     client = OpenAI(api_key=api_key, base_url=base_url)
     encoded_image: str
 
@@ -178,6 +182,7 @@ def call_image_model(
             encoded_image = _encode_bytes_to_base64(image_file.read())
     elif image_source.startswith(('http://', 'https://')):
         # It's a URL, download content to memory
+        import requests
         try:
             response = requests.get(image_source)
             response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
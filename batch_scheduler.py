@@ -0,0 +1,164 @@
+# batch_scheduler.py
+# Dynamic micro-batching in front of the loaded model. Concurrent callers (GUI, caption queue,
+# server requests) submit single generations. The scheduler gathers those of the same profile for
+# up to max_wait_ms or max_batch_size requests, runs them as one padded model.generate(),
+# and hands every caller its own result through a Future.
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from cancellation import CancellationToken, GenerationCancelled
+
+
+@dataclass
+class BatchRequest:
+    """One caller's generation, waiting for a batch."""
+    profile: Any  # VLMProfile
+    prompt: str
+    image_raw: Any  # PIL.Image.Image
+    cancel_token: Optional[CancellationToken] = None
+    future: Future = field(default_factory=Future)
+    submitted: float = field(default_factory=time.perf_counter)
+
+
+class BatchScheduler:
+    """
+    Groups concurrent generation requests into batches.
+
+    A batch starts when max_batch_size requests of the same profile are waiting, or when the
+    oldest request has waited max_wait_ms, so batching adds at most max_wait_ms of latency.
+    With max_wait_ms=0 only requests that are already queued (typically the ones that came in
+    while the previous batch was generating) are batched together.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait_ms=5.0):
+        """
+        Args:
+            run_batch: Callable(profile, requests) -> list of raw outputs, one per BatchRequest.
+                Called on the scheduler thread, one batch at a time.
+            max_batch_size (int): Largest batch passed to run_batch.
+            max_wait_ms (float): Longest time a request waits for others to join its batch.
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._batched_requests = 0
+        self._wait_seconds = 0.0
+
+    def submit(self, profile, prompt, image_raw, cancel_token=None) -> Future:
+        """
+        Queues one generation.
+
+        Returns:
+            Future: Resolves to the raw model output, or raises GenerationCancelled / the generation error.
+        """
+        request = BatchRequest(profile, prompt, image_raw, cancel_token)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BatchScheduler is shut down.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._condition.notify()
+        return request.future
+
+    def shutdown(self):
+        """Stops the scheduler thread, requests still waiting are cancelled."""
+        with self._condition:
+            self._closed = True
+            pending, self._pending = self._pending, []
+            self._condition.notify()
+        for request in pending:
+            request.future.set_exception(GenerationCancelled())
+
+    def stats(self) -> dict:
+        """Batches run so far, mean batch size and mean time requests waited for their batch."""
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "requests": self._batched_requests,
+                "mean_batch_size": self._batched_requests / self._batches if self._batches else 0.0,
+                "mean_wait_ms": self._wait_seconds / self._batched_requests * 1000 if self._batched_requests else 0.0,
+            }
+
+    def _next_batch(self):
+        """Blocks until a batch is ready. Returns (profile, requests), or None once shut down."""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None
+
+            # The oldest request decides the profile and the deadline, others wait for a later batch
+            profile = self._pending[0].profile
+            deadline = self._pending[0].submitted + self.max_wait
+            while not self._closed:
+                same_profile = sum(1 for request in self._pending if request.profile is profile)
+                remaining = deadline - time.perf_counter()
+                if same_profile >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch, rest = [], []
+            for request in self._pending:
+                if request.profile is profile and len(batch) < self.max_batch_size:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self._pending = rest
+            return profile, batch
+
+    def _loop(self):
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            profile, batch = next_batch
+
+            # Cancelled while waiting, don't spend a batch slot on them
+            live = []
+            for request in batch:
+                if request.cancel_token is not None and request.cancel_token.cancelled:
+                    request.future.set_exception(GenerationCancelled())
+                else:
+                    live.append(request)
+            if not live:
+                continue
+
+            start = time.perf_counter()
+            with self._stats_lock:
+                self._batches += 1
+                self._batched_requests += len(live)
+                self._wait_seconds += sum(start - request.submitted for request in live)
+            self._run(profile, live)
+
+    def _run(self, profile, requests):
+        try:
+            outputs = self.run_batch(profile, requests)
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0].future.set_exception(e)
+                return
+            # Typically out of memory for the bigger batch: retry one at a time
+            print(f"Batch of {len(requests)} failed ({e}), retrying the requests one by one.")
+            for request in requests:
+                self._run(profile, [request])
+            return
+
+        for request, output in zip(requests, outputs):
+            # A cancelled row stopped early, its partial output is dropped like in the single case
+            if request.cancel_token is not None and request.cancel_token.cancelled:
+                request.future.set_exception(GenerationCancelled())
+            else:
+                request.future.set_result(output)
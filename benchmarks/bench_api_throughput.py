@@ -0,0 +1,134 @@
+# bench_api_throughput.py
+# End-to-end throughput benchmark of ai_utils against the local stub server (fully offline).
+# Drives call_text_model, call_image_model and the card -> SD chain of the Generate tab
+# at different concurrency levels and reports latency percentiles, throughput and connection reuse.
+#
+# Usage: python benchmarks/bench_api_throughput.py --requests 64 --concurrency 1 4 16
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))  # prompts/ is resolved from cwd
+
+import ai_utils
+from config import CARD_CHAR_TO_ANALYZE, CARD_USER_ROLE, SD_CHAR_TO_ANALYZE, DEFAULT_CARD_TEMPLATE, \
+    DEFAULT_SD_TEMPLATE
+from prompts import generate_character_card_prompt, generate_stable_diffusion_prompt
+from openai_stub_server import StubConfig, StubServer
+
+API_KEY = "stub-key"
+MODEL = "stub-model"
+SAMPLE_IMAGE = "assets/profile.png"
+SAMPLE_CAPTION = "A young woman with silver hair sits by a rainy window in an old library, reading. " * 8
+SAMPLE_TAGS = "1girl, solo, silver_hair, long_hair, sitting, book, library, window, rain, indoors"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile, enough for a benchmark report."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_text(base_url):
+    return ai_utils.call_text_model(api_key=API_KEY, base_url=base_url, model=MODEL,
+                                    user_request="Hello!", temperature=0.7)
+
+
+def run_image(base_url, image_bytes):
+    return ai_utils.call_image_model(api_key=API_KEY, base_url=base_url, model=MODEL,
+                                     image_source=image_bytes, user_request="Describe this image.")
+
+
+def run_chain(base_url):
+    """Mirrors GenerateTab: card prompt -> card -> SD prompt -> SD output."""
+    card_prompt = generate_character_card_prompt(template_name=DEFAULT_CARD_TEMPLATE,
+                                                 character_to_analyze=CARD_CHAR_TO_ANALYZE,
+                                                 user_role=CARD_USER_ROLE, user_placeholder="{{user}}",
+                                                 caption=SAMPLE_CAPTION, tags=SAMPLE_TAGS)
+    card = ai_utils.call_text_model(api_key=API_KEY, base_url=base_url, model=MODEL, user_request=card_prompt)
+    if not card:
+        return None
+    sd_prompt = generate_stable_diffusion_prompt(template_name=DEFAULT_SD_TEMPLATE,
+                                                 character_to_analyze=SD_CHAR_TO_ANALYZE,
+                                                 caption=SAMPLE_CAPTION, tags=SAMPLE_TAGS, character_card=card)
+    return ai_utils.call_text_model(api_key=API_KEY, base_url=base_url, model=MODEL, user_request=sd_prompt)
+
+
+def measure(server, task, n_requests, concurrency):
+    """Runs task n_requests times on a thread pool and collects latencies and server counters."""
+    server.stats.reset()
+
+    def timed():
+        start = time.perf_counter()
+        result = task()
+        return time.perf_counter() - start, result is not None
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: timed(), range(n_requests)))
+    wall = time.perf_counter() - wall_start
+
+    latencies = [latency for latency, _ in results]
+    stats = server.stats.snapshot()
+    reused = max(0, stats["requests"] - stats["connections"])
+    return {
+        "ok": sum(1 for _, ok in results if ok),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "throughput": n_requests / wall if wall else 0.0,
+        "http_requests": stats["requests"],
+        "connections": stats["connections"],
+        "reuse_pct": 100.0 * reused / stats["requests"] if stats["requests"] else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline API throughput benchmark for ai_utils.")
+    parser.add_argument("--requests", type=int, default=64, help="Calls per scenario and concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--scenarios", nargs="+", default=["text", "image", "chain"],
+                        choices=["text", "image", "chain"])
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+
+    with open(SAMPLE_IMAGE, "rb") as f:
+        image_bytes = f.read()
+
+    config = StubConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+                        completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                        error_status=args.error_status, seed=1234)
+    tasks = {
+        "text": lambda url: (lambda: run_text(url)),
+        "image": lambda url: (lambda: run_image(url, image_bytes)),
+        "chain": lambda url: (lambda: run_chain(url)),
+    }
+
+    with StubServer(config=config) as server:
+        print(f"Stub server at {server.base_url} | latency {args.latency_ms} ms | "
+              f"{args.tokens_per_second} tok/s | {args.completion_tokens} tokens | error rate {args.error_rate}")
+        header = f"{'scenario':<8} {'conc':>4} {'ok':>5} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} " \
+                 f"{'ops/s':>8} {'http':>6} {'conns':>6} {'reuse%':>7}"
+        print(header)
+        print("-" * len(header))
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                row = measure(server, tasks[scenario](server.base_url), args.requests, concurrency)
+                print(f"{scenario:<8} {concurrency:>4} {row['ok']:>5} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+                      f"{row['mean_ms']:>9.1f} {row['throughput']:>8.1f} {row['http_requests']:>6} "
+                      f"{row['connections']:>6} {row['reuse_pct']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# bench_compiled_generation.py
+# Warm-up cost versus steady-state tokens/s of compiled generation (static KV cache + compiled
+# decode step) on CPU, against the usual eager decoding with a dynamic cache. Every mode runs in
+# a fresh process, like an app start:
+#   eager          - no compilation
+#   compiled/cold  - empty compile cache, the first generation compiles everything
+#   compiled/warm  - same cache folder again, what a later app start pays
+#
+# Uses a small text model as a stand-in for the VLM: the decode loop is what gets compiled.
+# Needs torch + transformers and downloads the model on first run.
+#
+# Usage: python benchmarks/bench_compiled_generation.py --model HuggingFaceTB/SmolLM2-360M-Instruct \
+#            --max-new-tokens 128 --generations 6
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+PROMPT = "Write a long detailed description of a painting of a girl with long silver hair reading in an old library."
+
+
+def run_child(args):
+    """One 'app start': loads the model, generates --generations times, prints the timings as JSON."""
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from compiled_generation import CompiledGeneration
+    from decode_stats import DecodeStats
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32).eval()
+    if args.mode == "compiled":
+        CompiledGeneration(model, args.max_new_tokens, "cpu", cache_dir=Path(args.cache_dir)).enable()
+
+    text = tokenizer.apply_chat_template([{"role": "user", "content": PROMPT}], tokenize=False,
+                                         add_generation_prompt=True)
+    inputs = tokenizer(text, return_tensors="pt")
+    runs = []
+    for _ in range(args.generations):
+        stats = DecodeStats()
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = model.generate(**inputs, max_new_tokens=args.max_new_tokens, min_new_tokens=args.max_new_tokens,
+                                    do_sample=False, pad_token_id=tokenizer.eos_token_id)
+        stats.seconds = time.perf_counter() - start
+        stats.new_tokens = output.shape[1] - inputs["input_ids"].shape[1]
+        runs.append(stats)
+
+    steady = DecodeStats(new_tokens=sum(run.new_tokens for run in runs[1:]),
+                         seconds=sum(run.seconds for run in runs[1:]))
+    print(json.dumps({"first_s": runs[0].seconds, "steady_tokens_per_s": steady.tokens_per_second,
+                      "threads": torch.get_num_threads()}))
+
+
+def run_mode(args, mode, cache_dir):
+    command = [sys.executable, __file__, "--child", "--mode", mode, "--cache-dir", cache_dir,
+               "--model", args.model, "--max-new-tokens", str(args.max_new_tokens),
+               "--generations", str(args.generations)]
+    if args.threads:
+        command += ["--threads", str(args.threads)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"{mode} run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled generation warm-up vs steady state on CPU.")
+    parser.add_argument("--model", default="HuggingFaceTB/SmolLM2-360M-Instruct")
+    parser.add_argument("--max-new-tokens", type=int, default=128)
+    parser.add_argument("--generations", type=int, default=6, help="Per run, the first one is the warm-up.")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="eager", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args)
+    if args.generations < 2:
+        parser.error("--generations must be at least 2 (warm-up + steady state).")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = [("eager", run_mode(args, "eager", cache_dir)),
+                   ("compiled/cold", run_mode(args, "compiled", cache_dir)),
+                   ("compiled/warm", run_mode(args, "compiled", cache_dir))]
+
+    baseline = results[0][1]
+    print(f"{args.model}, {args.max_new_tokens} new tokens x {args.generations} generations, "
+          f"{baseline['threads']} threads\n")
+    print(f"{'mode':>14} {'1st generation (s)':>19} {'steady tokens/s':>16} {'speedup':>8} {'break-even':>11}")
+    for name, result in results:
+        speedup = result["steady_tokens_per_s"] / baseline["steady_tokens_per_s"]
+        # Generations until the extra warm-up time is paid back by the faster steady state
+        steady_s = args.max_new_tokens / result["steady_tokens_per_s"]
+        baseline_steady_s = args.max_new_tokens / baseline["steady_tokens_per_s"]
+        extra_warmup_s = (result["first_s"] - steady_s) - (baseline["first_s"] - baseline_steady_s)
+        if name == "eager":
+            break_even = "-"
+        elif steady_s < baseline_steady_s:
+            break_even = f"{max(0.0, extra_warmup_s) / (baseline_steady_s - steady_s):.0f} gens"
+        else:
+            break_even = "never"
+        print(f"{name:>14} {result['first_s']:>19.1f} {result['steady_tokens_per_s']:>16.1f} "
+              f"{speedup:>7.2f}x {break_even:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench_constrained_tags.py
+# Cost and effect of vocabulary-constrained tag decoding:
+#   - building the token trie of a vocabulary (cold) versus loading it from the cache (warm)
+#   - the logits processor's overhead per decode step
+#   - with --profile and --images: free versus constrained tags pass on real images, tokens
+#     generated, tags kept by the normalizer and time per image
+#
+# The vocabulary is the user's (settings folder) when there is one, a synthetic one otherwise.
+# Needs torch + transformers (the tokenizer is downloaded, the model only with --profile).
+#
+# Usage: python benchmarks/bench_constrained_tags.py --tokenizer Minthy/ToriiGate-v0.4-7B --tags 150000
+#        python benchmarks/bench_constrained_tags.py --profile ToriiGate-v0.4-7B --images samples/ --limit 20
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+import torch
+from transformers import AutoTokenizer
+
+from bench_tag_vocabulary import write_tag_files
+from config import NO_TAGS_FOUND
+from image_loader import load_image
+from model_handler import ModelHandler
+from tag_normalizer import TagNormalizer
+from tag_trie import TagConstraint, TagTrieLogitsProcessor, load_tag_trie
+from tag_vocabulary import load_tag_vocabulary
+from vlm_profiles import VLM_PROFILES
+
+
+def measure_trie(vocabulary, tokenizer, spaces, steps):
+    with tempfile.TemporaryDirectory() as trie_dir:
+        start = time.perf_counter()
+        load_tag_trie(vocabulary, tokenizer, spaces=spaces, trie_dir=trie_dir)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        trie = load_tag_trie(vocabulary, tokenizer, spaces=spaces, trie_dir=trie_dir)
+        warm = time.perf_counter() - start
+        size_mb = sum(path.stat().st_size for path in Path(trie_dir).iterdir()) / 2 ** 20
+    print(f"trie: {trie.n_nodes} nodes, {size_mb:.1f} MB on disk, built in {cold:.1f} s, "
+          f"loaded from cache in {warm * 1000:.1f} ms")
+
+    # Per-step cost on a synthetic decode: the most used tags, comma separated
+    names = [name for name, _, _ in sorted(vocabulary.iter_tags(), key=lambda tag: -tag[2])[:200]]
+    text = ", ".join(name.replace("_", " ") if spaces else name for name in names)
+    ids = tokenizer.encode(text, add_special_tokens=False)[:steps]
+    processor = TagTrieLogitsProcessor(TagConstraint(trie), tokenizer, 0, tokenizer.eos_token_id)
+    scores = torch.zeros((1, len(tokenizer)))
+    start = time.perf_counter()
+    for length in range(1, len(ids) + 1):
+        processor(torch.tensor([ids[:length]]), scores)
+    elapsed = time.perf_counter() - start
+    print(f"logits processor: {elapsed / len(ids) * 1e6:.0f} us per decode step ({len(ids)} steps)\n")
+
+
+def measure_profile(args, vocabulary):
+    profile = VLM_PROFILES[args.profile]
+    handler = ModelHandler()
+    handler.load_model(profile)
+    measure_trie(vocabulary, handler.processor.tokenizer, profile.tags_with_spaces, args.steps)
+
+    images = sorted(path for path in Path(args.images).iterdir() if path.suffix.lower() in (".png", ".jpg", ".jpeg",
+                                                                                          ".webp"))[:args.limit]
+    normalizer = TagNormalizer(vocabulary, drop_unknown=True)
+    print(f"{'mode':>12} {'tokens/image':>13} {'s/image':>8} {'tags/image':>11} {'kept by normalizer':>19}")
+    for mode, tag_vocabulary in (("free", None), ("constrained", vocabulary)):
+        tokens = seconds = written = kept = 0
+        for path in images:
+            image, _ = load_image(path)
+            start = time.perf_counter()
+            raw_output = handler.generate_description(profile, profile.prompt_tags, image, force=True,
+                                                      tag_vocabulary=tag_vocabulary)
+            seconds += time.perf_counter() - start
+            tokens += handler.last_decode_stats.new_tokens
+            tags = profile.tags_parser(raw_output).get("output", "")
+            if tags and tags != NO_TAGS_FOUND:
+                written += len([tag for tag in tags.split(",") if tag.strip()])
+                kept += len(normalizer.normalize_list(tags))
+        count = max(1, len(images))
+        print(f"{mode:>12} {tokens / count:>13.0f} {seconds / count:>8.1f} {written / count:>11.1f} "
+              f"{kept / max(1, written):>19.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vocabulary-constrained tag decoding benchmark.")
+    parser.add_argument("--tokenizer", default="Minthy/ToriiGate-v0.4-7B")
+    parser.add_argument("--spaces", action="store_true", help="Tags spelled with spaces (ToriiGate).")
+    parser.add_argument("--tags", type=int, default=150000, help="Synthetic vocabulary size, without a user one.")
+    parser.add_argument("--steps", type=int, default=512)
+    parser.add_argument("--profile", default=None, choices=list(VLM_PROFILES))
+    parser.add_argument("--images", default=None, help="Folder of sample images, with --profile.")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    vocabulary = load_tag_vocabulary()
+    with tempfile.TemporaryDirectory() as tags_dir:
+        if vocabulary is None:
+            write_tag_files(tags_dir, args.tags)
+            vocabulary = load_tag_vocabulary(tags_dir)
+        print(f"{len(vocabulary)} tags\n")
+        if args.profile and args.images:
+            measure_profile(args, vocabulary)
+        else:
+            tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+            measure_trie(vocabulary, tokenizer, args.spaces, args.steps)
+
+
+if __name__ == "__main__":
+    main()
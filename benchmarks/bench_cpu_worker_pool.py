@@ -0,0 +1,104 @@
+# bench_cpu_worker_pool.py
+# Images/hour of the CPU worker pool for different worker counts, and how much memory each
+# worker really adds (Linux PSS: shared pages are split between the processes mapping them).
+#
+# By default the "model" is a stub that burns --work-ms of pure-Python CPU time per image (one
+# core, like a badly parallelized generate()), so the scaling of the pool itself can be checked
+# anywhere. Use --profile to measure a real VLM profile on a CPU-only host.
+#
+# Usage: python benchmarks/bench_cpu_worker_pool.py --workers 1 2 4 8 --images 32
+#        python benchmarks/bench_cpu_worker_pool.py --profile ToriiGate-v0.4-7B --workers 1 2 4 --images 8
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import wait
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from cpu_worker_pool import CPUWorkerPool, available_cores
+from model_handler import ModelHandler
+from vlm_profiles import VLMProfile, VLM_PROFILES, parse_simple_model_text
+
+
+def burn_cpu(model, processor, device, prompt, system_prompt, image_raw, cancel_token=None, work_ms=500.0):
+    """Stub generation function: CPU-bound loop, checks the token like a decode step would."""
+    deadline = time.process_time() + work_ms / 1000.0
+    steps = 0
+    while time.process_time() < deadline:
+        for _ in range(10000):
+            steps += 1
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+    return f"{prompt}: {steps} steps"
+
+
+def load_stub(model_id, device):
+    return None, None
+
+
+def proportional_set_size_mb(pid):
+    """PSS of a process in MB, None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU worker pool scaling benchmark.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--work-ms", type=float, default=500.0, help="Stub CPU time per image.")
+    parser.add_argument("--profile", default=None, choices=list(VLM_PROFILES), help="Measure a real profile.")
+    args = parser.parse_args()
+
+    cores = available_cores()
+    if args.profile:
+        profile = VLM_PROFILES[args.profile]
+        handler = ModelHandler(compute_device="cpu")
+        handler.load_model(profile)
+        model, processor = handler.model, handler.processor
+    else:
+        profile = VLMProfile(model_id="stub/cpu-burner", prompt_caption="", prompt_tags="", system_prompt="",
+                             caption_parser=parse_simple_model_text, tags_parser=parse_simple_model_text,
+                             generation_function=burn_cpu, loader_function=load_stub, required_vram_gb=0,
+                             generation_params={"work_ms": args.work_ms})
+        model, processor = None, None
+    image = Image.new("RGB", (448, 448), (120, 80, 200))
+    prompt = profile.prompt_caption or "image"
+
+    print(f"{len(cores)} cores, {args.images} images, {profile.model_id}\n")
+    print(f"{'workers':>7} {'threads':>8} {'images/h':>10} {'speedup':>8} {'PSS/worker (MB)':>16} {'jobs per worker'}")
+    baseline = None
+    for num_workers in args.workers:
+        if num_workers > len(cores):
+            break
+        pool = CPUWorkerPool(profile, model, processor, num_workers=num_workers).start()
+        try:
+            start = time.perf_counter()
+            futures = [pool.submit(f"{prompt} #{index}", image) for index in range(args.images)]
+            wait(futures)
+            elapsed = time.perf_counter() - start
+            for future in futures:
+                future.result()  # Re-raises worker errors
+            sizes = [proportional_set_size_mb(pid) for pid in pool.worker_pids]
+            jobs = list(pool.jobs_per_worker)
+        finally:
+            pool.shutdown()
+
+        images_per_hour = args.images / elapsed * 3600
+        baseline = baseline or images_per_hour
+        pss = f"{sum(sizes) / len(sizes):.0f}" if all(size is not None for size in sizes) else "n/a"
+        print(f"{num_workers:>7} {pool.threads_per_worker:>8} {images_per_hour:>10.0f} "
+              f"{images_per_hour / baseline:>7.2f}x {pss:>16} {jobs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_degeneration.py
+# DegenerationDetector replayed on recorded raw outputs: which ones it stops, at which token, how
+# many of the recorded decode steps that saves (loops typically ran to max_new_tokens) and what
+# checking costs per step. Each output is tokenized with the model's tokenizer and
+# fed one token at a time, like generate() would.
+# The entropy signal needs the model's logits, so only the text signals (compression ratio,
+# repeated sentences) are replayed here: an output stopped here is stopped by generate() too.
+#
+# Outputs come from the result cache (raw outputs of --profile) or from a folder of .txt files.
+# Outputs that are stopped are the ones to read: loops are expected, normal text is a false alarm.
+# Needs torch + transformers (downloads only the tokenizer).
+#
+# Usage: python benchmarks/bench_degeneration.py --profile llama-joycaption-beta-one-hf-llava --show 5
+#        python benchmarks/bench_degeneration.py --outputs-dir raw_outputs/ --limit 500
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch
+from transformers import AutoTokenizer
+
+from degeneration import DegenerationDetector, DegenerationSettings
+from result_cache import ResultCache
+from vlm_profiles import VLM_PROFILES
+
+
+def load_outputs(args, profile):
+    if args.outputs_dir:
+        return [path.read_text(encoding="utf-8") for path in sorted(Path(args.outputs_dir).glob("*.txt"))]
+    cache = ResultCache()
+    rows = cache._connection().execute("SELECT output FROM results WHERE model_id = ?", (profile.model_id,))
+    return [output for (output,) in rows]
+
+
+def replay(tokenizer, settings, output):
+    """Returns (tokens in the output, tokens generated when the detector fired or None, reason, seconds checking)."""
+    ids = tokenizer(output, add_special_tokens=False, return_tensors="pt")["input_ids"]
+    detector = DegenerationDetector(tokenizer, 0, settings)
+    checking = 0.0
+    for length in range(1, ids.shape[1] + 1):
+        start = time.perf_counter()
+        stop = bool(detector(ids[:, :length], None)[0])
+        checking += time.perf_counter() - start
+        if stop:
+            return ids.shape[1], length, detector.reasons[0], checking
+    return ids.shape[1], None, "", checking
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Degeneration detector replayed on recorded outputs.")
+    parser.add_argument("--profile", default="ToriiGate-v0.4-7B", choices=list(VLM_PROFILES))
+    parser.add_argument("--outputs-dir", default=None, help="Folder of raw outputs (.txt) instead of the cache.")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--show", type=int, default=3, help="Print the end of this many stopped outputs.")
+    args = parser.parse_args()
+
+    profile = VLM_PROFILES[args.profile]
+    outputs = load_outputs(args, profile)[:args.limit]
+    if not outputs:
+        sys.exit("No recorded outputs: caption some images with the profile first, or pass --outputs-dir.")
+    tokenizer = AutoTokenizer.from_pretrained(profile.model_id, trust_remote_code=True)
+    settings = DegenerationSettings()
+    max_new_tokens = profile.generation_params.get("max_new_tokens", 0)
+
+    lengths, stopped, checks, steps = [], [], 0.0, 0
+    for output in outputs:
+        length, stopped_at, reason, seconds = replay(tokenizer, settings, output)
+        lengths.append(length)
+        checks += seconds
+        steps += stopped_at or length
+        if stopped_at is not None:
+            stopped.append((output, length, stopped_at, reason))
+
+    print(f"{args.profile}: {len(outputs)} outputs, max_new_tokens {max_new_tokens}, "
+          f"{torch.get_num_threads()} threads\n")
+    print(f"tokens per output:        mean {statistics.mean(lengths):.0f}, median {statistics.median(lengths):.0f}, "
+          f"at max_new_tokens {sum(1 for length in lengths if length >= max_new_tokens)}")
+    print(f"outputs stopped:          {len(stopped)}/{len(outputs)}")
+    if stopped:
+        saved = [length - stopped_at for _, length, stopped_at, _ in stopped]
+        print(f"tokens saved per stopped: mean {statistics.mean(saved):.0f}, max {max(saved)} "
+              f"({sum(saved) / sum(lengths):.0%} of all decode steps)")
+    print(f"check cost:               {checks / max(1, steps) * 1e6:.0f} us per decode step")
+    for output, length, stopped_at, reason in stopped[:args.show]:
+        print(f"\n--- stopped at token {stopped_at}/{length}: {reason}\n...{output[-300:]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench_history_search.py
+# Fills a throwaway history database with synthetic generations and measures batched insert
+# throughput and full-text search latency.
+#
+# Usage: python benchmarks/bench_history_search.py --entries 100000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from history_store import HistoryStore
+
+HAIR = ("silver_hair", "black_hair", "blonde_hair", "red_hair", "blue_hair", "pink_hair", "brown_hair")
+PLACES = ("library", "beach", "forest", "classroom", "rooftop", "cafe", "bedroom", "train_station")
+ACTIONS = ("reading", "smiling", "running", "sitting", "sleeping", "eating", "dancing", "waving")
+QUERIES = ("silver", "library reading", "beach smiling", "red_hair", "forest danc", "cafe", "rooftop wav",
+           "nothing_matches_this")
+
+
+def synthetic_entry(rng: random.Random) -> dict:
+    hair, place, action = rng.choice(HAIR), rng.choice(PLACES), rng.choice(ACTIONS)
+    caption = (f"A girl with {hair.replace('_', ' ')} is {action} in the {place.replace('_', ' ')}. "
+               f"The light is soft and the mood is calm, number {rng.randint(0, 10 ** 6)}.")
+    return {
+        "image_path": f"/images/{rng.randint(0, 10 ** 9)}.png",
+        "model_id": "Minthy/ToriiGate-v0.4-7B",
+        "caption": caption,
+        "tags": f"1girl, solo, {hair}, {place}, {action}",
+        "card": f"Name: Unit {rng.randint(0, 9999)}. Loves the {place.replace('_', ' ')} and {action}.",
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="History store insert/search benchmark.")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--searches", type=int, default=50, help="Runs per query.")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as db_dir:
+        store = HistoryStore(db_dir=db_dir, batch_size=1000)
+
+        start = time.perf_counter()
+        for _ in range(args.entries):
+            store.record(store.new_entry_id(), **synthetic_entry(rng))
+        enqueue_s = time.perf_counter() - start
+        store.flush(timeout=600)
+        total_s = time.perf_counter() - start
+        print(f"inserted {store.count()} entries: enqueue {enqueue_s:.2f}s "
+              f"({args.entries / enqueue_s:,.0f}/s on the caller), committed in {total_s:.2f}s "
+              f"({args.entries / total_s:,.0f}/s)")
+
+        print(f"{'query':<24} {'hits':>5} {'p50 ms':>8} {'p95 ms':>8}")
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.searches):
+                t0 = time.perf_counter()
+                hits = store.search(query, limit=50)
+                timings.append((time.perf_counter() - t0) * 1000)
+            print(f"{query:<24} {len(hits):>5} {percentile(timings, 50):>8.2f} {percentile(timings, 95):>8.2f}")
+
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
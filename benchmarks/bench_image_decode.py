@@ -0,0 +1,76 @@
+# bench_image_decode.py
+# Time to first thumbnail and to full-resolution image for a dropped file: the old
+# decode-everything-then-thumbnail path versus image_loader (draft decoding + reduce()).
+#
+# Usage: python benchmarks/bench_image_decode.py --megapixels 12 50 --repeat 3
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from config import MAX_THUMBNAIL_SIZE
+from image_loader import load_image
+
+
+def legacy_load(path):
+    """The pre-worker implementation of process_dropped_image, kept here as the baseline."""
+    image_raw = Image.open(path).convert("RGB")
+    display_image = image_raw.copy()
+    display_image.thumbnail(MAX_THUMBNAIL_SIZE)
+    return image_raw, display_image
+
+
+def make_test_image(path, megapixels):
+    """Writes a noisy gradient (compresses like a photo, not like a flat color)."""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    Image.blend(image, noise, 0.3).save(path)
+    return width, height
+
+
+def time_load(loader, path, repeat):
+    first, full = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        marks = {}
+        if loader is legacy_load:
+            loader(path)
+            marks["thumbnail"] = marks["full"] = time.perf_counter()
+        else:
+            loader(path, MAX_THUMBNAIL_SIZE,
+                   on_thumbnail=lambda thumbnail: marks.setdefault("thumbnail", time.perf_counter()))
+            marks["full"] = time.perf_counter()
+        first.append(marks["thumbnail"] - start)
+        full.append(marks["full"] - start)
+    return min(first), min(full)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dropped image decode benchmark.")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[12, 50])
+    parser.add_argument("--formats", nargs="+", default=["jpg", "png"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'image':>18} {'loader':>8} {'thumbnail (s)':>14} {'full (s)':>10}")
+        for megapixels in args.megapixels:
+            for extension in args.formats:
+                path = os.path.join(tmp, f"test_{megapixels}.{extension}")
+                width, height = make_test_image(path, megapixels)
+                label = f"{width}x{height} {extension}"
+                for name, loader in (("legacy", legacy_load), ("worker", load_image)):
+                    first, full = time_load(loader, path, args.repeat)
+                    print(f"{label:>18} {name:>8} {first:>14.3f} {full:>10.3f}")
+    print("\nThe legacy path ran all of this on the Tk thread; the worker path runs none of it there.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# bench_micro_batching.py
+# Throughput and added latency of ModelHandler's dynamic micro-batching for different batch
+# windows, with concurrent callers hammering one simulated model.
+#
+# The stub model costs --base-ms per generate() plus --per-item-ms per batch row: decoding a
+# 7B VLM is memory-bound, so a batch of 4 costs little more than a single image.
+#
+# Usage: python benchmarks/bench_micro_batching.py --clients 1 8 --windows 0 2 5 10 20
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from model_handler import ModelHandler
+from vlm_profiles import VLMProfile, parse_simple_model_text
+
+
+def make_stub_profile(base_ms, per_item_ms):
+    def generate(model, processor, device, prompt, system_prompt, image_raw, cancel_token=None, **params):
+        time.sleep((base_ms + per_item_ms) / 1000.0)
+        return f"output for {prompt}"
+
+    def generate_batch(model, processor, device, prompts, system_prompt, images, cancel_tokens=None, **params):
+        time.sleep((base_ms + per_item_ms * len(prompts)) / 1000.0)
+        return [f"output for {prompt}" for prompt in prompts]
+
+    return VLMProfile(model_id="stub/batched-model", prompt_caption="", prompt_tags="", system_prompt="",
+                      caption_parser=parse_simple_model_text, tags_parser=parse_simple_model_text,
+                      generation_function=generate, loader_function=lambda model_id, device: (object(), None),
+                      required_vram_gb=0, batch_generation_function=generate_batch)
+
+
+def run(profile, image, clients, requests_per_client, max_batch_size, window_ms):
+    """Closed loop: every client sends its next request as soon as the previous one returns."""
+    handler = ModelHandler(compute_device="cpu", max_batch_size=max_batch_size, batch_wait_ms=window_ms)
+    handler.load_model(profile)
+    latencies = []
+    lock = threading.Lock()
+
+    def client(client_id):
+        for i in range(requests_per_client):
+            prompt = f"client {client_id} request {i}"
+            start = time.perf_counter()
+            output = handler.generate_description(profile, prompt, image, image_hash="-")
+            elapsed = time.perf_counter() - start
+            assert output == f"output for {prompt}", (output, prompt)  # Results went back to the right caller
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(client_id,)) for client_id in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stats = handler.batcher.stats() if handler.batcher else {"mean_batch_size": 1.0, "mean_wait_ms": 0.0}
+    return elapsed, latencies, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dynamic micro-batching benchmark.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--requests", type=int, default=12, help="Requests per client.")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10, 20], help="Batch windows (ms).")
+    parser.add_argument("--max-batch-size", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--base-ms", type=float, default=200.0)
+    parser.add_argument("--per-item-ms", type=float, default=25.0)
+    args = parser.parse_args()
+
+    profile = make_stub_profile(args.base_ms, args.per_item_ms)
+    image = Image.new("RGB", (64, 64))
+    print(f"Stub model: {args.base_ms:.0f} ms + {args.per_item_ms:.0f} ms per batch row\n")
+    print(f"{'clients':>7} {'batch':>6} {'window':>7} {'req/s':>7} {'mean (ms)':>10} {'p95 (ms)':>9} "
+          f"{'mean batch':>11} {'wait (ms)':>10}")
+    for clients in args.clients:
+        configurations = [(1, 0.0)] + [(size, window) for size in args.max_batch_size for window in args.windows]
+        for max_batch_size, window_ms in configurations:
+            elapsed, latencies, stats = run(profile, image, clients, args.requests, max_batch_size, window_ms)
+            latencies.sort()
+            label = "off" if max_batch_size == 1 else str(max_batch_size)
+            print(f"{clients:>7} {label:>6} {window_ms:>7.0f} {len(latencies) / elapsed:>7.2f} "
+                  f"{statistics.mean(latencies) * 1000:>10.0f} "
+                  f"{latencies[int(0.95 * (len(latencies) - 1))] * 1000:>9.0f} "
+                  f"{stats['mean_batch_size']:>11.2f} {stats['mean_wait_ms']:>10.1f}")
+        print()
+    print("wait = time a request spent queued before its batch started (includes waiting for the model).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# bench_ngram_blocking.py
+# NoRepeatNGramBlocker versus transformers' NoRepeatNGramLogitsProcessor on a simulated decode
+# loop: a prompt, then --steps generated tokens per row, Qwen-sized logits. Both see exactly the
+# same sequences, the banned tokens have to match at every step, and the time per step is
+# reported by position in the output (the stock processor slows down as the output grows).
+#
+# Tokens are drawn from a small alphabet most of the time, so there are plenty of repeats to ban.
+# Needs torch + transformers, no model.
+#
+# Usage: python benchmarks/bench_ngram_blocking.py --steps 1024 --batch 1 4 --ngram-size 3
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch
+from transformers import NoRepeatNGramLogitsProcessor
+
+from ngram_blocking import NoRepeatNGramBlocker
+
+BUCKETS = 4
+
+
+def decode(batch, prompt_length, steps, vocab_size, ngram_size, seed):
+    """Token sequences a generate() with n-gram blocking could produce: never a banned token."""
+    generator = torch.Generator().manual_seed(seed)
+    input_ids = torch.randint(0, vocab_size, (batch, prompt_length), generator=generator)
+    blocker = NoRepeatNGramBlocker(ngram_size)
+    for _ in range(steps):
+        scores = torch.rand((batch, vocab_size), generator=generator)
+        scores[:, :50] += 1.0  # A small alphabet wins most of the time: repeats to ban
+        next_tokens = blocker(input_ids, scores).argmax(dim=-1, keepdim=True)
+        input_ids = torch.cat([input_ids, next_tokens], dim=-1)
+    return input_ids
+
+
+def replay(processor, input_ids, prompt_length, vocab_size):
+    """Runs a processor over every step of the sequences, returns (per-step seconds, banned masks)."""
+    times, masks = [], []
+    scores = torch.zeros((input_ids.shape[0], vocab_size))
+    for length in range(prompt_length, input_ids.shape[1]):
+        start = time.perf_counter()
+        output = processor(input_ids[:, :length], scores)
+        times.append(time.perf_counter() - start)
+        masks.append(torch.isinf(output).nonzero())
+    return times, masks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental n-gram blocking benchmark.")
+    parser.add_argument("--steps", type=int, default=1024)
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--prompt-length", type=int, default=300)
+    parser.add_argument("--vocab-size", type=int, default=151_646)  # Qwen2-VL
+    parser.add_argument("--ngram-size", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.steps} steps, prompt {args.prompt_length} tokens, vocab {args.vocab_size}, "
+          f"n={args.ngram_size}, {torch.get_num_threads()} threads\n")
+    edges = [args.steps * index // BUCKETS for index in range(BUCKETS + 1)]
+    header = " ".join(f"{f'{edges[i]}-{edges[i + 1]}':>10}" for i in range(BUCKETS))
+    print(f"{'':>18} us per step, by position in the output")
+    print(f"{'batch':>5} {'processor':>12} {header} {'total ms':>9} {'identical':>9}")
+    for batch in args.batch:
+        input_ids = decode(batch, args.prompt_length, args.steps, args.vocab_size, args.ngram_size, seed=batch)
+        results = {}
+        for name, processor in (("stock", NoRepeatNGramLogitsProcessor(args.ngram_size)),
+                                ("incremental", NoRepeatNGramBlocker(args.ngram_size))):
+            results[name] = replay(processor, input_ids, args.prompt_length, args.vocab_size)
+        stock_masks, incremental_masks = results["stock"][1], results["incremental"][1]
+        identical = all(torch.equal(a, b) for a, b in zip(stock_masks, incremental_masks))
+        banned = sum(len(mask) for mask in stock_masks)
+        for name, (times, _) in results.items():
+            buckets = " ".join(f"{sum(times[edges[i]:edges[i + 1]]) / (edges[i + 1] - edges[i]) * 1e6:>10.0f}"
+                               for i in range(BUCKETS))
+            print(f"{batch:>5} {name:>12} {buckets} {sum(times) * 1000:>9.1f} "
+                  f"{('yes' if identical else 'NO'):>9}")
+        print(f"{'':>5} {'':>12} {banned} tokens banned over the run\n")
+        if not identical:
+            sys.exit("Banned tokens differ from the stock processor.")
+
+
+if __name__ == "__main__":
+    main()
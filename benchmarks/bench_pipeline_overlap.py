@@ -0,0 +1,87 @@
+# bench_pipeline_overlap.py
+# Serial vs overlapped caption queue: the VLM stage is simulated with a sleep (a GPU that is
+# busy for --vlm-seconds per image), the API stage does two real HTTP calls (card, SD prompt)
+# against the local OpenAI stub server.
+#
+# Usage: python benchmarks/bench_pipeline_overlap.py --images 12 --vlm-seconds 0.4 --api-latency-ms 250
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from caption_queue import CaptionJob, CaptionJobQueue, FINISHED_STATES
+from openai_stub_server import StubConfig, StubServer
+
+
+def chat(base_url, prompt):
+    """One chat completion, plain urllib so the benchmark runs without the openai package."""
+    body = json.dumps({"model": "stub", "messages": [{"role": "user", "content": prompt}]}).encode("utf-8")
+    request = urllib.request.Request(f"{base_url}/chat/completions", data=body,
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())["choices"][0]["message"]["content"]
+
+
+def run(n_images, vlm_seconds, base_url, overlapped, handoff_size):
+    def caption(job):
+        time.sleep(vlm_seconds)  # caption + tags on the local model
+        return f"caption of {job.path}", "1girl, solo"
+
+    def api_stage(job):
+        card = chat(base_url, f"card for {job.caption}")
+        return card, chat(base_url, f"sd prompt for {card}")
+
+    def serial_job(job):
+        result = caption(job)
+        job.caption, job.tags = result
+        api_stage(job)
+        return result
+
+    finished = threading.Semaphore(0)
+    on_event = lambda event_type, job: finished.release() \
+        if event_type == "updated" and job.status in FINISHED_STATES else None
+
+    job_queue = CaptionJobQueue(process_job=caption if overlapped else serial_job, on_event=on_event,
+                                post_process=api_stage if overlapped else None, handoff_size=handoff_size)
+    api_request = {"stub": True} if overlapped else None
+    start = time.perf_counter()
+    for i in range(n_images):
+        job_queue.add_job(CaptionJob(path=f"image_{i:03d}.png", prompt="describe", api_request=api_request))
+    for _ in range(n_images):
+        finished.acquire()
+    wall = time.perf_counter() - start
+    stats = job_queue.stats()
+    job_queue.shutdown()
+    return wall, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overlapped VLM/API pipeline benchmark.")
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--vlm-seconds", type=float, default=0.4)
+    parser.add_argument("--api-latency-ms", type=float, default=250.0)
+    parser.add_argument("--handoff-size", type=int, default=2)
+    args = parser.parse_args()
+
+    config = StubConfig(latency_ms=args.api_latency_ms, tokens_per_second=0)
+    with StubServer(config=config) as server:
+        print(f"{args.images} images, VLM {args.vlm_seconds:.2f} s/image, "
+              f"API 2 calls x {args.api_latency_ms:.0f} ms/image\n")
+        print(f"{'mode':>10} {'wall (s)':>9} {'img/min':>8} {'VLM busy':>9} {'API busy':>9}")
+        for name, overlapped in (("serial", False), ("pipelined", True)):
+            wall, stats = run(args.images, args.vlm_seconds, server.base_url, overlapped, args.handoff_size)
+            stages = stats["stages"]
+            # In serial mode the API calls run inside the VLM stage, the GPU idles while they wait
+            vlm_busy = args.images * args.vlm_seconds / wall
+            api_busy = stages["api"]["utilisation"] if overlapped else 1.0 - vlm_busy
+            print(f"{name:>10} {wall:>9.2f} {args.images * 60 / wall:>8.1f} {vlm_busy:>9.0%} {api_busy:>9.0%}")
+
+
+if __name__ == "__main__":
+    main()
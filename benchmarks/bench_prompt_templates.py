@@ -0,0 +1,73 @@
+# bench_prompt_templates.py
+# Microbenchmark of the prompt template engine: old read-from-disk + chained str.replace
+# versus the compiled, mtime-cached single-pass render in prompts.py.
+#
+# Usage: python benchmarks/bench_prompt_templates.py --caption-kb 4 64 512
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))  # prompts/ is resolved from cwd
+
+import prompts
+from config import CARD_CHAR_TO_ANALYZE, CARD_USER_ROLE, SD_CHAR_TO_ANALYZE, DEFAULT_CARD_TEMPLATE, \
+    DEFAULT_SD_TEMPLATE
+
+
+def legacy_card_prompt(template_name, character_to_analyze, user_role, user_placeholder, caption, tags):
+    """The pre-engine implementation, kept here as the baseline."""
+    template = prompts._load_prompt_template(f"{template_name}_character_card.txt")
+    prompt = template.replace("[[[character_to_analyze]]]", character_to_analyze)
+    prompt = prompt.replace("[[[user_role]]]", user_role)
+    prompt = prompt.replace("[[[user_placeholder]]]", user_placeholder)
+    prompt = prompt.replace("[[[caption]]]", caption)
+    prompt = prompt.replace("[[[tags]]]", tags)
+    return prompt
+
+
+def legacy_sd_prompt(template_name, character_to_analyze, caption, tags, character_card):
+    template = prompts._load_prompt_template(f"{template_name}_stable_diffusion.txt")
+    prompt = template.replace("[[[character_to_analyze]]]", character_to_analyze)
+    prompt = prompt.replace("[[[caption]]]", caption)
+    prompt = prompt.replace("[[[tags]]]", tags)
+    prompt = prompt.replace("[[[character_card]]]", character_card)
+    return prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt template render microbenchmark.")
+    parser.add_argument("--caption-kb", type=int, nargs="+", default=[4, 64, 512])
+    parser.add_argument("--number", type=int, default=200, help="Renders per timing run.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tags = "1girl, solo, silver_hair, long_hair, sitting, book, library, window, rain, indoors"
+    sentence = "A young woman with silver hair sits by a rainy window in an old library, reading. "
+
+    print(f"{'caption':>8} {'template':>9} {'legacy us':>10} {'compiled us':>12} {'speedup':>8}")
+    for kb in args.caption_kb:
+        caption = (sentence * (kb * 1024 // len(sentence) + 1))[:kb * 1024]
+        card = caption[: len(caption) // 2]
+
+        card_kwargs = dict(template_name=DEFAULT_CARD_TEMPLATE, character_to_analyze=CARD_CHAR_TO_ANALYZE,
+                           user_role=CARD_USER_ROLE, user_placeholder="{{user}}", caption=caption, tags=tags)
+        sd_kwargs = dict(template_name=DEFAULT_SD_TEMPLATE, character_to_analyze=SD_CHAR_TO_ANALYZE,
+                         caption=caption, tags=tags, character_card=card)
+
+        cases = (
+            ("card", legacy_card_prompt, prompts.generate_character_card_prompt, card_kwargs),
+            ("sd", legacy_sd_prompt, prompts.generate_stable_diffusion_prompt, sd_kwargs),
+        )
+        for name, legacy, compiled, kwargs in cases:
+            assert legacy(**kwargs) == compiled(**kwargs), f"{name} output differs from the legacy renderer"
+            legacy_s = min(timeit.repeat(lambda: legacy(**kwargs), number=args.number, repeat=args.repeat))
+            compiled_s = min(timeit.repeat(lambda: compiled(**kwargs), number=args.number, repeat=args.repeat))
+            legacy_us = legacy_s / args.number * 1e6
+            compiled_us = compiled_s / args.number * 1e6
+            print(f"{kb:>6}KB {name:>9} {legacy_us:>10.1f} {compiled_us:>12.1f} {legacy_us / compiled_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
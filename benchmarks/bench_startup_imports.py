@@ -0,0 +1,74 @@
+# bench_startup_imports.py
+# Startup budget guard: imports the GUI module in a fresh interpreter under `-X importtime`,
+# prints the slowest imports, and fails (exit code 1) if a heavy library sneaks back into
+# startup or the total goes over budget.
+#
+# Usage: python benchmarks/bench_startup_imports.py --budget-ms 800
+import argparse
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Only imported on first use (or by the background warm-up once the window is shown)
+HEAVY_MODULES = ("torch", "torchvision", "transformers", "qwen_vl_utils", "openai", "tiktoken", "requests",
+                 "sympy", "numpy", "huggingface_hub")
+
+
+def measure_imports(module):
+    """
+    Imports `module` in a fresh interpreter with -X importtime.
+
+    Returns:
+        list: (self_us, cumulative_us, depth, name) per imported module, in import order.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+        sys.exit(f"Could not import {module}, is the environment complete?")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget of the GUI startup.")
+    parser.add_argument("--module", default="plotcaption")
+    parser.add_argument("--budget-ms", type=float, default=800.0)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    entries = measure_imports(args.module)
+    total_ms = sum(self_us for self_us, _, _, _ in entries) / 1000
+
+    # Top-level imports are where the time is decided, nested ones are listed by their parent
+    print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+    slowest = sorted(entries, key=lambda entry: entry[1], reverse=True)[:args.top]
+    for self_us, cumulative_us, depth, name in slowest:
+        print(f"{cumulative_us / 1000:>16.1f} {self_us / 1000:>10.1f}  {'  ' * depth}{name}")
+
+    heavy = sorted({name for _, _, _, name in entries if name.split(".")[0] in HEAVY_MODULES})
+    print(f"\n{len(entries)} modules imported in {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: startup imports take {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
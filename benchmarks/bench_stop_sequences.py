@@ -0,0 +1,90 @@
+# bench_stop_sequences.py
+# Decode tokens saved per image by a profile's stop_sequences (ToriiGate: </tags>), replayed on
+# recorded raw tag outputs. Each output is tokenized with the model's tokenizer and fed to
+# StopSequenceCriteria one token at a time, like generate() would. Everything after the step
+# where it fires is a decode step the model no longer runs. The parsed tags must stay the same.
+#
+# Outputs come from the result cache (raw outputs of --profile containing the stop sequence, as
+# written before the stop existed) or from a folder of .txt files.
+# Needs torch + transformers (downloads only the tokenizer).
+#
+# Usage: python benchmarks/bench_stop_sequences.py --profile ToriiGate-v0.4-7B
+#        python benchmarks/bench_stop_sequences.py --outputs-dir raw_outputs/ --limit 500
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import torch
+from transformers import AutoTokenizer
+
+from result_cache import ResultCache
+from vlm_profiles import VLM_PROFILES, StopSequenceCriteria
+
+
+def load_outputs(args, profile):
+    if args.outputs_dir:
+        return [path.read_text(encoding="utf-8") for path in sorted(Path(args.outputs_dir).glob("*.txt"))]
+    cache = ResultCache()
+    rows = cache._connection().execute("SELECT output FROM results WHERE model_id = ?", (profile.model_id,))
+    # Only the tags pass writes the stop sequence, captions never contain it
+    return [output for (output,) in rows if any(sequence in output for sequence in profile.stop_sequences)]
+
+
+def replay(tokenizer, profile, output):
+    """Returns (tokens in the full output, tokens generated when the criteria fired, seconds spent checking)."""
+    ids = tokenizer(output, add_special_tokens=False, return_tensors="pt")["input_ids"]
+    criteria = StopSequenceCriteria(tokenizer, profile.stop_sequences, prompt_length=0)
+    checking = 0.0
+    for length in range(1, ids.shape[1] + 1):
+        start = time.perf_counter()
+        stop = bool(criteria(ids[:, :length], None)[0])
+        checking += time.perf_counter() - start
+        if stop:
+            return ids.shape[1], length, checking
+    return ids.shape[1], ids.shape[1], checking
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens saved by profile stop sequences.")
+    parser.add_argument("--profile", default="ToriiGate-v0.4-7B", choices=list(VLM_PROFILES))
+    parser.add_argument("--outputs-dir", default=None, help="Folder of raw outputs (.txt) instead of the cache.")
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+
+    profile = VLM_PROFILES[args.profile]
+    if not profile.stop_sequences:
+        sys.exit(f"{args.profile} declares no stop_sequences.")
+    outputs = load_outputs(args, profile)[:args.limit]
+    if not outputs:
+        sys.exit("No recorded outputs: caption some images with the profile first, or pass --outputs-dir.")
+    tokenizer = AutoTokenizer.from_pretrained(profile.model_id, trust_remote_code=True)
+
+    full_lengths, stopped_lengths, checks, changed = [], [], 0.0, 0
+    for output in outputs:
+        full, stopped, seconds = replay(tokenizer, profile, output)
+        full_lengths.append(full)
+        stopped_lengths.append(stopped)
+        checks += seconds
+        truncated = tokenizer.decode(tokenizer(output, add_special_tokens=False)["input_ids"][:stopped])
+        if profile.tags_parser(truncated).get("output") != profile.tags_parser(output).get("output"):
+            changed += 1
+
+    saved = [full - stopped for full, stopped in zip(full_lengths, stopped_lengths)]
+    print(f"{args.profile}: {len(outputs)} outputs, stop sequences {profile.stop_sequences}, "
+          f"{torch.get_num_threads()} threads\n")
+    print(f"tokens per image without stop: mean {statistics.mean(full_lengths):.0f}, "
+          f"median {statistics.median(full_lengths):.0f}")
+    print(f"tokens saved per image:        mean {statistics.mean(saved):.0f}, median {statistics.median(saved):.0f}, "
+          f"max {max(saved)} ({sum(saved) / sum(full_lengths):.0%} of all decode steps)")
+    print(f"outputs stopped early:         {sum(1 for value in saved if value > 0)}/{len(outputs)}")
+    print(f"check cost:                    {checks / sum(stopped_lengths) * 1e6:.0f} us per decode step")
+    print(f"parsed tags changed:           {changed}")
+
+
+if __name__ == "__main__":
+    main()
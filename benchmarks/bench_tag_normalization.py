@@ -0,0 +1,74 @@
+# bench_tag_normalization.py
+# Throughput of TagNormalizer on a JSONL manifest of raw VLM tag lists (spaces, duplicates,
+# aliases, prefixes, invented tags), against a synthetic Danbooru-sized vocabulary.
+#
+# Usage: python benchmarks/bench_tag_normalization.py --records 100000 --tags 300000
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from bench_tag_vocabulary import write_tag_files
+from tag_normalizer import TagNormalizer
+from tag_vocabulary import load_tag_vocabulary
+
+
+def write_manifest(path, names, n_records, seed=1):
+    """Tag lists the way models write them: mixed spelling, repeats, aliases and made-up tags."""
+    rng = random.Random(seed)
+    popular = names[:5000]  # Real outputs reuse a small set of common tags
+    with open(path, "w", encoding="utf-8") as file:
+        for i in range(n_records):
+            tags = []
+            for _ in range(rng.randint(15, 40)):
+                tag = rng.choice(popular) if rng.random() < 0.9 else rng.choice(names)
+                roll = rng.random()
+                if roll < 0.3:
+                    tag = tag.replace("_", " ")
+                elif roll < 0.4:
+                    tag = tag.title()
+                elif roll < 0.45:
+                    tag = f"{tag}_alias0"
+                elif roll < 0.5:
+                    tag = f"artist:{tag}"
+                elif roll < 0.55:
+                    tag = f"invented_{rng.randint(0, 999)}"
+                tags.append(tag)
+            tags.extend(rng.sample(tags, 3))  # Duplicates
+            file.write(json.dumps({"image": f"img_{i:06d}.png", "tags": ", ".join(tags)}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag normalization throughput on a JSONL manifest.")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--tags", type=int, default=300000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = write_tag_files(directory, args.tags)
+        vocabulary = load_tag_vocabulary(directory)
+        manifest = os.path.join(directory, "manifest.jsonl")
+        write_manifest(manifest, names, args.records)
+        output = os.path.join(directory, "manifest.normalized.jsonl")
+
+        for label, normalizer in (("no vocabulary", TagNormalizer()),
+                                  ("vocabulary", TagNormalizer(vocabulary)),
+                                  ("vocabulary, drop unknown", TagNormalizer(vocabulary, drop_unknown=True))):
+            start = time.perf_counter()
+            written = normalizer.normalize_manifest(manifest, output)
+            elapsed = time.perf_counter() - start
+            print(f"{label:>26}: {written} records in {elapsed:.2f} s ({written / elapsed:,.0f} lists/s)")
+
+        with open(manifest, encoding="utf-8") as before, open(output, encoding="utf-8") as after:
+            print("\nbefore:", json.loads(before.readline())["tags"][:150], "...")
+            print("after: ", json.loads(after.readline())["tags"][:150], "...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# bench_tagged_output.py
+# TaggedOutputParser versus the regexes parse_toriigate_tags used to run on the finished output:
+#   - whole output: one feed() versus two re.search() calls
+#   - streamed: the output fed in --chunk-chars pieces (about a token each), the way a streamer or
+#     a stopping criteria sees it, versus re-running the regexes on the text so far at every chunk
+#     (what finding a section "as soon as it closes" costs without an incremental parser)
+# Both have to find the same sections. The largest buffer the parser held is reported too.
+#
+# Outputs come from the result cache (raw ToriiGate outputs), a folder of .txt files, or are
+# synthetic (--synthetic N). Only the standard library is needed.
+#
+# Usage: python benchmarks/bench_tagged_output.py --synthetic 200
+#        python benchmarks/bench_tagged_output.py --outputs-dir raw_outputs/ --chunk-chars 4
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from result_cache import ResultCache
+from tagged_output import TaggedOutputParser
+from vlm_profiles import TORIIGATE_SECTIONS, VLM_PROFILES
+
+PATTERNS = {name: f"<{name}>(.*?)</{name}>" for name in TORIIGATE_SECTIONS}
+
+
+def synthetic_outputs(count, seed=0):
+    generator = random.Random(seed)
+    words = ["hair", "eyes", "dress", "smile", "outdoors", "sky", "sitting", "holding", "flower", "ribbon"]
+    outputs = []
+    for _ in range(count):
+        analysis = " ".join(generator.choice(words) for _ in range(generator.randint(100, 400)))
+        tags = ", ".join(f"{generator.choice(words)} {generator.choice(words)}" for _ in range(generator.randint(20, 80)))
+        description = " ".join(generator.choice(words) for _ in range(generator.randint(30, 120)))
+        outputs.append(f"<analysis>{analysis}</analysis>\n<tags>{tags}</tags>\n"
+                       f"<convenient_description>{description}</convenient_description>")
+    return outputs
+
+
+def load_outputs(args):
+    if args.synthetic:
+        return synthetic_outputs(args.synthetic)
+    if args.outputs_dir:
+        return [path.read_text(encoding="utf-8") for path in sorted(Path(args.outputs_dir).glob("*.txt"))]
+    model_id = VLM_PROFILES["ToriiGate-v0.4-7B"].model_id
+    rows = ResultCache()._connection().execute("SELECT output FROM results WHERE model_id = ?", (model_id,))
+    return [output for (output,) in rows if "<tags>" in output]
+
+
+def regex_fields(text):
+    fields = {}
+    for name, pattern in PATTERNS.items():
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            fields[name] = match.group(1).strip()
+    return fields
+
+
+def parser_fields(chunks):
+    """Returns (fields, largest buffer in characters)."""
+    parser = TaggedOutputParser(TORIIGATE_SECTIONS)
+    fields, largest = {}, 0
+    for chunk in chunks:
+        for name, content in parser.feed(chunk):
+            fields.setdefault(name, content)
+        largest = max(largest, len(parser.pending))
+    return fields, largest
+
+
+def streamed_regex_fields(chunks):
+    text, fields = "", {}
+    for chunk in chunks:
+        text += chunk
+        for name, value in regex_fields(text).items():
+            fields.setdefault(name, value)
+    return fields
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental tagged output parser benchmark.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Parse this many synthetic outputs.")
+    parser.add_argument("--outputs-dir", default=None, help="Folder of raw outputs (.txt) instead of the cache.")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="Characters per streamed chunk.")
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+
+    outputs = load_outputs(args)[:args.limit]
+    if not outputs:
+        sys.exit("No recorded outputs: tag some images with ToriiGate first, or pass --outputs-dir / --synthetic.")
+    totals = {"regex": 0.0, "parser": 0.0, "streamed regex": 0.0, "streamed parser": 0.0}
+    mismatches, largest_buffer, characters = 0, 0, 0
+    for output in outputs:
+        chunks = [output[index:index + args.chunk_chars] for index in range(0, len(output), args.chunk_chars)]
+        reference, seconds = timed(regex_fields, output)
+        totals["regex"] += seconds
+        (whole, _), seconds = timed(parser_fields, [output])
+        totals["parser"] += seconds
+        streamed_reference, seconds = timed(streamed_regex_fields, chunks)
+        totals["streamed regex"] += seconds
+        (streamed, largest), seconds = timed(parser_fields, chunks)
+        totals["streamed parser"] += seconds
+        mismatches += sum(1 for fields in (whole, streamed, streamed_reference) if fields != reference)
+        largest_buffer = max(largest_buffer, largest)
+        characters = max(characters, len(output))
+
+    print(f"{len(outputs)} outputs, up to {characters} characters, streamed in {args.chunk_chars}-character chunks\n")
+    for name, seconds in totals.items():
+        print(f"{name:>16}: {seconds / len(outputs) * 1e6:>10.0f} us per output")
+    print(f"\nlargest parser buffer: {largest_buffer} characters (the longest section)")
+    print(f"mismatches:            {mismatches}")
+    if mismatches:
+        sys.exit("The parser and the regexes found different sections.")
+
+
+if __name__ == "__main__":
+    main()
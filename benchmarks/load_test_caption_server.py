@@ -0,0 +1,152 @@
+# load_test_caption_server.py
+# Load test of caption_server: N concurrent clients uploading images over keep-alive
+# connections, reporting throughput and latency percentiles per concurrency level.
+#
+# Without --url, an in-process server is started with a stub profile whose "model" sleeps
+# --generation-ms per pass, so the HTTP/queueing overhead can be measured without a GPU.
+#
+# Usage: python benchmarks/load_test_caption_server.py --concurrency 1 2 4 8 --requests 40
+#        python benchmarks/load_test_caption_server.py --url http://127.0.0.1:8090 --profile ToriiGate-v0.4-7B
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit, urlencode
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from caption_server import CaptionServer, CaptionService
+from result_cache import ResultCache
+from vlm_profiles import VLMProfile, parse_simple_model_text, parse_toriigate_tags
+
+STUB_PROFILE = "stub"
+
+
+def make_stub_profile(generation_ms):
+    """A profile with the GUI's parsers but a sleeping fake model."""
+
+    def generate(model, processor, device, prompt, system_prompt, image_raw, cancel_token=None, **params):
+        time.sleep(generation_ms / 1000.0)
+        return "<tags>1girl, Smile, long hair, smile, looking at viewer</tags>" if "tags" in prompt \
+            else "A girl with long hair smiles at the viewer."
+
+    return VLMProfile(model_id="stub/sleeping-model", prompt_caption="Describe the image.",
+                      prompt_tags="Write the booru tags inside <tags>.", system_prompt="",
+                      caption_parser=parse_simple_model_text, tags_parser=parse_toriigate_tags,
+                      generation_function=generate, loader_function=lambda model_id, device: (object(), None),
+                      required_vram_gb=0)
+
+
+def make_images(count, size=512, seed=0):
+    """Distinct PNGs, so requests don't hit the result cache of each other."""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+        image.putpixel((rng.randrange(size), rng.randrange(size)), (0, 0, 0))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def run_level(base_url, endpoint, profile, images, concurrency, n_requests, force):
+    """Runs n_requests spread over `concurrency` client threads, one connection each."""
+    url = urlsplit(base_url)
+    query = urlencode({"profile": profile, "force": "1" if force else "0"})
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(n_requests))
+
+    def client():
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            start = time.perf_counter()
+            try:
+                connection.request("POST", f"/{endpoint}?{query}", body=images[index % len(images)],
+                                   headers={"Content-Type": "image/png"})
+                response = connection.getresponse()
+                payload = json.loads(response.read())
+                if response.status != 200:
+                    raise RuntimeError(f"{response.status}: {payload.get('error')}")
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                connection.close()
+                connection = http.client.HTTPConnection(url.hostname, url.port, timeout=600)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption server load test.")
+    parser.add_argument("--url", default=None, help="Running server to test, an in-process stub server if omitted.")
+    parser.add_argument("--profile", default=STUB_PROFILE)
+    parser.add_argument("--endpoint", default="caption_tags", choices=("caption", "tags", "caption_tags"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=40, help="Requests per concurrency level.")
+    parser.add_argument("--generation-ms", type=float, default=50.0, help="Stub model time per pass.")
+    parser.add_argument("--cache", action="store_true", help="Allow result cache hits (force=0).")
+    args = parser.parse_args()
+
+    images = make_images(args.requests)
+    server = None
+    if args.url is None:
+        cache_dir = tempfile.mkdtemp()
+        service = CaptionService(profiles={STUB_PROFILE: make_stub_profile(args.generation_ms)},
+                                 compute_device="cpu", result_cache=ResultCache(db_dir=cache_dir))
+        server = CaptionServer(service, port=0).start()
+        print(f"In-process server with a stub model ({args.generation_ms:.0f} ms per pass)")
+    base_url = args.url or server.base_url
+
+    print(f"{args.requests} x POST /{args.endpoint} per level, {len(images[0]) // 1024} KB PNG uploads\n")
+    print(f"{'clients':>8} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'max (ms)':>9} {'errors':>7}")
+    try:
+        for concurrency in args.concurrency:
+            elapsed, latencies, errors = run_level(base_url, args.endpoint, args.profile, images, concurrency,
+                                                   args.requests, force=not args.cache)
+            if latencies:
+                print(f"{concurrency:>8} {len(latencies) / elapsed:>8.2f} "
+                      f"{statistics.median(latencies) * 1000:>9.0f} {percentile(latencies, 0.95) * 1000:>9.0f} "
+                      f"{max(latencies) * 1000:>9.0f} {len(errors):>7}")
+            else:
+                print(f"{concurrency:>8} {'-':>8} {'-':>9} {'-':>9} {'-':>9} {len(errors):>7}")
+            if errors:
+                print(f"         first error: {errors[0]}")
+    finally:
+        if server is not None:
+            server.stop()
+    print("\nThe model runs one generate() at a time: req/s stays flat with more clients and latency grows, "
+          "that is the queueing the server adds.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# openai_stub_server.py
+# A tiny local stand-in for an OpenAI-compatible endpoint, so ai_utils and the Generate tab
+# can be exercised and measured fully offline, without burning a paid API key.
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOREM_WORDS = ("she", "smiles", "softly", "while", "the", "rain", "taps", "against", "window", "of",
+               "old", "library", "her", "silver", "hair", "glows", "in", "lamp", "light", "and")
+
+
+class StubConfig:
+    """
+    Behaviour knobs of the stub server. All of them can be changed while the server runs.
+    """
+
+    def __init__(self, latency_ms=50.0, tokens_per_second=200.0, completion_tokens=64,
+                 error_rate=0.0, error_status=500, stream_chunk_tokens=4, seed=None):
+        """
+        Args:
+            latency_ms (float): Fixed delay before the first token (time to first byte).
+            tokens_per_second (float): Simulated decode speed, 0 means instant.
+            completion_tokens (int): Default length of each answer when max_tokens is not given.
+            error_rate (float): Probability (0.0-1.0) that a request fails with error_status.
+            error_status (int): HTTP status used for injected errors (e.g. 429, 500, 503).
+            stream_chunk_tokens (int): How many tokens go in every streamed SSE chunk.
+            seed (int): Optional seed for reproducible error injection.
+        """
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_chunk_tokens = max(1, stream_chunk_tokens)
+        self.random = random.Random(seed)
+
+
+class StubStats:
+    """
+    Thread-safe counters, used by benchmarks to verify connection reuse and error handling.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.errors = 0
+            self.streamed = 0
+            self.completion_tokens = 0
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "requests": self.requests,
+                "errors": self.errors,
+                "streamed": self.streamed,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the socket open between requests, one handler instance = one TCP connection
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.stats.add(connections=1)
+
+    def log_message(self, format, *args):
+        # Silence the default per-request stderr logging, benchmarks would drown in it
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.server.stats.add(requests=1)
+            self._send_json(200, {"object": "list",
+                                  "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        request = self._read_json()
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        config = self.server.config
+        stats = self.server.stats
+        stats.add(requests=1)
+
+        # Time to first byte, the "thinking" part of a real endpoint
+        if config.latency_ms > 0:
+            time.sleep(config.latency_ms / 1000.0)
+
+        if config.error_rate > 0 and config.random.random() < config.error_rate:
+            stats.add(errors=1)
+            self._send_json(config.error_status, {"error": {"message": "Injected stub error",
+                                                            "type": "stub_error",
+                                                            "code": config.error_status}})
+            return
+
+        n_tokens = int(request.get("max_tokens") or config.completion_tokens)
+        model = request.get("model", "stub-model")
+        words = [LOREM_WORDS[i % len(LOREM_WORDS)] for i in range(n_tokens)]
+        stats.add(completion_tokens=n_tokens)
+
+        if request.get("stream"):
+            stats.add(streamed=1)
+            self._stream_completion(model, words)
+        else:
+            self._sleep_for_tokens(n_tokens)
+            self._send_json(200, {
+                "id": f"chatcmpl-stub-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "length" if request.get("max_tokens") else "stop",
+                }],
+                "usage": {"prompt_tokens": _count_prompt_tokens(request),
+                          "completion_tokens": n_tokens,
+                          "total_tokens": _count_prompt_tokens(request) + n_tokens},
+            })
+
+    def _sleep_for_tokens(self, n_tokens: int):
+        tps = self.server.config.tokens_per_second
+        if tps > 0:
+            time.sleep(n_tokens / tps)
+
+    def _stream_completion(self, model: str, words: list):
+        """Sends the answer as Server-Sent Events, chunked transfer so keep-alive still works."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        created = int(time.time())
+        chunk_id = f"chatcmpl-stub-{time.time_ns()}"
+        step = self.server.config.stream_chunk_tokens
+        for start in range(0, len(words), step):
+            piece = words[start:start + step]
+            self._sleep_for_tokens(len(piece))
+            text = (" " if start else "") + " ".join(piece)
+            self._write_event({"id": chunk_id, "object": "chat.completion.chunk", "created": created,
+                               "model": model,
+                               "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]})
+
+        self._write_event({"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                           "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")  # Terminating zero-length chunk
+
+    def _write_event(self, payload: dict):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _count_prompt_tokens(request: dict) -> int:
+    """Rough whitespace token count of the prompt, good enough for a usage block."""
+    total = 0
+    for message in request.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += len(str(content).split())
+    return total
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server speaking the subset of the OpenAI API used by ai_utils.
+    """
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config: StubConfig = None, verbose=False):
+        """
+        Args:
+            host (str): Interface to bind, loopback by default so nothing leaves the machine.
+            port (int): Port to bind, 0 picks a free one (see base_url).
+            config (StubConfig): Behaviour of the server, defaults are used if None.
+            verbose (bool): Log every request to stderr.
+        """
+        super().__init__((host, port), _StubHandler)
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serves in a background daemon thread and returns immediately."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the listening socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--stream-chunk-tokens", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    config = StubConfig(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second,
+                        completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                        error_status=args.error_status, stream_chunk_tokens=args.stream_chunk_tokens)
+    server = StubServer(args.host, args.port, config=config, verbose=args.verbose)
+    print(f"Stub OpenAI server listening on {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stats: {server.stats.snapshot()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# stress_settings_persistence.py
+# Stress test of the write-behind settings store: simulates sliders being dragged as fast as
+# Tk can fire events, while a reader keeps parsing the file to prove it is never truncated.
+#
+# Usage: python benchmarks/stress_settings_persistence.py --seconds 3 --rate 2000
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from persistence_manager import PersistenceManager
+
+SLIDERS = ("temperature", "frequency_penalty", "presence_penalty")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rapid slider change stress test for PersistenceManager.")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--rate", type=float, default=2000.0, help="Slider events per second (0 = unthrottled).")
+    parser.add_argument("--debounce", type=float, default=0.25)
+    parser.add_argument("--max-delay", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as settings_dir:
+        manager = PersistenceManager(settings_dir=settings_dir, debounce_seconds=args.debounce,
+                                     max_delay_seconds=args.max_delay)
+        manager.load_settings()
+        path = manager.get_settings_path()
+
+        stop = threading.Event()
+        reads = {"ok": 0, "corrupt": 0}
+
+        def reader():
+            # Hammers the file like a crash-recovery load would, it must always parse
+            while not stop.is_set():
+                try:
+                    with open(path, 'r') as f:
+                        json.loads(f.read())
+                    reads["ok"] += 1
+                except FileNotFoundError:
+                    pass
+                except json.JSONDecodeError:
+                    reads["corrupt"] += 1
+
+        reader_thread = threading.Thread(target=reader, daemon=True)
+        reader_thread.start()
+
+        events, slowest_call = 0, 0.0
+        interval = 1.0 / args.rate if args.rate > 0 else 0.0
+        value = 0.0
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            value = round((value + 0.01) % 2.0, 2)
+            start = time.perf_counter()
+            manager.update_setting(SLIDERS[events % len(SLIDERS)], value)
+            slowest_call = max(slowest_call, time.perf_counter() - start)
+            events += 1
+            if interval:
+                time.sleep(interval)
+
+        final_expected = manager.load_settings()
+        flush_start = time.perf_counter()
+        saved = manager.close()
+        flush_ms = (time.perf_counter() - flush_start) * 1000
+        stop.set()
+        reader_thread.join()
+
+        with open(path, 'r') as f:
+            on_disk = json.load(f)
+        leftovers = [name for name in os.listdir(settings_dir) if name.endswith(".tmp")]
+
+        print(f"slider events:        {events}")
+        print(f"file writes:          {manager.writes} ({events / max(1, manager.writes):.0f} events per write)")
+        print(f"slowest UI call:      {slowest_call * 1e6:.1f} us")
+        print(f"shutdown flush:       {flush_ms:.1f} ms (saved={saved})")
+        print(f"concurrent reads:     {reads['ok']} ok, {reads['corrupt']} corrupt")
+        print(f"final state on disk:  {'matches' if on_disk == final_expected else 'MISMATCH'}")
+        print(f"leftover temp files:  {len(leftovers)}")
+
+        if reads["corrupt"] or on_disk != final_expected or leftovers or not saved:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
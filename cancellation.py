@@ -0,0 +1,31 @@
+# cancellation.py
+# Cooperative cancellation of local generations. The UI (or the caption queue) flips a token,
+# model.generate() checks it after every decoded token through a StoppingCriteria.
+import threading
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation was stopped through its CancellationToken."""
+
+
+class CancellationToken:
+    """
+    Thread-safe "please stop" flag shared between the thread asking and the generating thread.
+    A token is single use: create a new one per task.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Requests cancellation. Safe to call from any thread, any number of times."""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raises GenerationCancelled if cancellation was requested."""
+        if self._event.is_set():
+            raise GenerationCancelled()
@@ -0,0 +1,396 @@
+# caption_queue.py
+# Background captioning queue: dropped files and folders become jobs that the loaded
+# model processes one after another, while the UI stays free. Jobs that also want a card
+# and an SD prompt go through a second (API) stage, overlapped with the captioning of the next image.
+import copy
+import itertools
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional
+
+from cancellation import CancellationToken, GenerationCancelled
+from config import ACCEPTED_IMAGE_EXTENSIONS
+
+JOB_PENDING = "Pending"
+JOB_RUNNING = "Running"
+JOB_API = "Calling API"
+JOB_DONE = "Done"
+JOB_FAILED = "Failed"
+JOB_CANCELLED = "Cancelled"
+
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+_job_ids = itertools.count(1)
+
+
+@dataclass
+class CaptionJob:
+    path: str
+    prompt: str
+    profile: Any = None  # VLMProfile the job was queued with
+    job_id: int = field(default_factory=lambda: next(_job_ids))
+    status: str = JOB_PENDING
+    caption: str = ""
+    tags: str = ""
+    error: str = ""
+    history_id: str = None  # History entry holding the result
+    api_request: dict = None  # API settings for the card/SD stage, None to stop after the tags
+    card: str = ""
+    sd_output: str = ""
+    cancel_requested: bool = False
+    # Shared by every copy of the job, stops its generation mid-decode
+    cancel_token: CancellationToken = field(default_factory=CancellationToken, repr=False, compare=False)
+
+
+def expand_image_paths(paths, extensions=ACCEPTED_IMAGE_EXTENSIONS) -> List[str]:
+    """
+    Expands dropped paths into image files: folders are walked recursively with os.scandir,
+    files are kept if their extension is accepted. Order follows the drop, then file names.
+
+    Args:
+        paths (list): Files and/or directories.
+        extensions (tuple): Accepted lowercase extensions.
+
+    Returns:
+        list: Image file paths.
+    """
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(_scan_directory(path, extensions))
+        elif path.lower().endswith(extensions) and os.path.isfile(path):
+            images.append(path)
+    return images
+
+
+def _scan_directory(directory, extensions) -> List[str]:
+    files, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(extensions):
+                        files.append(entry.path)
+                except OSError:
+                    continue  # Unreadable entry, skip it
+    except OSError as e:
+        print(f"Could not scan {directory}: {e}")
+        return []
+
+    images = sorted(files, key=lambda p: os.path.basename(p).lower())
+    for subdir in sorted(subdirs, key=str.lower):
+        images.extend(_scan_directory(subdir, extensions))
+    return images
+
+
+@dataclass
+class StageStats:
+    """Busy time of one pipeline stage, to tell which one is the bottleneck."""
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+    first_start: Optional[float] = None
+    last_end: Optional[float] = None
+
+    def record(self, start, end):
+        self.items += 1
+        self.busy_seconds += end - start
+        if self.first_start is None:
+            self.first_start = start
+        self.last_end = end
+
+    def utilisation(self, window_seconds) -> float:
+        """Share of the window the stage spent working, 0..1."""
+        return min(1.0, self.busy_seconds / window_seconds) if window_seconds > 0 else 0.0
+
+
+class CaptionJobQueue:
+    """
+    An ordered queue of CaptionJob processed as a two-stage pipeline:
+
+        [pending jobs] -> VLM stage (caption + tags) -> bounded handoff -> API stage (card + SD prompt)
+
+    Each stage has its own thread, so the local model captions image N+1 while the API works
+    on image N. The handoff queue is bounded: when the API falls behind, the VLM stage waits
+    instead of piling up finished captions. Jobs without api_request skip the second stage.
+
+    Jobs can be paused (the running one finishes first), reordered and cancelled.
+    Every change is reported through on_event(event_type, payload) from a background thread,
+    with a copy of the job, so the UI can mirror it without sharing mutable state:
+        "added"   -> CaptionJob
+        "updated" -> CaptionJob
+        "removed" -> job_id
+        "order"   -> list of job_ids
+    """
+
+    def __init__(self, process_job: Callable[[CaptionJob], tuple], on_event: Callable[[str, Any], None],
+                 can_run: Callable[[], bool] = lambda: True,
+                 post_process: Callable[[CaptionJob], tuple] = None, handoff_size=2):
+        """
+        Args:
+            process_job: Called in the runner thread, returns (caption, tags) or raises.
+            on_event: Receives queue events, called from background threads.
+            can_run: Checked before each job, e.g. "is a model loaded". Call wake() when it may have changed.
+            post_process: Optional second stage, called in its own thread for jobs with an api_request.
+                Returns (card, sd_output) or raises.
+            handoff_size (int): Captioned jobs allowed to wait for the API stage.
+        """
+        self.process_job = process_job
+        self.on_event = on_event
+        self.can_run = can_run
+        self.post_process = post_process
+
+        self._jobs: List[CaptionJob] = []
+        self._condition = threading.Condition()
+        self._paused = False
+        self._stopped = False
+        self._handoff = queue.Queue(maxsize=handoff_size)
+        self._stats = {"vlm": StageStats("vlm"), "api": StageStats("api")}
+        self._jobs_finished = 0
+        self._stats_lock = threading.Lock()
+
+        self._runner = threading.Thread(target=self._run_loop, name="caption-queue", daemon=True)
+        self._runner.start()
+        self._api_runner = threading.Thread(target=self._api_loop, name="caption-queue-api", daemon=True)
+        self._api_runner.start()
+
+    # --- Adding jobs ---
+
+    def add_paths(self, paths, prompt, profile=None, api_request=None):
+        """
+        Expands the paths on a worker thread (folders can be huge) and queues one job per image.
+        Returns immediately. With an api_request, every job also goes through the API stage.
+        """
+        def expand():
+            images = expand_image_paths(paths)
+            if not images:
+                self.on_event("empty", list(paths))
+                return
+            for image_path in images:
+                self.add_job(CaptionJob(path=image_path, prompt=prompt, profile=profile, api_request=api_request))
+
+        threading.Thread(target=expand, name="caption-queue-scan", daemon=True).start()
+
+    def add_job(self, job: CaptionJob):
+        with self._condition:
+            self._jobs.append(job)
+            self._condition.notify_all()
+            snapshot = copy.copy(job)
+        self.on_event("added", snapshot)
+
+    # --- Controls ---
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    def pause(self):
+        """Stops picking new jobs. The one running keeps going until it finishes."""
+        with self._condition:
+            self._paused = True
+
+    def resume(self):
+        with self._condition:
+            self._paused = False
+            self._condition.notify_all()
+
+    def wake(self):
+        """Re-checks can_run, e.g. after a model was loaded."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def cancel(self, job_id):
+        """Cancels a pending job, or stops the running one within one decode step."""
+        with self._condition:
+            job = self._find(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return
+            if job.status == JOB_PENDING:
+                job.status = JOB_CANCELLED
+            else:
+                job.cancel_requested = True
+                job.cancel_token.cancel()
+            snapshot = copy.copy(job)
+        self.on_event("updated", snapshot)
+
+    def cancel_all(self):
+        with self._condition:
+            job_ids = [job.job_id for job in self._jobs if job.status not in FINISHED_STATES]
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def move(self, job_id, offset):
+        """
+        Moves a job up (negative offset) or down (positive offset) in the queue.
+        """
+        with self._condition:
+            job = self._find(job_id)
+            if job is None:
+                return
+            index = self._jobs.index(job)
+            new_index = max(0, min(len(self._jobs) - 1, index + offset))
+            if new_index == index:
+                return
+            self._jobs.insert(new_index, self._jobs.pop(index))
+            order = [j.job_id for j in self._jobs]
+        self.on_event("order", order)
+
+    def clear_finished(self):
+        with self._condition:
+            finished = [job.job_id for job in self._jobs if job.status in FINISHED_STATES]
+            self._jobs = [job for job in self._jobs if job.status not in FINISHED_STATES]
+        for job_id in finished:
+            self.on_event("removed", job_id)
+
+    def get(self, job_id):
+        """Returns a copy of a job, or None."""
+        with self._condition:
+            job = self._find(job_id)
+            return copy.copy(job) if job else None
+
+    def stats(self) -> dict:
+        """
+        Pipeline figures since the first job started.
+
+        Returns:
+            dict: elapsed seconds, finished jobs, throughput (jobs per minute) and,
+                per stage, items, busy seconds and utilisation (0..1).
+        """
+        # Job statuses change under _condition, read them there (not nested, the stages never hold both)
+        with self._condition:
+            busy = self._stage_busy()
+        with self._stats_lock:
+            stages = [stage for stage in self._stats.values() if stage.first_start is not None]
+            if not stages:
+                return {"elapsed": 0.0, "jobs_finished": 0, "jobs_per_minute": 0.0, "stages": {}}
+            start = min(stage.first_start for stage in stages)
+            end = max(stage.last_end for stage in stages)
+            if busy:
+                end = time.monotonic()  # Still working, count up to now
+            elapsed = max(end - start, 1e-9)
+            return {
+                "elapsed": elapsed,
+                "jobs_finished": self._jobs_finished,
+                "jobs_per_minute": self._jobs_finished * 60.0 / elapsed,
+                "stages": {name: {"items": stage.items, "busy_seconds": stage.busy_seconds,
+                                  "utilisation": stage.utilisation(elapsed)}
+                           for name, stage in self._stats.items()},
+            }
+
+    def _stage_busy(self) -> bool:
+        """True while a job is in the VLM or API stage. Call with _condition held."""
+        return any(job.status in (JOB_RUNNING, JOB_API) for job in self._jobs)
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            for job in self._jobs:
+                if job.status == JOB_RUNNING:
+                    job.cancel_token.cancel()
+            self._condition.notify_all()
+
+    def _find(self, job_id):
+        for job in self._jobs:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    # --- Runner ---
+
+    def _next_job(self):
+        """Blocks until a job can run. Returns None on shutdown."""
+        with self._condition:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._paused and self.can_run():
+                    for job in self._jobs:
+                        if job.status == JOB_PENDING:
+                            job.status = JOB_RUNNING
+                            return job
+                self._condition.wait()
+
+    def _run_loop(self):
+        """VLM stage: captions jobs in queue order, hands them to the API stage if needed."""
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self.on_event("updated", copy.copy(job))
+
+            caption, tags, error = "", "", ""
+            start = time.monotonic()
+            try:
+                caption, tags = self.process_job(job)
+            except GenerationCancelled:
+                pass  # cancel_requested is set, reported below
+            except Exception as e:
+                error = str(e)
+                print(f"Caption job failed for {job.path}: {e}")
+            with self._stats_lock:
+                self._stats["vlm"].record(start, time.monotonic())
+
+            handoff = False
+            with self._condition:
+                job.caption, job.tags = caption, tags
+                if job.cancel_requested:
+                    job.status = JOB_CANCELLED
+                elif error:
+                    job.status, job.error = JOB_FAILED, error
+                elif job.api_request and self.post_process is not None:
+                    job.status = JOB_API
+                    handoff = True
+                else:
+                    job.status = JOB_DONE
+                snapshot = copy.copy(job)
+            if not handoff:
+                self._job_finished()
+            self.on_event("updated", snapshot)
+
+            if handoff:
+                # Blocks while the API stage is handoff_size jobs behind (backpressure)
+                while not self._stopped:
+                    try:
+                        self._handoff.put(job, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+
+    def _api_loop(self):
+        """API stage: builds the card and the SD prompt of captioned jobs."""
+        while not self._stopped:
+            try:
+                job = self._handoff.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            card, sd_output, error = "", "", ""
+            if not job.cancel_requested:
+                start = time.monotonic()
+                try:
+                    card, sd_output = self.post_process(job)
+                except Exception as e:
+                    error = str(e)
+                    print(f"API stage failed for {job.path}: {e}")
+                with self._stats_lock:
+                    self._stats["api"].record(start, time.monotonic())
+
+            with self._condition:
+                if job.cancel_requested:
+                    job.status = JOB_CANCELLED
+                elif error:
+                    job.status, job.error = JOB_FAILED, error
+                else:
+                    job.status, job.card, job.sd_output = JOB_DONE, card, sd_output
+                snapshot = copy.copy(job)
+            self._job_finished()
+            self.on_event("updated", snapshot)
+
+    def _job_finished(self):
+        with self._stats_lock:
+            self._jobs_finished += 1
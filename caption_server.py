@@ -0,0 +1,434 @@
+# caption_server.py
+# Headless captioning over HTTP, to run PlotCaption on a shared box and call it from other
+# services. Models stay loaded between requests, and generations go through ModelHandler
+# (lock, result cache) and the profile parsers exactly like in the GUI.
+#
+# Usage: python caption_server.py --profile ToriiGate-v0.4-7B --path-root D:/datasets
+#
+# Endpoints (all answers are JSON):
+#   GET  /health, /profiles
+#   POST /caption, /tags, /caption_tags
+#        - JSON body: {"path": "...", "profile": "...", "prompt": "...", "force": false}
+#          or {"image_base64": "...", ...} instead of "path"
+#        - or the raw image file as body (Content-Type image/* or application/octet-stream),
+#          options in the query string: /tags?profile=...&force=1
+import argparse
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from config import NO_TAGS_FOUND, SERVER_HOST, SERVER_PORT, SERVER_MAX_UPLOAD_MB, VLM_MAX_BATCH_SIZE, \
+    VLM_BATCH_WAIT_MS, COMPILED_GENERATION, CONSTRAINED_TAG_DECODING, DEGENERATION_DETECTION, DEGENERATION_RETRIES
+from image_loader import decode_image_bytes
+from model_handler import ModelHandler
+from result_cache import ResultCache, image_content_hash
+from tag_normalizer import TagNormalizer
+from tag_vocabulary import load_tag_vocabulary
+from vlm_profiles import VLM_PROFILES
+
+# Endpoint -> passes to run, in order
+TASKS = {
+    "caption": ("caption",),
+    "tags": ("tags",),
+    "caption_tags": ("caption", "tags"),
+}
+
+
+class CaptionRequestError(Exception):
+    """A request the service refuses, carries the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class CaptionService:
+    """
+    Captioning without the GUI: keeps up to max_models models loaded (least recently used
+    is unloaded first) and runs the caption/tags passes of a profile on an image.
+    Thread-safe, every HTTP request runs on its own thread.
+    """
+
+    def __init__(self, profiles=None, default_profile=None, max_models=1, path_roots=(), compute_device=None,
+                 result_cache=None, tag_normalizer=None, max_batch_size=VLM_MAX_BATCH_SIZE,
+                 batch_wait_ms=VLM_BATCH_WAIT_MS, cpu_workers=0, compile_generation=COMPILED_GENERATION,
+                 constrain_tags=CONSTRAINED_TAG_DECODING, detect_degeneration=DEGENERATION_DETECTION,
+                 degeneration_retries=DEGENERATION_RETRIES):
+        """
+        Args:
+            profiles (dict): Profiles that can be requested, VLM_PROFILES by default.
+            default_profile (str): Profile used when a request doesn't name one.
+            max_models (int): Models kept loaded at the same time.
+            path_roots (list): Folders requests may read images from by path. Empty disables paths.
+            compute_device (str): Force "cpu" or "cuda", detected if None.
+            result_cache (ResultCache): Cache of raw outputs, shared with the GUI by default.
+            tag_normalizer (TagNormalizer): Cleans the tag lists, a vocabulary-less one by default.
+            max_batch_size (int): Concurrent requests merged into one generate(), 1 disables batching.
+            batch_wait_ms (float): How long a request waits for others to join its batch.
+            cpu_workers (int): On CPU, worker processes sharing one copy of the weights (0 = off).
+            compile_generation (bool): Static KV cache + compiled decode step for the loaded models.
+            constrain_tags (bool): Tags pass limited to the tag normalizer's vocabulary (once loaded).
+            detect_degeneration (bool): Stop looping generations early and run them again.
+            degeneration_retries (int): Times a looping generation is run again.
+        """
+        self.profiles = profiles if profiles is not None else VLM_PROFILES
+        self.default_profile = default_profile or next(iter(self.profiles))
+        if self.default_profile not in self.profiles:
+            raise ValueError(f"Unknown profile: {self.default_profile}")
+        self.max_models = max(1, max_models)
+        self.path_roots = [os.path.realpath(root) for root in path_roots]
+        self.compute_device = compute_device
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.tag_normalizer = tag_normalizer or TagNormalizer()
+        self.max_batch_size = max_batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self.cpu_workers = cpu_workers
+        self.compile_generation = compile_generation
+        self.constrain_tags = constrain_tags
+        self.detect_degeneration = detect_degeneration
+        self.degeneration_retries = degeneration_retries
+
+        self._handlers = OrderedDict()  # Profile name -> ModelHandler, least recently used first
+        self._handlers_lock = threading.Lock()  # Only around _handlers, never held while loading
+        self._load_lock = threading.Lock()  # One load (and the evictions making room for it) at a time
+
+    def loaded_profiles(self) -> list:
+        with self._handlers_lock:
+            return list(self._handlers)
+
+    def _loaded_handler(self, profile_name):
+        """The handler of a loaded profile, marked as the most recently used, or None."""
+        with self._handlers_lock:
+            handler = self._handlers.get(profile_name)
+            if handler is not None:
+                self._handlers.move_to_end(profile_name)
+            return handler
+
+    def get_handler(self, profile_name) -> ModelHandler:
+        """
+        Returns the ModelHandler of a profile, loading the model first if needed.
+        Loading blocks other loads, not requests for models that are already loaded (nor /health).
+        """
+        if profile_name not in self.profiles:
+            raise CaptionRequestError(404, f"Unknown profile: {profile_name}")
+
+        handler = self._loaded_handler(profile_name)
+        if handler is not None:
+            return handler
+
+        with self._load_lock:
+            # Loaded by another request while this one waited
+            handler = self._loaded_handler(profile_name)
+            if handler is not None:
+                return handler
+
+            with self._handlers_lock:
+                evicted = []
+                while len(self._handlers) >= self.max_models:
+                    evicted.append(self._handlers.popitem(last=False))
+            for old_name, old_handler in evicted:
+                print(f"Unloading {old_name} to make room for {profile_name}.")
+                old_handler.shutdown()  # Lets the running generation finish
+
+            handler = ModelHandler(result_cache=self.result_cache, compute_device=self.compute_device,
+                                   max_batch_size=self.max_batch_size, batch_wait_ms=self.batch_wait_ms,
+                                   cpu_workers=self.cpu_workers, compile_generation=self.compile_generation,
+                                   detect_degeneration=self.detect_degeneration,
+                                   degeneration_retries=self.degeneration_retries)
+            try:
+                handler.load_model(self.profiles[profile_name])
+            except Exception as e:
+                print(f"Failed to load {profile_name}: {e}")
+                raise CaptionRequestError(503, f"Could not load model {profile_name}: {e}")
+            with self._handlers_lock:
+                self._handlers[profile_name] = handler
+            return handler
+
+    def resolve_path(self, path) -> str:
+        """Checks that a requested local path is an existing file inside one of the path roots."""
+        if not self.path_roots:
+            raise CaptionRequestError(403, "Local paths are disabled on this server (see --path-root).")
+        real_path = os.path.realpath(path)
+        if not any(_is_inside(real_path, root) for root in self.path_roots):
+            raise CaptionRequestError(403, f"Path outside of the allowed folders: {path}")
+        if not os.path.isfile(real_path):
+            raise CaptionRequestError(404, f"File not found: {path}")
+        return real_path
+
+    def run(self, task, image_raw, profile_name=None, prompt=None, force=False) -> dict:
+        """
+        Runs the passes of a task on one image.
+
+        Args:
+            task (str): "caption", "tags" or "caption_tags".
+            image_raw (PIL.Image.Image): The RGB image.
+            profile_name (str): Profile to use, the default profile if None.
+            prompt (str): Caption prompt, the profile's prompt_caption if None.
+            force (bool): Ignore cached results.
+
+        Returns:
+            dict: profile, model_id, caption and/or tags (a list), timings_ms.
+        """
+        profile_name = profile_name or self.default_profile
+        handler = self.get_handler(profile_name)
+        profile = self.profiles[profile_name]
+
+        # Hash the image once, both passes share it for the cache lookup
+        image_hash = image_content_hash(image_raw)
+        result = {"profile": profile_name, "model_id": profile.model_id}
+        timings = {}
+        for step in TASKS[task]:
+            if handler.closed:
+                raise CaptionRequestError(503, f"Model {profile_name} was unloaded, retry the request.")
+            start = time.perf_counter()
+            if step == "caption":
+                step_prompt, tag_vocabulary = prompt or profile.prompt_caption, None
+            else:
+                step_prompt = profile.prompt_tags
+                tag_vocabulary = self.tag_normalizer.vocabulary if self.constrain_tags else None
+            try:
+                raw_output = handler.generate_description(profile, step_prompt, image_raw, image_hash=image_hash,
+                                                          force=force, tag_vocabulary=tag_vocabulary)
+            except Exception as e:
+                # Evicted while this request was queued or running: the handler is shut down
+                if handler.closed:
+                    raise CaptionRequestError(503, f"Model {profile_name} was unloaded, retry the request.") from e
+                raise
+            if step == "caption":
+                result["caption"] = profile.caption_parser(raw_output).get("output", "")
+            else:
+                tags = profile.tags_parser(raw_output).get("output", "")
+                result["tags"] = self.tag_normalizer.normalize_list(tags) if tags and tags != NO_TAGS_FOUND else []
+            timings[f"{step}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["timings_ms"] = timings
+        return result
+
+
+class _CaptionHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the socket open between requests, ingestion clients reuse their connection
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlsplit(self.path).path.rstrip("/")
+        if path == "/health":
+            self._send_json(200, {"status": "ok", "loaded": service.loaded_profiles()})
+        elif path == "/profiles":
+            self._send_json(200, {"default": service.default_profile,
+                                  "profiles": {name: {"model_id": profile.model_id,
+                                                      "prompt_caption": profile.prompt_caption}
+                                               for name, profile in service.profiles.items()}})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        task = url.path.strip("/")
+        start = time.perf_counter()
+        try:
+            # Read the body even for bad paths, leftovers would be parsed as the next request
+            body = self._read_body()
+            if task not in TASKS:
+                raise CaptionRequestError(404, f"Unknown path {self.path}")
+            options, image_raw = self._parse_request(body, parse_qs(url.query))
+            decode_ms = round((time.perf_counter() - start) * 1000, 1)
+            result = self.server.service.run(task, image_raw, profile_name=options.get("profile"),
+                                             prompt=options.get("prompt"), force=_as_bool(options.get("force")))
+        except CaptionRequestError as e:
+            self._send_json(e.status, {"error": str(e)})
+            return
+        except Exception as e:
+            print(f"Captioning request failed: {e}")
+            self._send_json(500, {"error": f"Generation failed: {e}"})
+            return
+
+        result["timings_ms"] = {"decode_ms": decode_ms, **result["timings_ms"],
+                                "total_ms": round((time.perf_counter() - start) * 1000, 1)}
+        self._send_json(200, result)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        if length > self.server.max_upload_bytes:
+            self.close_connection = True  # The body is left unread, the socket can't be reused
+            raise CaptionRequestError(413, f"Body over the {self.server.max_upload_bytes / 2 ** 20:g} MB limit.")
+        return self.rfile.read(length) if length else b""
+
+    def _parse_request(self, body, query):
+        """
+        Reads the options and the image of a POST.
+
+        Returns:
+            tuple: (options dict, decoded RGB image).
+        """
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+        # Query string options work with every body type, JSON fields win
+        options = {key: values[-1] for key, values in query.items()}
+        if content_type == "application/json":
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError as e:
+                raise CaptionRequestError(400, f"Invalid JSON: {e}")
+            if not isinstance(request, dict):
+                raise CaptionRequestError(400, "The JSON body must be an object.")
+            options.update(request)
+            if options.get("image_base64"):
+                try:
+                    body = base64.b64decode(options["image_base64"], validate=True)
+                except (binascii.Error, TypeError) as e:
+                    raise CaptionRequestError(400, f"Invalid image_base64: {e}")
+            elif options.get("path"):
+                with open(self.server.service.resolve_path(str(options["path"])), "rb") as file:
+                    body = file.read()
+            else:
+                raise CaptionRequestError(400, "Give either \"path\" or \"image_base64\".")
+        elif not body:
+            raise CaptionRequestError(400, "Empty body, send an image or a JSON request.")
+
+        try:
+            return options, decode_image_bytes(body)
+        except Exception as e:
+            raise CaptionRequestError(400, f"Could not decode the image: {e}")
+
+
+def _is_inside(path, root) -> bool:
+    """True if path is root or below it. Paths on another drive (Windows) are outside."""
+    try:
+        return os.path.commonpath([path, root]) == root
+    except ValueError:
+        return False
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+class CaptionServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server around a CaptionService.
+    """
+    daemon_threads = True
+
+    def __init__(self, service: CaptionService, host=SERVER_HOST, port=SERVER_PORT,
+                 max_upload_mb=SERVER_MAX_UPLOAD_MB, verbose=False):
+        """
+        Args:
+            service (CaptionService): Does the actual captioning.
+            host (str): Interface to bind, loopback by default.
+            port (int): Port to bind, 0 picks a free one (see base_url).
+            max_upload_mb (int): Largest accepted request body.
+            verbose (bool): Log every request to stderr.
+        """
+        super().__init__((host, port), _CaptionHandler)
+        self.service = service
+        self.max_upload_bytes = int(max_upload_mb * 2 ** 20)
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves in a background daemon thread and returns immediately."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and closes the listening socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def _load_tag_vocabulary(tag_normalizer):
+    """Loads the user's tag vocabulary into the normalizer, runs in a background thread."""
+    try:
+        vocabulary = load_tag_vocabulary()
+    except Exception as e:
+        print(f"Could not load the tag vocabulary: {e}")
+        return
+    if vocabulary is not None:
+        tag_normalizer.vocabulary = vocabulary
+        print(f"Tag vocabulary loaded: {len(vocabulary)} tags.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PlotCaption headless captioning server.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--profile", default=next(iter(VLM_PROFILES)), choices=list(VLM_PROFILES),
+                        help="Default profile, loaded at startup.")
+    parser.add_argument("--max-models", type=int, default=1, help="Models kept loaded at the same time.")
+    parser.add_argument("--path-root", action="append", default=[],
+                        help="Folder requests may read images from by path (repeatable).")
+    parser.add_argument("--device", choices=("cpu", "cuda"), default=None)
+    parser.add_argument("--max-batch-size", type=int, default=VLM_MAX_BATCH_SIZE,
+                        help="Concurrent requests merged into one generate(), 1 disables batching.")
+    parser.add_argument("--batch-wait-ms", type=float, default=VLM_BATCH_WAIT_MS)
+    parser.add_argument("--cpu-workers", type=int, default=0,
+                        help="CPU only: worker processes sharing one copy of the weights, 0 = off.")
+    parser.add_argument("--compile", action="store_true", default=COMPILED_GENERATION,
+                        help="Static KV cache + compiled decode step (slow first generation, faster after).")
+    parser.add_argument("--constrain-tags", action="store_true", default=CONSTRAINED_TAG_DECODING,
+                        help="Tags pass may only write tags of the local tag vocabulary.")
+    parser.add_argument("--no-degeneration-check", action="store_true", default=not DEGENERATION_DETECTION,
+                        help="Don't stop and retry looping generations.")
+    parser.add_argument("--degeneration-retries", type=int, default=DEGENERATION_RETRIES)
+    parser.add_argument("--max-upload-mb", type=float, default=SERVER_MAX_UPLOAD_MB)
+    parser.add_argument("--no-preload", action="store_true", help="Load the model on the first request.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    service = CaptionService(default_profile=args.profile, max_models=args.max_models,
+                             path_roots=args.path_root, compute_device=args.device,
+                             max_batch_size=args.max_batch_size, batch_wait_ms=args.batch_wait_ms,
+                             cpu_workers=args.cpu_workers, compile_generation=args.compile,
+                             constrain_tags=args.constrain_tags,
+                             detect_degeneration=not args.no_degeneration_check,
+                             degeneration_retries=args.degeneration_retries)
+    threading.Thread(target=_load_tag_vocabulary, args=(service.tag_normalizer,), daemon=True).start()
+    if not args.no_preload:
+        service.get_handler(args.profile)
+
+    server = CaptionServer(service, args.host, args.port, max_upload_mb=args.max_upload_mb, verbose=args.verbose)
+    print(f"PlotCaption server listening on {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
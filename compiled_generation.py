@@ -0,0 +1,98 @@
+# compiled_generation.py
+# Optional compiled generation for the loaded model: a static KV cache (allocated once, sized
+# from the prompt plus the profile's max_new_tokens, reused by every later generation) and a
+# torch.compile'd decode step. Compiling takes a while on the first generation, so the compiler
+# caches go to a folder in the settings directory and later app starts reuse them.
+import os
+import time
+
+from config import COMPILE_CACHE_FOLDER
+from persistence_manager import config_dir
+
+
+class CompiledGeneration:
+    """
+    Switches a loaded Hugging Face model to static-cache + compiled decoding, and keeps track of
+    the warm-up (compiling) generation versus the steady-state ones.
+    """
+
+    def __init__(self, model, max_new_tokens, device, cache_dir=None):
+        """
+        Args:
+            model: The loaded model (anything with generate() and a generation_config).
+            max_new_tokens (int): The profile's max_new_tokens, the static cache is sized for it.
+            device (str): "cpu" or "cuda", CUDA graphs are only used on "cuda".
+            cache_dir (Path): Persistent compiler cache, config_dir/COMPILE_CACHE_FOLDER by default.
+        """
+        self.model = model
+        self.max_new_tokens = max_new_tokens
+        self.device = device
+        self.cache_dir = cache_dir or config_dir / COMPILE_CACHE_FOLDER
+        self.warmup_stats = None  # DecodeStats of the first (compiling) generation
+        self.generations = 0
+
+    @property
+    def _artifacts_file(self):
+        return self.cache_dir / "compile_artifacts.bin"
+
+    def enable(self):
+        """Sets up the caches and the compiled decode step. Returns self."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Read by inductor/triton when they first need their cache dirs, i.e. at the first compile
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(self.cache_dir / "inductor"))
+        os.environ.setdefault("TRITON_CACHE_DIR", str(self.cache_dir / "triton"))
+
+        import torch
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True  # Compiled graphs are reused across processes
+
+        # Newer torch can also restore everything (autotuning included) in one go
+        if hasattr(torch.compiler, "load_cache_artifacts") and self._artifacts_file.exists():
+            try:
+                torch.compiler.load_cache_artifacts(self._artifacts_file.read_bytes())
+                print("Loaded compile cache artifacts.")
+            except Exception as e:
+                print(f"Ignoring unusable compile cache artifacts: {e}")
+
+        generation_config = self.model.generation_config
+        # generate() allocates the cache for prompt + max_new_tokens and keeps reusing it while it is big
+        # enough: one allocation (and one compiled graph) for a whole run of same-size images
+        generation_config.cache_implementation = "static"
+        if self.max_new_tokens:
+            generation_config.max_new_tokens = self.max_new_tokens
+        # CUDA graphs cut the per-step launch overhead, they don't exist on CPU
+        mode = "reduce-overhead" if self.device == "cuda" else "default"
+        try:
+            from transformers import CompileConfig
+        except ImportError:
+            CompileConfig = None
+        if CompileConfig is not None:
+            # generate() compiles only the decode step, the prefill (image tokens, varying length) stays eager
+            generation_config.compile_config = CompileConfig(fullgraph=False, dynamic=False, mode=mode)
+        else:
+            # Older transformers: compile the whole forward, dynamic so each prompt length doesn't recompile
+            self.model.forward = torch.compile(self.model.forward, mode=mode, dynamic=True)
+        print(f"Compiled generation enabled (static cache, {mode} mode, cache in {self.cache_dir}).")
+        return self
+
+    def record(self, run_stats):
+        """
+        Called after every generation with its DecodeStats. The first one includes the compile time,
+        once it is done the compiler caches are saved for the next app start.
+        """
+        self.generations += 1
+        if self.generations > 1:
+            return
+        self.warmup_stats = run_stats
+        print(f"Compiled generation warm-up: {run_stats.seconds:.1f} s.")
+
+        import torch
+        if hasattr(torch.compiler, "save_cache_artifacts"):
+            try:
+                artifacts = torch.compiler.save_cache_artifacts()
+                if artifacts is not None:
+                    started = time.perf_counter()
+                    self._artifacts_file.write_bytes(artifacts[0])
+                    print(f"Saved compile cache artifacts in {time.perf_counter() - started:.1f} s.")
+            except Exception as e:
+                print(f"Could not save compile cache artifacts: {e}")
@@ -30,3 +30,46 @@ DEFAULT_SD_TEMPLATE = "NSFW"
 CARD_USER_ROLE = "develop around Main Character personality (Main Character interest/Lover/Rival/Friend/NTR partecipant...)"
 CARD_CHAR_TO_ANALYZE = "Main Character"
 SD_CHAR_TO_ANALYZE = "Character from character card, Main Character"
+
+# --- Startup ---
+# Heavy libraries are not imported at startup, the window comes first. Once it is up they are
+# imported in the background, so the first model load / API call doesn't pay for them either.
+WARM_UP_IMPORTS = ("torch", "transformers", "openai")
+WARM_UP_DELAY_MS = 1000  # Let the window draw and settle before competing with it for the GIL
+
+# --- Local Generation ---
+# Concurrent caption requests (GUI, queue, server) on the same model are merged into one padded
+# generate() of up to VLM_MAX_BATCH_SIZE images. Each request waits at most VLM_BATCH_WAIT_MS for
+# company. Bigger batches need more VRAM: a batch that fails is retried one image at a time.
+VLM_MAX_BATCH_SIZE = 4
+VLM_BATCH_WAIT_MS = 5
+# Static KV cache + torch.compile'd decode step: faster steady-state decoding over long runs, but
+# the first generation after loading a model compiles (minutes on CPU). The compiled graphs are
+# kept in COMPILE_CACHE_FOLDER (in the settings folder) so later starts mostly skip that.
+# Takes precedence over batching and the draft model, which don't work with a static cache.
+COMPILED_GENERATION = False
+COMPILE_CACHE_FOLDER = "compile_cache"
+# Looping outputs (the same sentence over and over until max_new_tokens) are stopped as soon as
+# they are detected and generated again, up to DEGENERATION_RETRIES times, sampling. Not in
+# batches of several requests or in CPU worker processes. See degeneration.py for the thresholds.
+DEGENERATION_DETECTION = True
+DEGENERATION_RETRIES = 1
+
+# --- Tag Vocabulary ---
+NO_TAGS_FOUND = "No tags found."  # Shown when a tags parser finds nothing
+
+# Danbooru-style tag list: name,category,post_count,"alias1,alias2" (the format of the
+# a1111 tag autocomplete CSVs), and optional implications: antecedent,consequent.
+# Looked up in the settings folder, the app ships without one.
+TAG_VOCABULARY_FILE = "danbooru_tags.csv"
+TAG_IMPLICATIONS_FILE = "danbooru_tag_implications.csv"
+# Constrained tag decoding: the tags pass may only write tags of the vocabulary (needs the tag
+# list above). The token trie behind it is built once per model tokenizer and kept in TAG_TRIE_FOLDER.
+CONSTRAINED_TAG_DECODING = False
+TAG_TRIE_FOLDER = "tag_tries"
+
+# --- Caption Server ---
+# Loopback by default: exposing the server to the network is an explicit --host choice
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8090
+SERVER_MAX_UPLOAD_MB = 32
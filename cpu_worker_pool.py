@@ -0,0 +1,270 @@
+# cpu_worker_pool.py
+# CPU-only hosts: a single generate() keeps only a handful of cores busy. This runs N worker
+# processes, each pinned to its own slice of the cores, all reading ONE copy of the weights: the
+# parent loads the model, moves its tensors to shared memory (model.share_memory()) and hands
+# them to the workers, which map the same pages instead of loading 16 GB each.
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from cancellation import GenerationCancelled
+
+
+def _multiprocessing_context():
+    """
+    torch.multiprocessing passes tensors as shared memory handles instead of copying them.
+    Without torch (stub profiles in the benchmarks) the stdlib module does the same for everything else.
+    "spawn" everywhere: it is the only method on Windows, and forking a process that already
+    runs Tk, HTTP and torch threads is asking for deadlocks.
+    """
+    try:
+        import torch.multiprocessing as multiprocessing
+    except ImportError:
+        import multiprocessing
+    return multiprocessing.get_context("spawn")
+
+
+def available_cores() -> list:
+    """Cores this process may run on (respects taskset/cgroup limits where the OS tells us)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(num_workers, cores=None) -> list:
+    """
+    Splits the cores into num_workers contiguous, disjoint slices (neighbouring cores tend to
+    share caches). The first slices get one more core when it doesn't divide evenly.
+    """
+    cores = list(cores if cores is not None else available_cores())
+    num_workers = max(1, min(num_workers, len(cores)))
+    size, extra = divmod(len(cores), num_workers)
+    slices, start = [], 0
+    for index in range(num_workers):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+class _JobCancelToken:
+    """
+    CancellationToken stand-in inside a worker: the parent writes the id of the job to cancel
+    into a shared value, so a late cancel can never hit the worker's next job.
+    """
+
+    def __init__(self, cancel_slot):
+        self._cancel_slot = cancel_slot
+        self.job_id = -1
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_slot.value == self.job_id
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled()
+
+
+def _worker_main(worker_id, profile, model, processor, cores, threads, jobs, results, cancel_slot):
+    """Worker process: pins itself, sizes its thread pool, then generates until it gets None."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    cancel_token = _JobCancelToken(cancel_slot)
+    extra_args = {"stop_sequences": profile.stop_sequences} if profile.stop_sequences else {}
+    results.put(("ready", worker_id, None))
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, prompt, image_raw = job
+        cancel_token.job_id = job_id
+        results.put(("started", job_id, worker_id))
+        try:
+            output = profile.generation_function(model, processor, "cpu", prompt, profile.system_prompt, image_raw,
+                                                 cancel_token=cancel_token, **extra_args, **profile.generation_params)
+            results.put(("done", job_id, output))
+        except GenerationCancelled:
+            results.put(("cancelled", job_id, None))
+        except Exception as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+
+
+class CPUWorkerPool:
+    """
+    Runs a profile's generation_function in worker processes sharing one loaded model.
+    Jobs go to a single queue and idle workers pull from it, so slow images don't hold up the others.
+    """
+
+    def __init__(self, profile, model, processor, num_workers=None, threads_per_worker=None, pin_cores=True):
+        """
+        Args:
+            profile (VLMProfile): Profile of the loaded model, its functions must be importable (no lambdas).
+            model: The model loaded on the CPU by the parent.
+            processor: Its processor, every worker gets a copy (it is small).
+            num_workers (int): Worker processes, defaults to one per 8 cores.
+            threads_per_worker (int): Intra-op threads of each worker, defaults to its share of the cores.
+            pin_cores (bool): Pin every worker to its own slice of the cores (Linux only).
+        """
+        cores = available_cores()
+        self.num_workers = max(1, min(num_workers or len(cores) // 8 or 1, len(cores)))
+        self.core_slices = partition_cores(self.num_workers, cores)
+        self.threads_per_worker = threads_per_worker or max(1, min(len(core_slice) for core_slice in self.core_slices))
+        self.pin_cores = pin_cores
+        self.profile = profile
+        self.model = model
+        self.processor = processor
+
+        self._context = _multiprocessing_context()
+        self._jobs = self._context.Queue()
+        self._results = self._context.Queue()
+        self._processes = []
+        self._cancel_slots = []
+
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._futures = {}  # job id -> (Future, CancellationToken)
+        self._running = {}  # job id -> worker id
+        self._ready = threading.Event()
+        self._ready_count = 0
+        self._start_error = None
+        self._closed = False
+        self._collector = None
+        self.jobs_per_worker = [0] * self.num_workers
+
+    def start(self, timeout=None):
+        """
+        Starts the workers and waits until all of them are ready (they have to import torch and
+        map the weights). Returns self.
+        """
+        if hasattr(self.model, "share_memory"):
+            self.model.share_memory()  # Tensors move to shared memory once, workers map them
+
+        # Thread pools read these when torch is imported in the child, set_num_threads alone is too late for OpenMP
+        saved_environment = {name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS")}
+        os.environ.update({name: str(self.threads_per_worker) for name in saved_environment})
+        try:
+            for worker_id, core_slice in enumerate(self.core_slices):
+                cancel_slot = self._context.Value("q", -1, lock=False)
+                process = self._context.Process(
+                    target=_worker_main, name=f"cpu-worker-{worker_id}", daemon=True,
+                    args=(worker_id, self.profile, self.model, self.processor,
+                          core_slice if self.pin_cores else None, self.threads_per_worker,
+                          self._jobs, self._results, cancel_slot))
+                process.start()
+                self._processes.append(process)
+                self._cancel_slots.append(cancel_slot)
+        finally:
+            for name, value in saved_environment.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        self._collector = threading.Thread(target=self._collect, name="cpu-pool-collector", daemon=True)
+        self._collector.start()
+        if not self._ready.wait(timeout):
+            self.shutdown()
+            raise TimeoutError("CPU workers didn't start in time.")
+        if self._start_error:
+            self.shutdown()
+            raise RuntimeError(self._start_error)
+        print(f"CPU worker pool ready: {self.num_workers} workers x {self.threads_per_worker} threads.")
+        return self
+
+    @property
+    def worker_pids(self) -> list:
+        return [process.pid for process in self._processes]
+
+    def submit(self, prompt, image_raw, cancel_token=None) -> Future:
+        """
+        Queues one generation.
+
+        Returns:
+            Future: Resolves to the raw model output, or raises GenerationCancelled / RuntimeError.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("CPU worker pool is shut down (or all its workers died).")
+            job_id = next(self._job_ids)
+            self._futures[job_id] = (future, cancel_token)
+        self._jobs.put((job_id, prompt, image_raw))
+        return future
+
+    def shutdown(self, timeout=10):
+        """Stops the workers (after their current job) and fails the jobs still queued."""
+        with self._lock:
+            self._closed = True
+            futures, self._futures = self._futures, {}
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for future, _ in futures.values():
+            if not future.done():
+                future.set_exception(GenerationCancelled())
+
+    def _collect(self):
+        """Resolves futures from the workers' messages and forwards cancellations. Runs in a thread."""
+        while not self._closed or self._running:
+            try:
+                kind, job_id, data = self._results.get(timeout=0.05)
+            except queue.Empty:
+                kind = None
+            except (EOFError, OSError):
+                return  # Queue closed during shutdown
+
+            with self._lock:
+                if not self._ready.is_set() and not all(process.is_alive() for process in self._processes):
+                    self._start_error = "A CPU worker exited while starting, see its output above."
+                    self._ready.set()
+                if kind == "ready":
+                    self._ready_count += 1
+                    if self._ready_count == self.num_workers:
+                        self._ready.set()
+                elif kind == "started":
+                    self._running[job_id] = data
+                    self.jobs_per_worker[data] += 1
+                elif kind is not None:
+                    self._running.pop(job_id, None)
+                    future, _ = self._futures.pop(job_id, (None, None))
+                    if future is not None:
+                        if kind == "done":
+                            future.set_result(data)
+                        elif kind == "cancelled":
+                            future.set_exception(GenerationCancelled())
+                        else:
+                            future.set_exception(RuntimeError(data))
+
+                for running_id, worker_id in list(self._running.items()):
+                    _, token = self._futures.get(running_id, (None, None))
+                    if token is not None and token.cancelled:
+                        self._cancel_slots[worker_id].value = running_id
+                    if not self._processes[worker_id].is_alive():
+                        # Killed (out of memory?): its job will never report back
+                        del self._running[running_id]
+                        future, _ = self._futures.pop(running_id, (None, None))
+                        if future is not None:
+                            future.set_exception(RuntimeError(f"CPU worker {worker_id} died."))
+                if self._ready.is_set() and not self._closed \
+                        and not any(process.is_alive() for process in self._processes):
+                    # Every worker is gone: nobody will ever pick up the queued jobs
+                    self._closed = True
+                    futures, self._futures = self._futures, {}
+                    self._running.clear()
+                    for future, _ in futures.values():
+                        if not future.done():
+                            future.set_exception(RuntimeError("All CPU workers died."))
+            if self._closed and kind is None and not any(process.is_alive() for process in self._processes):
+                return
@@ -0,0 +1,56 @@
+# decode_stats.py
+# Per-run decode measurements: tokens generated, decode steps of the big model, forwards of the
+# draft model (assisted decoding), wall time. Filled by the generation functions through a
+# do-nothing StoppingCriteria, which generate() calls once per step of the big model.
+from dataclasses import dataclass
+
+
+@dataclass
+class DecodeStats:
+    """Counters of one generate() call (or several, they add up)."""
+    new_tokens: int = 0
+    target_steps: int = 0  # Decode steps of the big model (each one verifies the draft in assisted mode)
+    draft_forwards: int = 0  # Forward passes of the draft model, one per drafted token
+    seconds: float = 0.0
+    degeneration: str = ""  # Why DegenerationDetector stopped the (last) run early, empty if it didn't
+    tokens_saved: int = 0  # Tokens of max_new_tokens not spent on the run it stopped (not retried)
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.new_tokens / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def tokens_per_step(self) -> float:
+        """Tokens produced per big-model step: 1.0 without a draft, higher is better with one."""
+        return self.new_tokens / self.target_steps if self.target_steps else 0.0
+
+    @property
+    def acceptance_rate(self) -> float:
+        """Share of drafted tokens the big model kept (every step adds one token of its own on top)."""
+        if not self.draft_forwards:
+            return 0.0
+        return max(0, self.new_tokens - self.target_steps) / self.draft_forwards
+
+    def summary(self) -> str:
+        text = f"{self.new_tokens} tokens in {self.seconds:.1f} s ({self.tokens_per_second:.1f} tokens/s)"
+        if self.draft_forwards:
+            text += f", draft acceptance {self.acceptance_rate:.0%}, {self.tokens_per_step:.2f} tokens/step"
+        if self.degeneration:
+            text += f", degenerated ({self.degeneration}), {self.tokens_saved} tokens saved by stopping it"
+        return text
+
+
+class DecodeStepCounter:
+    """
+    StoppingCriteria that never stops anything, it counts the big model's steps.
+    Duck-types transformers.StoppingCriteria like CancellationStoppingCriteria.
+    """
+
+    def __init__(self, stats: DecodeStats):
+        self.stats = stats
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        self.stats.target_steps += 1
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
@@ -0,0 +1,165 @@
+# degeneration.py
+# Online detection of looping generations. no_repeat_ngram_size stops exact repeats, but a model
+# can still drift into paraphrasing the same sentence over and over until max_new_tokens runs out.
+# Three signals are watched while generating, and a row that degenerates is stopped right away:
+#   - compression ratio: a looping tail compresses far better than normal prose or tag lists
+#   - repeated sentences: sentences hashed by their set of words, so reworded repeats still match
+#   - entropy collapse: the model is nearly certain of every token and the tail is repetitive
+import re
+import zlib
+from collections import deque
+from dataclasses import dataclass
+
+_SENTENCE_END = re.compile(r"[.!?\n]")
+_WORD = re.compile(r"[^\W_]{3,}")
+
+
+@dataclass
+class DegenerationSettings:
+    """Thresholds of DegenerationDetector. The defaults leave normal captions and tag lists alone."""
+    min_tokens: int = 64  # Nothing is judged before this many generated tokens
+    check_every: int = 16  # Compression and entropy are checked every check_every tokens
+    window_chars: int = 800  # Tail of the output that is compressed
+    max_compression_ratio: float = 3.5  # Above: looping, whatever the entropy
+    soft_compression_ratio: float = 2.4  # Above, with collapsed entropy: looping
+    max_sentence_repeats: int = 3  # Same sentence (same words) this many times: looping
+    min_sentence_words: int = 4  # Shorter sentences are not hashed ("Yes." twice is fine)
+    entropy_window: int = 64  # Steps averaged for the entropy
+    min_entropy: float = 0.15  # Mean entropy (nats) below this counts as collapsed
+
+
+def compression_ratio(text: str) -> float:
+    """Raw size / zlib size of the text, about 2 for prose, much higher for loops."""
+    data = text.encode("utf-8")
+    return len(data) / len(zlib.compress(data)) if data else 0.0
+
+
+class _Row:
+    """Per-row state: text tail, current sentence, sentence counts, recent entropies."""
+
+    def __init__(self, settings):
+        self.tail = ""
+        self.sentence = ""
+        self.sentence_counts = {}
+        self.entropies = deque(maxlen=settings.entropy_window)
+        self.consumed = 0
+        self.last_checked = 0  # Tokens generated at the last compression/entropy check
+        self.reason = ""
+
+
+class DegenerationDetector:
+    """
+    StoppingCriteria that stops the rows that degenerate, with the reason in reasons[row].
+    Its entropy_probe is a logits processor that only reads the scores (generate() doesn't hand
+    them to stopping criteria) and has to be passed along in logits_processor. Not with a draft
+    model: generate() hands logits_processor to the draft's generate() too, the probe would mix
+    in the draft's entropies. Without it the entropy signal stays off, the others still work.
+    Duck-types transformers.StoppingCriteria like CancellationStoppingCriteria.
+    """
+
+    def __init__(self, tokenizer, prompt_length, settings: DegenerationSettings = None):
+        """
+        Args:
+            tokenizer: The processor's tokenizer.
+            prompt_length (int): Length of the (padded) prompt.
+            settings (DegenerationSettings): Thresholds, the defaults if None.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.settings = settings or DegenerationSettings()
+        self._rows = {}
+        self.entropy_probe = _EntropyProbe(self)
+
+    def _row(self, row) -> _Row:
+        if row not in self._rows:
+            self._rows[row] = _Row(self.settings)
+        return self._rows[row]
+
+    @property
+    def reasons(self) -> dict:
+        """row -> why it was stopped, for the rows that degenerated."""
+        return {row: state.reason for row, state in self._rows.items() if state.reason}
+
+    @property
+    def stopped_at(self) -> dict:
+        """row -> tokens it had generated when it was stopped, for the rows that degenerated."""
+        return {row: state.consumed for row, state in self._rows.items() if state.reason}
+
+    def _add_text(self, state, text):
+        """Feeds newly generated text, returns a reason if a sentence came back too often."""
+        settings = self.settings
+        state.tail = (state.tail + text)[-settings.window_chars:]
+        state.sentence += text
+        parts = _SENTENCE_END.split(state.sentence)
+        state.sentence = parts.pop()  # Still being written
+        for sentence in parts:
+            words = frozenset(word.lower() for word in _WORD.findall(sentence))
+            if len(words) < settings.min_sentence_words:
+                continue
+            count = state.sentence_counts.get(words, 0) + 1
+            state.sentence_counts[words] = count
+            if count >= settings.max_sentence_repeats:
+                return f"sentence repeated {count} times"
+        return ""
+
+    def _judge(self, state, generated) -> str:
+        settings = self.settings
+        # Assisted decoding adds several tokens per step, so multiples of check_every can be skipped
+        if generated < settings.min_tokens or generated - state.last_checked < settings.check_every:
+            return ""
+        state.last_checked = generated
+        ratio = compression_ratio(state.tail)
+        if ratio > settings.max_compression_ratio:
+            return f"compression ratio {ratio:.1f}"
+        if len(state.entropies) == state.entropies.maxlen and ratio > settings.soft_compression_ratio:
+            mean_entropy = sum(state.entropies) / len(state.entropies)
+            if mean_entropy < settings.min_entropy:
+                return f"entropy collapsed to {mean_entropy:.2f} (compression ratio {ratio:.1f})"
+        return ""
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        generated = input_ids.shape[1] - self.prompt_length
+        flags = []
+        for row in range(input_ids.shape[0]):
+            state = self._row(row)
+            if not state.reason and generated > state.consumed:
+                # Only the new tokens are decoded, the tail and sentence buffers do the rest
+                new_tokens = input_ids[row, self.prompt_length + state.consumed:].tolist()
+                state.consumed = generated
+                text = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+                state.reason = self._add_text(state, text) or self._judge(state, generated)
+            flags.append(bool(state.reason))
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+
+class _EntropyProbe:
+    """Logits processor recording the entropy of every row's next-token distribution, scores untouched."""
+
+    def __init__(self, detector):
+        self.detector = detector
+
+    def __call__(self, input_ids, scores):
+        log_probs = scores.float().log_softmax(dim=-1)
+        entropies = -(log_probs.exp() * log_probs).nan_to_num().sum(dim=-1).tolist()
+        for row, entropy in enumerate(entropies):
+            self.detector._row(row).entropies.append(entropy)
+        return scores
+
+
+def degeneration_reason(text: str, settings: DegenerationSettings = None) -> str:
+    """
+    The text-only checks of DegenerationDetector (repeated sentences, compression ratio of the
+    tail) on a finished output, for outputs that were generated without the detector.
+
+    Returns:
+        str: Why the text looks degenerate, empty if it doesn't.
+    """
+    settings = settings or DegenerationSettings()
+    detector = DegenerationDetector(None, 0, settings)
+    state = detector._row(0)
+    reason = detector._add_text(state, text + "\n")  # Ends the last sentence too
+    if reason:
+        return reason
+    ratio = compression_ratio(state.tail)
+    return f"compression ratio {ratio:.1f}" if ratio > settings.max_compression_ratio else ""
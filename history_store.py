@@ -0,0 +1,270 @@
+# history_store.py
+# Local generation history: every caption, tag list, card and SD prompt is kept in a SQLite
+# database next to app_settings.json, searchable with a full-text index.
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from persistence_manager import config_dir
+
+# Columns a history entry can carry, in table order
+HISTORY_FIELDS = (
+    "image_path", "model_id", "prompt", "caption", "tags",
+    "card_prompt", "card", "sd_prompt", "sd_output",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    image_path TEXT,
+    model_id TEXT,
+    prompt TEXT,
+    caption TEXT,
+    tags TEXT,
+    card_prompt TEXT,
+    card TEXT,
+    sd_prompt TEXT,
+    sd_output TEXT
+);
+CREATE INDEX IF NOT EXISTS generations_created_at ON generations(created_at);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+    caption, tags, card,
+    content='generations', content_rowid='id',
+    tokenize='unicode61 tokenchars ''_'''
+);
+
+-- Keep the external-content FTS index in sync with the table
+CREATE TRIGGER IF NOT EXISTS generations_ai AFTER INSERT ON generations BEGIN
+    INSERT INTO generations_fts(rowid, caption, tags, card) VALUES (new.id, new.caption, new.tags, new.card);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_ad AFTER DELETE ON generations BEGIN
+    INSERT INTO generations_fts(generations_fts, rowid, caption, tags, card)
+    VALUES ('delete', old.id, old.caption, old.tags, old.card);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_au AFTER UPDATE OF caption, tags, card ON generations BEGIN
+    INSERT INTO generations_fts(generations_fts, rowid, caption, tags, card)
+    VALUES ('delete', old.id, old.caption, old.tags, old.card);
+    INSERT INTO generations_fts(rowid, caption, tags, card) VALUES (new.id, new.caption, new.tags, new.card);
+END;
+"""
+
+# Upsert: only overwrite the columns that were given, so an entry can be filled step by step
+_UPSERT = f"""
+INSERT INTO generations (uid, created_at, updated_at, {", ".join(HISTORY_FIELDS)})
+VALUES (:uid, :now, :now, {", ".join(":" + name for name in HISTORY_FIELDS)})
+ON CONFLICT(uid) DO UPDATE SET
+    updated_at = excluded.updated_at,
+    {", ".join(f"{name} = COALESCE(excluded.{name}, {name})" for name in HISTORY_FIELDS)}
+"""
+
+_SELECT_COLUMNS = "g.id, g.uid, g.created_at, g.updated_at, " + ", ".join(f"g.{name}" for name in HISTORY_FIELDS)
+
+
+def _to_fts_query(text: str) -> str:
+    """
+    Turns free text typed by the user into a safe FTS5 query: every word must match,
+    and the last one is treated as a prefix so results show up while typing.
+    """
+    words = [word.replace('"', '""') for word in text.split()]
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words[:-1]]
+    terms.append(f'"{words[-1]}"*')
+    return " ".join(terms)
+
+
+class HistoryStore:
+    """
+    SQLite (WAL mode) store of past generations with an FTS5 index over captions, tags and cards.
+
+    Writes are queued and applied in batches by a background thread, the Tk thread never
+    waits on the disk. Reads use their own connection and can run from any thread.
+    """
+
+    def __init__(self, db_file="history.sqlite3", db_dir=None, batch_size=256, batch_window_seconds=0.25):
+        """
+        Args:
+            db_file (str): Database file name.
+            db_dir (Path): Directory of the database, defaults to the settings folder.
+            batch_size (int): Max number of queued writes applied in one transaction.
+            batch_window_seconds (float): How long the writer waits to gather more writes.
+        """
+        self.db_path = Path(db_dir or config_dir) / db_file
+        self.batch_size = batch_size
+        self.batch_window_seconds = batch_window_seconds
+
+        self._write_queue = queue.Queue()
+        self._local = threading.local()
+        self._closed = False
+
+        # Create the schema up front, so readers never race the writer on a fresh file
+        connection = self._connect()
+        with connection:
+            connection.executescript(_SCHEMA)
+        connection.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL is crash safe for the database, only the last commits may be lost on power failure
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        """One read connection per thread, sqlite3 connections are not shared across threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    # --- Writes (asynchronous) ---
+
+    def new_entry_id(self) -> str:
+        """Returns a fresh id for a generation, to be passed to record()."""
+        return uuid.uuid4().hex
+
+    def record(self, entry_id: str, **fields):
+        """
+        Queues an insert or update of a history entry. Returns immediately.
+
+        Only the given fields are written, the others keep their stored value, so an entry
+        can be recorded after the caption and completed later with the card and SD prompt.
+
+        Args:
+            entry_id (str): Id from new_entry_id().
+            **fields: Any of HISTORY_FIELDS.
+        """
+        unknown = set(fields) - set(HISTORY_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown history fields: {', '.join(sorted(unknown))}")
+        if self._closed:
+            print("History store already closed, entry not recorded.")
+            return
+        row = {name: fields.get(name) for name in HISTORY_FIELDS}
+        row["uid"] = entry_id
+        row["now"] = time.time()
+        self._write_queue.put(row)
+
+    def flush(self, timeout=10.0) -> bool:
+        """Blocks until every queued write is committed."""
+        done = threading.Event()
+        self._write_queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Commits pending writes and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write_queue.put(None)
+        self._writer.join(timeout=timeout)
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _writer_loop(self):
+        connection = self._connect()
+        try:
+            while True:
+                item = self._write_queue.get()
+                batch, waiters, stop = [], [], False
+                deadline = time.monotonic() + self.batch_window_seconds
+                while True:
+                    if item is None:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+
+                    if stop or waiters or len(batch) >= self.batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._write_queue.get(timeout=remaining) if remaining > 0 \
+                            else self._write_queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    try:
+                        with connection:
+                            connection.executemany(_UPSERT, batch)
+                    except sqlite3.Error as e:
+                        print(f"Error writing generation history: {e}")
+
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    # Drain whatever raced in before close() and leave
+                    leftovers = []
+                    while True:
+                        try:
+                            item = self._write_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if isinstance(item, threading.Event):
+                            item.set()
+                        elif item is not None:
+                            leftovers.append(item)
+                    if leftovers:
+                        with connection:
+                            connection.executemany(_UPSERT, leftovers)
+                    return
+        finally:
+            connection.close()
+
+    # --- Reads (synchronous, cheap) ---
+
+    def search(self, text: str, limit=50) -> list:
+        """
+        Full-text search over captions, tags and cards, newest matches first.
+        (Ranking by relevance would score every match, newest first stays fast on huge histories.)
+
+        Args:
+            text (str): Free text, words are ANDed and the last word is a prefix.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Entries as dicts, or the most recent entries if text is empty.
+        """
+        fts_query = _to_fts_query(text)
+        if not fts_query:
+            return self.recent(limit)
+        rows = self._reader().execute(
+            f"""SELECT {_SELECT_COLUMNS} FROM generations_fts
+                JOIN generations AS g ON g.id = generations_fts.rowid
+                WHERE generations_fts MATCH ? ORDER BY generations_fts.rowid DESC LIMIT ?""",
+            (fts_query, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def recent(self, limit=50) -> list:
+        """Returns the latest entries, newest first."""
+        rows = self._reader().execute(
+            f"SELECT {_SELECT_COLUMNS} FROM generations AS g ORDER BY g.created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, entry_id: str):
+        """Returns a single entry by id, or None."""
+        row = self._reader().execute(
+            f"SELECT {_SELECT_COLUMNS} FROM generations AS g WHERE g.uid = ?", (entry_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM generations").fetchone()[0]
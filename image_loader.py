@@ -0,0 +1,97 @@
+# image_loader.py
+# Image decoding for the Caption tab, meant to run on a worker thread: a big PNG or JPEG
+# can take seconds to decode, which would freeze the Tk window if done in the drop handler.
+from io import BytesIO
+
+from PIL import Image
+
+from config import MAX_THUMBNAIL_SIZE
+
+# Formats whose decoder can downscale while decoding (Image.draft)
+DRAFT_FORMATS = ("JPEG", "MPO")
+
+
+def make_thumbnail(image, max_size=MAX_THUMBNAIL_SIZE):
+    """
+    Downscales an already decoded image for display.
+
+    reducing_gap lets Pillow shrink with reduce() (a cheap integer box filter) before the
+    final resampling, instead of resampling the full-resolution pixels.
+
+    Args:
+        image (PIL.Image.Image): The source image, left untouched.
+        max_size (tuple): Bounding box of the thumbnail.
+
+    Returns:
+        PIL.Image.Image: An RGB thumbnail.
+    """
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")  # Palette images can't be resampled smoothly
+    scale = min(max_size[0] / image.width, max_size[1] / image.height, 1.0)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # resize() returns a new image, no full-resolution copy is made
+    thumbnail = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return thumbnail.convert("RGB") if thumbnail.mode != "RGB" else thumbnail
+
+
+def load_draft_thumbnail(path, max_size=MAX_THUMBNAIL_SIZE):
+    """
+    Decodes a thumbnail straight at reduced scale when the format supports it.
+    JPEG decoding with draft() skips most of the work (DCT scaling 1/2 to 1/8).
+
+    Args:
+        path (str): Image file.
+        max_size (tuple): Bounding box of the thumbnail.
+
+    Returns:
+        PIL.Image.Image: An RGB thumbnail, or None if the format cannot be draft-decoded.
+    """
+    with Image.open(path) as image:
+        if image.format not in DRAFT_FORMATS:
+            return None
+        image.draft("RGB", max_size)
+        return make_thumbnail(image, max_size)
+
+
+def load_image(path, max_size=MAX_THUMBNAIL_SIZE, on_thumbnail=None):
+    """
+    Decodes an image at full resolution and builds its thumbnail.
+
+    For draftable formats the thumbnail is decoded first and handed to on_thumbnail, so it
+    can be shown while the full image is still decoding. Other formats are decoded once and
+    the thumbnail is derived from the full image.
+
+    Args:
+        path (str): Image file.
+        max_size (tuple): Bounding box of the thumbnail.
+        on_thumbnail: Optional callable(thumbnail), called as soon as a thumbnail exists.
+
+    Returns:
+        tuple: (full-resolution RGB image, thumbnail).
+    """
+    thumbnail = load_draft_thumbnail(path, max_size)
+    if thumbnail is not None and on_thumbnail:
+        on_thumbnail(thumbnail)
+
+    with Image.open(path) as image:
+        image_raw = image.convert("RGB")
+
+    if thumbnail is None:
+        thumbnail = make_thumbnail(image_raw, max_size)
+        if on_thumbnail:
+            on_thumbnail(thumbnail)
+    return image_raw, thumbnail
+
+
+def decode_image_bytes(data):
+    """
+    Decodes an uploaded/in-memory image (no thumbnail, nothing is shown).
+
+    Args:
+        data (bytes): Encoded image file content.
+
+    Returns:
+        PIL.Image.Image: The full-resolution RGB image.
+    """
+    with Image.open(BytesIO(data)) as image:
+        return image.convert("RGB")
@@ -1,20 +1,73 @@
-import torch
+import threading
+
+from batch_scheduler import BatchScheduler
+from compiled_generation import CompiledGeneration
+from cpu_worker_pool import CPUWorkerPool
+from decode_stats import DecodeStats
+from degeneration import DegenerationSettings, degeneration_reason
+from result_cache import image_content_hash
+from tag_trie import TagConstraint, load_tag_trie
 
 
 class ModelHandler:
-    def __init__(self):
+    def __init__(self, result_cache=None, compute_device=None, max_batch_size=1, batch_wait_ms=0.0, cpu_workers=0,
+                 compile_generation=False, detect_degeneration=False, degeneration_retries=1):
+        """
+        Args:
+            result_cache (ResultCache): Optional cache of raw outputs, skips the model on repeated requests.
+            compute_device (str): Force "cpu" or "cuda", detected on first use if None.
+            max_batch_size (int): Concurrent generate_description calls run as one batch, 1 disables batching.
+            batch_wait_ms (float): How long a call waits for others to join its batch.
+            cpu_workers (int): On CPU, run generations in this many worker processes sharing the
+                loaded weights (0 = generate in this process).
+            compile_generation (bool): Static KV cache + compiled decode step (see CompiledGeneration).
+                Batching and the draft model are skipped, they don't work with a static cache.
+            detect_degeneration (bool): Stop looping generations early (see DegenerationDetector), in
+                this process and outside of multi-request batches.
+            degeneration_retries (int): Times a degenerated generation is run again, sampling.
+        """
         self.model = None
         self.processor = None
+        self.profile = None  # VLMProfile of the loaded model, set once load_model is done
+        self.draft_model = None  # Small model for assisted decoding, if the profile declares one
+        self._draft_forwards = 0
+        self.last_decode_stats = None  # DecodeStats of the last generation run in this process
+        self.closed = False  # Set by shutdown()
+        self.result_cache = result_cache
+        # One generate() at a time: the GUI, the caption queue and others share the same model
+        self.generation_lock = threading.Lock()
+        # Concurrent callers are merged into batches for profiles that support it
+        self.batcher = BatchScheduler(self._run_batch, max_batch_size, batch_wait_ms) if max_batch_size > 1 else None
+        self.cpu_workers = cpu_workers
+        self.worker_pool = None
+        self.compile_generation = compile_generation
+        self.compiled_generation = None
+        # Token tries of the tag vocabulary for the loaded tokenizer, built on the first constrained tags pass
+        self._tag_tries = {}
+        self._tag_trie_lock = threading.Lock()
+        self.degeneration = DegenerationSettings() if detect_degeneration else None
+        self.degeneration_retries = max(0, degeneration_retries)
+        # Counters over all runs with the detector, updated under the generation lock
+        self.degeneration_stats = {"runs": 0, "degenerated": 0, "retried": 0, "tokens_saved": 0}
 
         # This is the device we will ALWAYS use for TENSOR computations.
-        self.compute_device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Detected on first use: asking torch means importing it, which we don't want before the window is up.
+        self._compute_device = compute_device
 
         # This will be the STRATEGY for loading the model. It might be 'auto' or 'cuda'.
-        self.device_map_config = self.compute_device
+        self.device_map_config = None
+
+    @property
+    def compute_device(self):
+        if self._compute_device is None:
+            import torch
+            self._compute_device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._compute_device
 
     def pick_device_map_strategy(self, loaded_profile):
         """Determines the best loading strategy based on available VRAM."""
         if self.compute_device == "cuda":
+            import torch
             total_vram_gb = torch.cuda.get_device_properties(0).total_memory / (1024 ** 3)
             vram_threshold_gb = loaded_profile.required_vram_gb
 
@@ -40,20 +93,213 @@ class ModelHandler:
             loaded_profile.model_id,
             self.device_map_config  # Pass the loading STRATEGY here
         )
+        if self.cpu_workers > 0 and self.compute_device == "cpu":
+            self.worker_pool = CPUWorkerPool(loaded_profile, self.model, self.processor,
+                                             num_workers=self.cpu_workers).start()
+        elif self.compile_generation:
+            self.compiled_generation = CompiledGeneration(
+                self.model, loaded_profile.generation_params.get("max_new_tokens"), self.compute_device).enable()
+        elif loaded_profile.draft_model_id and loaded_profile.draft_loader_function:
+            self.draft_model = loaded_profile.draft_loader_function(loaded_profile.draft_model_id,
+                                                                    self.device_map_config)
+            # One forward per drafted token, for the acceptance rate
+            self.draft_model.register_forward_hook(self._count_draft_forward)
+        self.profile = loaded_profile
+
+    def _count_draft_forward(self, module, args, output):
+        self._draft_forwards += 1
+
+    def generation_params(self, loaded_profile) -> dict:
+        """The profile's generation_params, adjusted for assisted decoding when a draft model is loaded."""
+        if self.draft_model is not None and loaded_profile.draft_decoding == "greedy":
+            return {**loaded_profile.generation_params, "do_sample": False}
+        return loaded_profile.generation_params
+
+    def tag_constraint(self, loaded_profile, vocabulary):
+        """
+        TagConstraint of the loaded model for a vocabulary. The trie comes from the disk cache,
+        or is built the first time (slow, once per vocabulary and tokenizer).
+        """
+        key = (vocabulary.fingerprint(), loaded_profile.tags_with_spaces)
+        with self._tag_trie_lock:
+            trie = self._tag_tries.get(key)
+            if trie is None:
+                trie = load_tag_trie(vocabulary, self.processor.tokenizer, spaces=loaded_profile.tags_with_spaces)
+                self._tag_tries[key] = trie
+        return TagConstraint(trie, loaded_profile.tags_section_start, loaded_profile.tags_section_end)
 
     def unload_model(self):
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+        self.profile = None
         self.model = None
         self.processor = None
-        if self.compute_device == "cuda":
+        self.draft_model = None
+        self.compiled_generation = None
+        self._tag_tries = {}
+        # Nothing to free if torch was never imported (no model was ever loaded)
+        if self._compute_device == "cuda":
+            import torch
             torch.cuda.empty_cache()
 
-    def generate_description(self, loaded_profile, prompt, image_raw):
-        # Always pass the actual COMPUTE device here ("cuda" or "cpu"), never "auto".
-        return loaded_profile.generation_function(
-            self.model,
-            self.processor,
-            self.compute_device,
-            prompt,
-            loaded_profile.system_prompt,
-            image_raw
-        )
\ No newline at end of file
+    def shutdown(self):
+        """
+        Unloads the model for good: the batch scheduler is stopped too (its waiting requests are
+        cancelled) and the handler can't generate anymore. Waits for the running generation.
+        """
+        self.closed = True  # First: the requests cancelled below see why
+        if self.batcher is not None:
+            self.batcher.shutdown()
+        with self.generation_lock:
+            self.unload_model()
+
+    def generate_description(self, loaded_profile, prompt, image_raw, image_hash=None, force=False, cancel_token=None,
+                             tag_vocabulary=None):
+        """
+        Runs the profile's generation function, or returns a cached result for the same request.
+
+        Args:
+            loaded_profile (VLMProfile): The profile of the loaded model.
+            prompt (str): The user prompt.
+            image_raw (PIL.Image.Image): The RGB image.
+            image_hash (str): Precomputed image_content_hash(image_raw), avoids hashing twice per image.
+            force (bool): Skip the cache lookup and regenerate (the new result still replaces the cached one).
+            cancel_token (CancellationToken): Optional token, stops the generation within one decode step.
+            tag_vocabulary (TagVocabulary): Tags pass only: the tag list may only contain tags of this
+                vocabulary. Runs in this process, without batching.
+
+        Returns:
+            str: The raw model output.
+
+        Raises:
+            GenerationCancelled: If cancel_token was cancelled before or during the generation.
+        """
+        cache_key = None
+        if self.result_cache is not None:
+            key_params = self.generation_params(loaded_profile)
+            if tag_vocabulary is not None:
+                # Constrained and free outputs of the same prompt differ, they are cached apart
+                key_params = {**key_params, "tag_vocabulary": tag_vocabulary.fingerprint()}
+            cache_key = self.result_cache.make_key(
+                image_hash or image_content_hash(image_raw),
+                loaded_profile.model_id,
+                prompt,
+                loaded_profile.system_prompt,
+                key_params
+            )
+            if not force:
+                cached_output = self.result_cache.get(cache_key)
+                if cached_output is not None:
+                    print(f"Result cache hit for {loaded_profile.model_id}.")
+                    return cached_output
+
+        # Built (or read from disk) before taking the generation lock, the first build takes a while
+        tag_constraint = self.tag_constraint(loaded_profile, tag_vocabulary) if tag_vocabulary is not None else None
+        if self.worker_pool is not None and tag_constraint is None:
+            # Workers run in parallel, each on its own cores, no need for the generation lock
+            raw_output = self.worker_pool.submit(prompt, image_raw, cancel_token).result()
+        elif self.batcher is not None and loaded_profile.batch_generation_function is not None \
+                and self.draft_model is None and self.compiled_generation is None and tag_constraint is None:
+            # Assisted generation only works one sequence at a time, a static cache is sized for one batch size
+            # Waits for the batch this request ends up in, errors and cancellation are re-raised here
+            raw_output = self.batcher.submit(loaded_profile, prompt, image_raw, cancel_token).result()
+        else:
+            with self.generation_lock:
+                # Cancelled while waiting for the model, don't even start
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                run_stats = DecodeStats()
+                draft_forwards = self._draft_forwards
+                extra_args = {"assistant_model": self.draft_model} if self.draft_model is not None else {}
+                if loaded_profile.stop_sequences:
+                    extra_args["stop_sequences"] = loaded_profile.stop_sequences
+                if tag_constraint is not None:
+                    extra_args["tag_constraint"] = tag_constraint
+                raw_output = self._generate_single(loaded_profile, prompt, image_raw, cancel_token, run_stats,
+                                                   extra_args, self.generation_params(loaded_profile))
+                run_stats.draft_forwards = self._draft_forwards - draft_forwards
+                self.last_decode_stats = run_stats
+                if self.compiled_generation is not None:
+                    self.compiled_generation.record(run_stats)
+                if run_stats.new_tokens:  # Profiles that don't report stats leave it empty
+                    print(f"Generated {run_stats.summary()}.")
+
+        if cache_key is not None:
+            # Still looping after the retries: returned, but not kept, the next request tries again
+            if self.degeneration is not None and degeneration_reason(raw_output, self.degeneration):
+                print(f"Not caching a degenerated output of {loaded_profile.model_id}.")
+            else:
+                self.result_cache.put(cache_key, raw_output, loaded_profile.model_id)
+        return raw_output
+
+    def _generate_single(self, loaded_profile, prompt, image_raw, cancel_token, run_stats, extra_args, params):
+        """
+        Runs the profile's generation_function once, and again (up to degeneration_retries times)
+        while the degeneration detector stops it. Greedy profiles retry sampling, greedy decoding
+        would loop the same way. Called under the generation lock.
+
+        Returns:
+            str: The raw output of the last run.
+        """
+        if self.model is None:
+            raise RuntimeError("No model loaded (it was unloaded while the request waited).")
+        if self.degeneration is not None:
+            extra_args = {**extra_args, "degeneration": self.degeneration}
+        for attempt in range(self.degeneration_retries + 1):
+            # Only the last attempt's savings count, a retry spends the tokens a stopped run saved
+            run_stats.degeneration = ""
+            run_stats.tokens_saved = 0
+            # Always pass the actual COMPUTE device here ("cuda" or "cpu"), never "auto".
+            raw_output = loaded_profile.generation_function(
+                self.model,
+                self.processor,
+                self.compute_device,
+                prompt,
+                loaded_profile.system_prompt,
+                image_raw,
+                cancel_token=cancel_token,
+                run_stats=run_stats,
+                **extra_args,
+                **params
+            )
+            if self.degeneration is None:
+                break
+            self.degeneration_stats["runs"] += 1
+            if not run_stats.degeneration:
+                break
+            self.degeneration_stats["degenerated"] += 1
+            print(f"Generation degenerated ({run_stats.degeneration}), stopped early.")
+            if attempt < self.degeneration_retries:
+                self.degeneration_stats["retried"] += 1
+                params = {**params, "do_sample": True}
+        if self.degeneration is not None:
+            self.degeneration_stats["tokens_saved"] += run_stats.tokens_saved
+        return raw_output
+
+    def _run_batch(self, loaded_profile, requests):
+        """
+        Runs BatchRequests as one padded generate(). Called by the batch scheduler thread.
+
+        Returns:
+            list: Raw outputs, in the order of requests.
+        """
+        extra_args = {"stop_sequences": loaded_profile.stop_sequences} if loaded_profile.stop_sequences else {}
+        with self.generation_lock:
+            if len(requests) == 1:
+                # Nothing to pad, the single-image path is the reference behaviour
+                request = requests[0]
+                return [self._generate_single(loaded_profile, request.prompt, request.image_raw,
+                                              request.cancel_token, DecodeStats(), extra_args,
+                                              loaded_profile.generation_params)]
+            return loaded_profile.batch_generation_function(
+                self.model,
+                self.processor,
+                self.compute_device,
+                [request.prompt for request in requests],
+                loaded_profile.system_prompt,
+                [request.image_raw for request in requests],
+                cancel_tokens=[request.cancel_token for request in requests],
+                **extra_args,
+                **loaded_profile.generation_params
+            )
@@ -1,7 +1,10 @@
 import json
+import os
+import tempfile
+import threading
+import time
 from pathlib import Path
 import appdirs
-from transformers.testing_utils import set_config_for_less_flaky_test
 
 from vlm_profiles import VLM_PROFILES
 
@@ -17,16 +20,25 @@ config_dir.mkdir(parents=True, exist_ok=True)
 class PersistenceManager:
     """
     Manages loading and saving of application settings to a single JSON file.
+
+    Settings live in memory and are written behind: saves are coalesced over a short
+    debounce window and written atomically by a background thread, so the Tk thread
+    never waits on the disk and a crash can never leave a half-written file.
     """
 
-    def __init__(self, settings_file="app_settings.json"):
+    def __init__(self, settings_file="app_settings.json", debounce_seconds=0.5, max_delay_seconds=2.0,
+                 settings_dir=None):
         """
         Initializes the PersistenceManager.
 
         Args:
             settings_file (str): The name of the settings file.
+            debounce_seconds (float): Quiet time after the last change before writing.
+            max_delay_seconds (float): Upper bound on how long a change can wait while
+                changes keep coming (e.g. a slider being dragged).
+            settings_dir (Path): Optional directory for the file, defaults to the user config dir.
         """
-        self.settings_file_path = config_dir / settings_file
+        self.settings_file_path = Path(settings_dir or config_dir) / settings_file
         self.defaults = {
             "api_key": "",
             "base_url": "",
@@ -39,6 +51,20 @@ class PersistenceManager:
             # Get the first available VLM profile as the default
             "last_used_vlm": next(iter(VLM_PROFILES), None)
         }
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+        # In-memory copy, parsed from disk only once
+        self._settings = None
+        self._condition = threading.Condition()
+        self._dirty_since = None  # Time of the first unsaved change
+        self._last_change = None  # Time of the latest unsaved change
+        self._write_generation = 0  # Bumped on every change, lets flush() know what is on disk
+        self._written_generation = 0
+        self._closed = False
+        self.writes = 0  # Number of files actually written, handy for benchmarks
+        self._writer = threading.Thread(target=self._writer_loop, name="settings-writer", daemon=True)
+        self._writer.start()
 
         print(self.settings_file_path)
 
@@ -49,10 +75,18 @@ class PersistenceManager:
         If the file doesn't exist, is empty, or is corrupted, it returns
         a dictionary with default values. It also ensures that all keys
         from the defaults are present in the loaded settings.
+        The file is parsed only on the first call, later calls return the in-memory copy.
 
         Returns:
             dict: A dictionary containing the application settings.
         """
+        with self._condition:
+            if self._settings is None:
+                self._settings = self._read_settings_file()
+            return dict(self._settings)
+
+    def _read_settings_file(self) -> dict:
+        """Parses the settings file, falling back to the defaults."""
         if not self.settings_file_path.exists():
             return self.defaults.copy()
 
@@ -74,22 +108,152 @@ class PersistenceManager:
 
     def save_settings(self, settings_data: dict):
         """
-        Saves the provided settings dictionary to the JSON file.
+        Stores the provided settings dictionary and schedules a write to the JSON file.
+
+        The call returns immediately, the file is written by the background writer
+        once changes stop coming for debounce_seconds. Use flush() to force it.
 
         Args:
             settings_data (dict): The dictionary of settings to save.
 
         Returns:
-            bool: True if saving was successful, False otherwise.
+            bool: True if the settings were accepted, False if the manager is closed.
+        """
+        with self._condition:
+            if self._closed:
+                print("Error saving settings: persistence manager already closed.")
+                return False
+            if self._settings is None:
+                self._settings = self._read_settings_file()
+            changed = {key: value for key, value in settings_data.items() if self._settings.get(key, object()) != value}
+            if changed:
+                self._settings.update(changed)
+                self._mark_dirty()
+        return True
+
+    def update_setting(self, key, value):
+        """
+        Changes a single setting, e.g. from a slider callback. Same write-behind rules as save_settings.
+
+        Args:
+            key (str): The setting name.
+            value: The new value.
+        """
+        return self.save_settings({key: value})
+
+    def _mark_dirty(self):
+        """Records a change and wakes the writer. Caller must hold the condition."""
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        self._last_change = now
+        self._write_generation += 1
+        self._condition.notify_all()
+
+    def flush(self, timeout=5.0) -> bool:
+        """
+        Writes pending changes right away and waits for them to be on disk.
+
+        Args:
+            timeout (float): Maximum seconds to wait for the writer.
+
+        Returns:
+            bool: True if everything is saved, False on timeout or write error.
+        """
+        with self._condition:
+            target = self._write_generation
+            if self._written_generation >= target:
+                return True
+            # Pretend the debounce window already expired
+            self._dirty_since = self._last_change = float("-inf")
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._written_generation >= target, timeout=timeout)
+
+    def close(self, timeout=5.0) -> bool:
+        """Flushes pending changes and stops the writer thread. Call on shutdown."""
+        saved = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join(timeout=timeout)
+        return saved
+
+    def _writer_loop(self):
+        """Background thread: waits for changes, debounces them and writes the file."""
+        while True:
+            with self._condition:
+                while True:
+                    if self._dirty_since is not None:
+                        now = time.monotonic()
+                        due = min(self._last_change + self.debounce_seconds,
+                                  self._dirty_since + self.max_delay_seconds)
+                        if now >= due:
+                            break
+                        self._condition.wait(due - now)
+                    elif self._closed:
+                        return
+                    else:
+                        self._condition.wait()
+
+                snapshot = dict(self._settings)
+                generation = self._write_generation
+                self._dirty_since = self._last_change = None
+
+            # Write outside the lock so new changes can keep coming in
+            success = self._write_atomically(snapshot)
+
+            with self._condition:
+                if success:
+                    self._written_generation = max(self._written_generation, generation)
+                elif self._dirty_since is None:
+                    # Retry later, but don't spin on a broken disk
+                    self._dirty_since = self._last_change = time.monotonic() + self.max_delay_seconds
+                self._condition.notify_all()
+
+    def _write_atomically(self, settings_data: dict) -> bool:
+        """
+        Writes the settings to a temp file next to the real one, fsyncs it and renames it
+        over the original. Readers see either the old or the new file, never a partial one.
         """
+        directory = self.settings_file_path.parent
+        tmp_path = None
         try:
-            with open(self.settings_file_path, 'w') as f:
+            fd, tmp_path = tempfile.mkstemp(prefix=".app_settings.", suffix=".tmp", dir=directory)
+            with os.fdopen(fd, 'w') as f:
                 json.dump(settings_data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.settings_file_path)
+            tmp_path = None
+            self._fsync_directory(directory)
+            self.writes += 1
             print(f"Settings successfully saved to {self.settings_file_path}")
             return True
-        except IOError as e:
+        except (IOError, OSError) as e:
             print(f"Error saving settings: {e}")
             return False
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _fsync_directory(directory):
+        """Makes the rename itself durable. Not supported (nor needed) on Windows."""
+        if os.name != 'posix':
+            return
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
 
     def get_settings_path(self):
         """
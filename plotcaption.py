@@ -1,9 +1,11 @@
+import importlib
 import queue
 import sys, os
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox, scrolledtext
 import threading
+import time
 from PIL import Image, ImageTk
 from tkinterdnd2 import DND_FILES, TkinterDnD
 
@@ -14,13 +16,24 @@ from config import MAX_THUMBNAIL_SIZE, INACTIVE_TAB_COLOR, DARK_COLOR, FIELD_BOR
     FIELD_BACK_COLOR, FIELD_FOREGROUND_COLOR, INSERT_COLOR, SELECT_BACKGROUND_COLOR, BUTTON_ACTIVATE_COLOR, \
     BUTTON_PRESSED_COLOR, BUTTON_COLOR, TEXT_BG_COLOR, INSERT_BACKGROUND_COLOR, PLACEHOLDER_FG_COLOR, COPY_IMAGE_FILE, \
     COPY_IMAGE_HOVER_FILE, CARD_USER_ROLE, CARD_CHAR_TO_ANALYZE, SD_CHAR_TO_ANALYZE, APP_VERSION, \
-    ACCEPTED_IMAGE_EXTENSIONS
+    ACCEPTED_IMAGE_EXTENSIONS, NO_TAGS_FOUND, WARM_UP_IMPORTS, WARM_UP_DELAY_MS, \
+    VLM_MAX_BATCH_SIZE, VLM_BATCH_WAIT_MS, COMPILED_GENERATION, CONSTRAINED_TAG_DECODING, \
+    DEGENERATION_DETECTION, DEGENERATION_RETRIES
 import ai_utils
+from cancellation import CancellationToken, GenerationCancelled
+from image_loader import load_image
 from persistence_manager import PersistenceManager
+from history_store import HistoryStore
+from result_cache import ResultCache, image_content_hash
+from caption_queue import CaptionJobQueue
 from model_handler import ModelHandler
 from prompts import generate_character_card_prompt, generate_stable_diffusion_prompt, discover_prompt_templates, _load_prompt_template
+from prompt_index import PromptTemplateIndex
+from tag_normalizer import TagNormalizer
+from tag_vocabulary import load_tag_vocabulary
 from ui_components import AutocompleteEntry
-from ui_tabs import CaptionTab, GenerateTab, SettingsTab
+from ui_dispatcher import UIDispatcher
+from ui_tabs import CaptionTab, GenerateTab, SettingsTab, HistoryTab, QueueTab
 from vlm_profiles import VLMProfile, VLM_PROFILES
 
 from enum import Enum, auto
@@ -63,16 +76,45 @@ class VLM_GUI(TkinterDnD.Tk):
         self.geometry("900x750")
         self.configure(bg=DARK_COLOR)
 
+        # Worker threads talk to the UI only through this dispatcher
+        self.dispatcher = UIDispatcher(self)
+        self.dispatcher.register("vlm", self._handle_task_message)
+        self.dispatcher.register("model", self._handle_model_message)
+        self.dispatcher.register("templates", self._handle_template_message)
+        self.dispatcher.register("jobs", self._handle_job_message)
+        self.dispatcher.register("image", self._handle_image_message)
+
         # Handlers
-        self.model_handler = ModelHandler()
+        self.model_handler = ModelHandler(result_cache=ResultCache(), max_batch_size=VLM_MAX_BATCH_SIZE,
+                                          batch_wait_ms=VLM_BATCH_WAIT_MS,
+                                          compile_generation=COMPILED_GENERATION,
+                                          detect_degeneration=DEGENERATION_DETECTION,
+                                          degeneration_retries=DEGENERATION_RETRIES)
         self.persistence = PersistenceManager()
         self.settings = self.persistence.load_settings()
+        self.history = HistoryStore()
+        # Tags are cleaned up right after parsing. The vocabulary (if the user has one) can take
+        # a few seconds to compile the first time, so it is loaded in the background.
+        self.tag_normalizer = TagNormalizer()
+        threading.Thread(target=self._load_tag_vocabulary, daemon=True).start()
+        # Multi-file / folder drops are captioned here, one job at a time. The optional API
+        # stage (card + SD prompt) runs in parallel, on the previous image.
+        self.caption_queue = CaptionJobQueue(
+            process_job=self._process_caption_job,
+            on_event=lambda event_type, payload: self.dispatcher.post("jobs", event_type, payload),
+            # Not while the model is being unloaded, it only waits for the running generation
+            can_run=lambda: self.model_handler.model is not None and self.current_state != AppState.MODEL_LOADING,
+            post_process=self._process_job_api
+        )
 
         # State Variables
         self.loaded_profile: VLMProfile = None
         self.image_path = None
         self.image_raw = None
         self.image_tk = None
+        self.image_load_id = 0  # Bumped on every drop, results of older loads are ignored
+        self.cancel_token = None  # Token of the running caption generation, if any
+        self.current_history_id = None  # History entry of the image currently in the tabs
 
         # STYLE CONFIGURATION using config values
         # Create the Style object
@@ -163,6 +205,13 @@ class VLM_GUI(TkinterDnD.Tk):
 
         self.style.configure('Placeholder.TLabel', background=TEXT_BG_COLOR, foreground=PLACEHOLDER_FG_COLOR)
 
+        # Job list of the Queue tab
+        self.style.configure('Dark.Treeview', background=TEXT_BG_COLOR, fieldbackground=TEXT_BG_COLOR,
+                             foreground=FIELD_FOREGROUND_COLOR, borderwidth=0)
+        self.style.map('Dark.Treeview', background=[('selected', SELECT_BACKGROUND_COLOR)])
+        self.style.configure('Dark.Treeview.Heading', background=FIELD_BORDER_AREA_COLOR,
+                             foreground=FIELD_FOREGROUND_COLOR, relief='flat')
+
         # Add this new style for our text box frames
         self.style.configure('Border.TFrame', background=TEXT_BG_COLOR,
                              borderwidth=1, relief='solid', bordercolor=FIELD_BORDER_AREA_COLOR)
@@ -175,6 +224,11 @@ class VLM_GUI(TkinterDnD.Tk):
         prompt_templates = discover_prompt_templates()
         self.card_prompt_templates = prompt_templates.get("card_prompts", ["NSFW"])
         self.sd_prompt_templates = prompt_templates.get("sd_prompts", ["NSFW"])
+        # Keep watching the folder so new templates show up without a restart
+        self.template_index = PromptTemplateIndex(
+            initial=prompt_templates,
+            on_update=lambda snapshot: self.dispatcher.post("templates", "update", snapshot)
+        ).start()
 
         # UI Setup
         # Create Tab Instances
@@ -184,9 +238,13 @@ class VLM_GUI(TkinterDnD.Tk):
             copy_icon=self.copy_icon,
             copy_icon_hover=self.copy_icon_hover)
         self.settings_tab = SettingsTab(self.tab_control, self)
+        self.history_tab = HistoryTab(self.tab_control, self)
+        self.queue_tab = QueueTab(self.tab_control, self)
 
         self.tab_control.add(self.caption_tab, text='Caption')
         self.tab_control.add(self.generate_tab, text='Generate')
+        self.tab_control.add(self.queue_tab, text='Queue')
+        self.tab_control.add(self.history_tab, text='History')
         self.tab_control.add(self.settings_tab, text='Settings')
 
         # Create the status bar first and pack it to the bottom of the window
@@ -205,6 +263,16 @@ class VLM_GUI(TkinterDnD.Tk):
         self.current_state = None
         self.set_state(AppState.IDLE)  # Set the initial state
 
+        # The ML/API libraries were left out of startup, import them now that the window is up
+        self.after(WARM_UP_DELAY_MS, lambda: threading.Thread(target=self._warm_up_imports, daemon=True).start())
+
+    def _handle_template_message(self, message_type, data):
+        """Pushes a new snapshot of the template index into the Generate tab."""
+        if message_type == "update":
+            self.card_prompt_templates = data.get("card_prompts", [])
+            self.sd_prompt_templates = data.get("sd_prompts", [])
+            self.generate_tab.update_template_lists(self.card_prompt_templates, self.sd_prompt_templates)
+
     def start_api_generation_task(self):
         """The controller's method for handling the start of an API task."""
         self.set_state(AppState.API_GENERATING)
@@ -219,9 +287,6 @@ class VLM_GUI(TkinterDnD.Tk):
         Saves the complete application state and closes the application.
         """
         try:
-            # Update settings with the final state from the UI
-            settings_data = self.persistence.load_settings()
-
             # Update settings with the final state from the UI
             self.settings['last_used_vlm'] = self.caption_tab.model_selection_combo.get()
             self.settings['last_card_template'] = self.generate_tab.card_template_combo.get()
@@ -230,13 +295,20 @@ class VLM_GUI(TkinterDnD.Tk):
             self.settings['frequency_penalty'] = self.settings_tab.frequency_penalty_slider.get()
             self.settings['presence_penalty'] = self.settings_tab.presence_penalty_slider.get()
 
-            # Save all settings
-            self.persistence.save_settings(settings_data)
-            print("Settings saved.")
+            # Save all settings, then wait for the write-behind thread to put them on disk
+            self.persistence.save_settings(self.settings)
+            if self.persistence.close():
+                print("Settings saved.")
 
         except Exception as e:
             print(f"Error saving settings: {e}")
         finally:
+            if self.cancel_token is not None:
+                self.cancel_token.cancel()
+            self.template_index.stop()
+            self.caption_queue.shutdown()
+            self.history.close()
+            self.dispatcher.close()
             self.destroy()
 
 
@@ -244,34 +316,85 @@ class VLM_GUI(TkinterDnD.Tk):
 
 
     def process_dropped_image(self, filepath):
-        # This is the new home for the image processing logic!
-        if filepath.lower().endswith(ACCEPTED_IMAGE_EXTENSIONS):
-            self.image_path = filepath
-            try:
-                self.image_raw = Image.open(self.image_path).convert("RGB")
-                display_image = self.image_raw.copy()
-                display_image.thumbnail(MAX_THUMBNAIL_SIZE)
-                self.image_tk = ImageTk.PhotoImage(display_image)
-
-                # The controller updates the widget on the specific tab
-                self.caption_tab.image_label.config(image=self.image_tk, text="")
-
-                if self.current_state == AppState.MODEL_LOADED:
-                    self.set_state(AppState.READY_TO_GENERATE)
-                elif self.current_state == AppState.MODEL_LOADING:
-                    self.update_status("Image ready. Wait for model...")
-                elif self.current_state == AppState.READY_TO_GENERATE:
-                    self.update_status("Image ready. Ready to generate.")
-                else:
-                    # If the model isn't loaded yet, just update the status
-                    self.update_status("Image ready. Now load a model.")
-
-            except Exception as e:
-                messagebox.showerror("Image Error", f"Failed to load image: {e}")
-                self.image_path = None
-        else:
+        """
+        Starts loading a dropped image. Decoding and thumbnailing run on a worker thread,
+        a placeholder is shown meanwhile. The image only counts as present (image_raw set,
+        READY_TO_GENERATE allowed) once the full-resolution decode finished.
+        """
+        if not filepath.lower().endswith(ACCEPTED_IMAGE_EXTENSIONS):
             supported_extensions = ', '.join(ACCEPTED_IMAGE_EXTENSIONS)
             messagebox.showerror("Error", f"Invalid file type.\nAccepted: {supported_extensions}\n Please drop a valid image file.")
+            return
+
+        self.image_load_id += 1
+        self.image_path = None
+        self.image_raw = None
+        self.image_tk = None
+        self.caption_tab.image_label.config(image="", text=f"Loading {os.path.basename(filepath)}...")
+
+        # No image yet: generation has to wait for the decode
+        if self.current_state == AppState.READY_TO_GENERATE:
+            self.set_state(AppState.MODEL_LOADED)
+        elif self.current_state in (AppState.READY_FOR_CARD_GENERATION, AppState.READY_FOR_SD_GENERATION):
+            self.caption_tab.generate_button.config(state='disabled')
+        self.update_status("Loading image...")
+
+        threading.Thread(target=self._load_image_task,
+                         args=(filepath, self.image_load_id, self.dispatcher.channel("image")),
+                         daemon=True).start()
+
+    def _load_image_task(self, filepath, load_id, q):
+        """
+        Decodes the image in a separate thread. Posts "thumbnail" as soon as a preview exists,
+        then "loaded" with the full-resolution image, or "error".
+
+        Args:
+            filepath (str): The dropped file.
+            load_id (int): Id of this load, to recognize stale results.
+            q: Queue-like poster of the "image" dispatcher channel.
+        """
+        try:
+            image_raw, _ = load_image(filepath, MAX_THUMBNAIL_SIZE,
+                                      on_thumbnail=lambda thumbnail: q.put(("thumbnail", (load_id, thumbnail))))
+            q.put(("loaded", (load_id, filepath, image_raw)))
+        except Exception as e:
+            print(f"Failed to load image {filepath}: {e}")
+            q.put(("error", (load_id, filepath, str(e))))
+
+    def _handle_image_message(self, message_type, data):
+        """Applies the progress of an image load. Runs on the Tk thread."""
+        load_id = data[0]
+        if load_id != self.image_load_id:
+            return  # Another image was dropped in the meantime
+
+        if message_type == "thumbnail":
+            # PhotoImage must be created on the Tk thread, it is cheap at thumbnail size
+            self.image_tk = ImageTk.PhotoImage(data[1])
+            self.caption_tab.image_label.config(image=self.image_tk, text="")
+
+        elif message_type == "loaded":
+            _, filepath, image_raw = data
+            self.image_path = filepath
+            self.image_raw = image_raw
+
+            if self.current_state == AppState.MODEL_LOADED:
+                self.set_state(AppState.READY_TO_GENERATE)
+            elif self.current_state in (AppState.READY_FOR_CARD_GENERATION, AppState.READY_FOR_SD_GENERATION):
+                self.caption_tab.generate_button.config(state='normal')
+                self.update_status("Image ready.")
+            elif self.current_state == AppState.MODEL_LOADING:
+                self.update_status("Image ready. Wait for model...")
+            elif self.current_state in (AppState.GENERATING, AppState.API_GENERATING):
+                pass  # The running task reports its own status
+            else:
+                # If the model isn't loaded yet, just update the status
+                self.update_status("Image ready. Now load a model.")
+
+        elif message_type == "error":
+            _, filepath, error = data
+            self.caption_tab.image_label.config(image="", text="Drag & Drop an Image Here")
+            messagebox.showerror("Image Error", f"Failed to load image: {error}")
+            self.update_status("Image could not be loaded.")
 
 
 
@@ -292,39 +415,64 @@ class VLM_GUI(TkinterDnD.Tk):
             return
 
         self.set_state(AppState.MODEL_LOADING)
-        threading.Thread(target=self._load_model_task, args=(self.loaded_profile.model_id,), daemon=True).start()
+        threading.Thread(target=self._load_model_task, args=(self.loaded_profile, self.dispatcher.channel("model")),
+                         daemon=True).start()
 
-    def _load_model_task(self, model_id: str):
+    def _load_model_task(self, profile: VLMProfile, q):
         """
         The actual task of loading the model, executed in a separate thread.
-        Updates the state to MODEL_LOADED on success, or READY_TO_GENERATE
-        if an image is already present. Updates to IDLE on failure.
+        Posts "loaded" on success or "error" on failure, the UI thread updates the state.
 
         Args:
-            model_id (str): The Hugging Face ID of the model to load.
+            profile (VLMProfile): The profile of the model to load.
+            q: Queue-like poster of the "model" dispatcher channel.
         """
         try:
-            print(model_id)
+            print(profile.model_id)
             print("Loading model thread...")
-            self.model_handler.load_model(self.loaded_profile)
+            self.model_handler.load_model(profile)
+            q.put(("loaded", profile.model_id))
+
+        except Exception as e:
+            print(e)
+            q.put(("error", str(e)))
 
-            if self.image_path:
+    def _handle_model_message(self, message_type, data):
+        """
+        Applies the result of a model loading task. Runs on the Tk thread.
+        Updates the state to MODEL_LOADED on success, or READY_TO_GENERATE
+        if an image is already present. Updates to IDLE on failure, or once unloaded.
+        """
+        if message_type == "loaded":
+            if self.image_raw is not None:
                 self.set_state(AppState.READY_TO_GENERATE)
             else:
                 self.set_state(AppState.MODEL_LOADED)
-
-        except Exception as e:
-            print(e)
+            self.caption_queue.wake()  # Queued jobs were waiting for a model (and for MODEL_LOADING to end)
+        elif message_type == "unloaded":
+            self.set_state(AppState.IDLE)
+        elif message_type == "error":
             messagebox.showerror("Model Loading Error",
-                                 f"Failed to load model: {e}\n\nCheck the model name, your internet connection, and ensure you have enough VRAM/RAM.")
+                                 f"Failed to load model: {data}\n\nCheck the model name, your internet connection, and ensure you have enough VRAM/RAM.")
             self.set_state(AppState.IDLE)
 
     def unload_model(self):
         """
-        Unloads the model and resets the GUI to the IDLE state.
+        Unloads the model in a separate thread and resets the GUI to the IDLE state.
+        A queued job may be generating: the unload waits for it, and the queue doesn't
+        start another one meanwhile (MODEL_LOADING).
         """
-        self.model_handler.unload_model()
-        self.set_state(AppState.IDLE)
+        self.set_state(AppState.MODEL_LOADING)
+        self.caption_tab.load_button.config(text="Unloading...")
+        self.update_status("Unloading model, waiting for the running generation...")
+        threading.Thread(target=self._unload_model_task, args=(self.dispatcher.channel("model"),),
+                         daemon=True).start()
+
+    def _unload_model_task(self, q):
+        """Unloads the model once the generation lock is free. Posts "unloaded"."""
+        with self.model_handler.generation_lock:
+            self.model_handler.unload_model()
+        q.put(("unloaded", None))
 
     def set_state(self, new_state: AppState):
         """
@@ -339,6 +487,7 @@ class VLM_GUI(TkinterDnD.Tk):
         self.caption_tab.load_button.config(text="Load")
         self.caption_tab.unload_button.config(state='disabled')
         self.caption_tab.generate_button.config(state='disabled', text="Generate")
+        self.caption_tab.cancel_button.config(state='disabled')
         self.caption_tab.copy_caption_button.config(state='enabled')
         self.caption_tab.copy_tags_button.config(state='enabled')
         self.caption_tab.model_selection_combo.config(state='disabled')
@@ -379,13 +528,14 @@ class VLM_GUI(TkinterDnD.Tk):
 
         elif self.current_state == AppState.GENERATING:
             self.caption_tab.generate_button.config(text="Generating...")
+            self.caption_tab.cancel_button.config(state='normal')
             self.caption_tab.unload_button.config(state='disabled')
             self.caption_tab.model_selection_combo.config(state='disabled')
             self.settings_tab.test_button.config(state='disabled')
             self.update_status("Generating, please wait...")
 
         elif self.current_state == AppState.READY_FOR_CARD_GENERATION:
-            self.caption_tab.generate_button.config(state='normal')
+            self.caption_tab.generate_button.config(state='normal' if self.image_raw is not None else 'disabled')
             self.generate_tab.card_text_box.config(state='normal')
             self.generate_tab.card_generate_button.config(state='normal')
             self.generate_tab.sd_text_box.config(state='disabled')
@@ -397,7 +547,7 @@ class VLM_GUI(TkinterDnD.Tk):
             self.update_status("Character Card prompt ready. -> In Generate Tab, click 'Generate Card'.")
 
         elif self.current_state == AppState.READY_FOR_SD_GENERATION:
-            self.caption_tab.generate_button.config(state='normal')
+            self.caption_tab.generate_button.config(state='normal' if self.image_raw is not None else 'disabled')
             self.generate_tab.card_text_box.config(state='normal')
             self.generate_tab.card_generate_button.config(state='normal')
             self.generate_tab.sd_text_box.config(state='normal')
@@ -443,92 +593,332 @@ class VLM_GUI(TkinterDnD.Tk):
         if not prompt:
             messagebox.showwarning("Input Error", "Prompt cannot be empty.")
             return
+        if self.image_raw is None:
+            self.update_status("The image is still loading, try again in a moment.")
+            return
 
         self.set_state(AppState.GENERATING)
 
-        # Create a queue to communicate with the worker thread
-        self.task_queue = queue.Queue()
-
-        # Start the worker thread, passing it the queue
-        threading.Thread(target=self._generate_task_chain, args=(prompt, self.task_queue), daemon=True).start()
+        # Everything the worker needs is read here, on the Tk thread
+        force = self.caption_tab.force_regenerate_var.get()
+        self.cancel_token = CancellationToken()
+        # The image path too: dropping another image during the generation changes self.image_path
+        threading.Thread(target=self._generate_task_chain,
+                         args=(prompt, self.dispatcher.channel("vlm"), force, self.model_handler.profile, self.image_raw,
+                               self.cancel_token, self.image_path),
+                         daemon=True).start()
 
-        # Start a loop to check the queue for updates from the thread, this will be rescheduled until done
-        self.after(100, self._process_queue)
+    def cancel_generation(self):
+        """
+        Asks the running caption generation to stop. The model stops after the current
+        decode step, the worker then posts "cancelled" and the UI goes back to READY_TO_GENERATE.
+        """
+        if self.current_state != AppState.GENERATING or self.cancel_token is None:
+            return
+        self.cancel_token.cancel()
+        self.caption_tab.cancel_button.config(state='disabled')
+        self.update_status("Cancelling generation...")
 
-    def _generate_task_chain(self, prompt, q):
+    def _generate_task_chain(self, prompt, q, force=False, profile=None, image_raw=None, cancel_token=None,
+                             image_path=None):
         """
         The actual task of generating in a sequence. Runs in a worker thread.
+        Results already in the cache are returned without running the model, unless force is set.
+        Progress goes through q (the "vlm" dispatcher channel), widgets are never touched here.
+        The final "done" message carries (image_path, caption, tags) when both passes succeeded,
+        None when the generation failed.
         """
-        if not self.loaded_profile:
+        profile = profile or self.loaded_profile
+        image_raw = image_raw if image_raw is not None else self.image_raw
+        if not profile:
             q.put(("error", "No model profile loaded. Cannot generate."))
             q.put(("status", "Generation failed."))
             q.put(("done", None))
             return
+        cancelled = False
+        result = None
         try:
-
-            # --- TASK 1: Generate and Parse Caption ---
-            q.put(("status", "Generating description (step 1/2)..."))
-            raw_caption_output = self.model_handler.generate_description(self.loaded_profile, prompt, self.image_raw)
-
-            # Use the caption_parser here!
-            parsed_caption_data = self.loaded_profile.caption_parser(raw_caption_output)
-            q.put(("update_caption", parsed_caption_data.get("output", "")))
-
-            q.put(("status", "Generating booru tags. (step 2/2)..."))
-
-            # --- TASK 2: Generate and Parse Tags ---
-            tags_prompt = self.loaded_profile.prompt_tags
-            raw_tags_output = self.model_handler.generate_description(self.loaded_profile, tags_prompt, self.image_raw)
-
-
-            # Use the tags_parser here!
-            parsed_tags_data = self.loaded_profile.tags_parser(raw_tags_output)
-            q.put(("update_tags",
-                   parsed_tags_data.get("output", "")))
-
+            caption, tags = self._caption_image(profile, prompt, image_raw, force=force, q=q,
+                                                cancel_token=cancel_token)
+            result = (image_path, caption, tags)
             q.put(("status", "Generation complete."))
+        except GenerationCancelled:
+            cancelled = True
         except Exception as e:
             # If anything fails, put an error message in the queue
             q.put(("error", f"An error occurred during generation: {e}"))
             q.put(("status", "Generation failed."))
         finally:
             # Put a special "DONE" signal in the queue so the UI knows to re-enable buttons
-            q.put(("done", None))
+            q.put(("cancelled", None) if cancelled else ("done", result))
 
-    def _process_queue(self):
+    def _caption_image(self, profile, prompt, image_raw, force=False, q=None, cancel_token=None):
         """
-        Checks the queue for messages from the worker thread and updates the UI.
+        Runs the caption pass and the tags pass on one image. Runs in a worker thread.
+
+        Args:
+            profile (VLMProfile): Profile of the loaded model.
+            prompt (str): The caption prompt.
+            image_raw (PIL.Image.Image): The RGB image.
+            force (bool): Ignore cached results.
+            q: Optional queue-like poster for status and partial results.
+            cancel_token (CancellationToken): Optional token to stop between or during the passes.
+
+        Returns:
+            tuple: (caption, tags) as returned by the profile parsers.
+
+        Raises:
+            GenerationCancelled: If cancel_token was cancelled.
         """
+        # Hash the image once, both passes share it for the cache lookup
+        image_hash = image_content_hash(image_raw)
+
+        # --- TASK 1: Generate and Parse Caption ---
+        if q:
+            q.put(("status", "Generating description (step 1/2)..."))
+        raw_caption_output = self.model_handler.generate_description(profile, prompt, image_raw,
+                                                                     image_hash=image_hash, force=force,
+                                                                     cancel_token=cancel_token)
+
+        # Use the caption_parser here!
+        caption = profile.caption_parser(raw_caption_output).get("output", "")
+        if q:
+            q.put(("update_caption", caption))
+            q.put(("status", "Generating booru tags. (step 2/2)..."))
+
+        # --- TASK 2: Generate and Parse Tags ---
+        tags_prompt = profile.prompt_tags
+        # Constrained: the model can only write tags of the vocabulary (once it is loaded)
+        tag_vocabulary = self.tag_normalizer.vocabulary if CONSTRAINED_TAG_DECODING else None
+        raw_tags_output = self.model_handler.generate_description(profile, tags_prompt, image_raw,
+                                                                  image_hash=image_hash, force=force,
+                                                                  cancel_token=cancel_token,
+                                                                  tag_vocabulary=tag_vocabulary)
+
+        # Use the tags_parser here, then clean the list (spelling, duplicates, aliases, order)
+        tags = profile.tags_parser(raw_tags_output).get("output", "")
+        if tags and tags != NO_TAGS_FOUND:
+            tags = self.tag_normalizer.normalize(tags)
+        if q:
+            q.put(("update_tags", tags))
+        return caption, tags
+
+    def _warm_up_imports(self):
+        """Imports WARM_UP_IMPORTS in the background, runs in a worker thread."""
+        for module_name in WARM_UP_IMPORTS:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module_name)
+            except Exception as e:
+                # Not fatal here, the real import reports it again when the feature is used
+                print(f"Could not preload {module_name}: {e}")
+                continue
+            print(f"Preloaded {module_name} in {time.perf_counter() - start:.1f} s.")
+
+    def _load_tag_vocabulary(self):
+        """Loads the user's tag vocabulary, runs in a background thread."""
         try:
-            # Check the queue for a new message without blocking
-            message_type, data = self.task_queue.get_nowait()
-
-            # Process the message based on its type
-            if message_type == "status":
-                self.update_status(data)
-            elif message_type == "update_caption":
-                self.caption_tab.update_caption_text(data)
-            elif message_type == "update_tags":
-                self.caption_tab.update_tags_text(data)
-            elif message_type == "error":
-                print(data)
-                messagebox.showerror("Generation Error", data)
-            elif message_type == "done":
-                # The chain is finished, populate the next tab
-                final_caption = self.caption_tab.output_caption_text.get("1.0", tk.END).strip()
-                final_tags = self.caption_tab.output_tags_text.get("1.0", tk.END).strip()
-                # Set the state first to enable the text boxes
-                self.set_state(AppState.READY_FOR_CARD_GENERATION)
-                # Now populate them
-                self.generate_tab.populate_generate_card(final_caption, final_tags)
-                return  # Stop the queue-checking loop
+            vocabulary = load_tag_vocabulary()
+        except Exception as e:
+            print(f"Could not load the tag vocabulary: {e}")
+            return
+        if vocabulary is not None:
+            self.tag_normalizer.vocabulary = vocabulary
+            print(f"Tag vocabulary loaded: {len(vocabulary)} tags.")
+
+    # --- Caption Queue ---
+
+    def enqueue_paths(self, paths):
+        """
+        Queues dropped files and folders for background captioning with the current prompt.
+        Folders are expanded on a worker thread.
+        """
+        prompt = self.caption_tab.caption_prompt.get("1.0", tk.END).strip()
+        if not prompt:
+            messagebox.showwarning("Input Error", "Prompt cannot be empty.")
+            return
+        api_request = None
+        if self.queue_tab.api_stage_var.get():
+            # Read once on the Tk thread, the API stage only gets plain values
+            api_request = self.generate_tab.build_api_request()
+            if not all([api_request["api_key"], api_request["base_url"], api_request["model_name"]]):
+                messagebox.showwarning("API Settings", "Fill in the API settings to generate cards in the queue.")
+                return
+        # The model in memory, not the combobox: with nothing loaded the jobs take whatever gets loaded
+        self.caption_queue.add_paths(paths, prompt, self.model_handler.profile, api_request=api_request)
+        if self.model_handler.model is None:
+            self.update_status("Images queued. Load a model to start captioning.")
+        else:
+            self.update_status(f"Queued {len(paths)} dropped item(s) for captioning.")
+
+    def _process_caption_job(self, job):
+        """Captions a queued image. Runs in the caption queue thread."""
+        profile = self.model_handler.profile
+        if not profile:
+            raise ValueError("No model loaded.")
+        if job.profile is not None and job.profile.model_id != profile.model_id:
+            # Its prompt was written for the other model, and its result would be cached under the wrong id
+            raise ValueError(f"Queued for {job.profile.model_id}, but {profile.model_id} is loaded now.")
+        with Image.open(job.path) as image:
+            image_raw = image.convert("RGB")
+        caption, tags = self._caption_image(profile, job.prompt, image_raw, cancel_token=job.cancel_token)
+
+        # Results are kept per image in the history, searchable and re-openable later
+        job.history_id = self.history.new_entry_id()
+        self.history.record(job.history_id, image_path=job.path, model_id=profile.model_id,
+                            prompt=job.prompt, caption=caption, tags=tags)
+        return caption, tags
+
+    def _process_job_api(self, job):
+        """
+        Second stage of a queued job: character card, then SD prompt, over the API.
+        Runs in the caption queue API thread, while the model captions the next image.
+
+        Returns:
+            tuple: (card, sd_output)
+        """
+        request = job.api_request
+        api_params = dict(api_key=request["api_key"], base_url=request["base_url"], model=request["model_name"],
+                          temperature=request["temperature"], frequency_penalty=request["frequency_penalty"],
+                          presence_penalty=request["presence_penalty"])
+
+        card_prompt = generate_character_card_prompt(
+            template_name=request["card_template"], caption=job.caption, tags=job.tags,
+            character_to_analyze=CARD_CHAR_TO_ANALYZE, user_role=CARD_USER_ROLE, user_placeholder="{{user}}")
+        card = ai_utils.call_text_model(user_request=card_prompt, **api_params)
+        if not card:
+            raise RuntimeError("Character card API call failed.")
+
+        sd_prompt = generate_stable_diffusion_prompt(
+            template_name=request["sd_template"], caption=job.caption, tags=job.tags, character_card=card,
+            character_to_analyze=SD_CHAR_TO_ANALYZE)
+        sd_output = ai_utils.call_text_model(user_request=sd_prompt, **api_params)
+        if not sd_output:
+            raise RuntimeError("SD prompt API call failed.")
+
+        self.history.record(job.history_id, card_prompt=card_prompt, card=card, sd_prompt=sd_prompt,
+                            sd_output=sd_output)
+        return card, sd_output
+
+    def _handle_job_message(self, message_type, data):
+        """Mirrors caption queue events in the Queue tab. Called on the Tk thread."""
+        if message_type == "empty":
+            self.update_status("No supported images found in the dropped items.")
+            return
+        self.queue_tab.apply_event(message_type, data)
+
+    def open_job_result(self, job):
+        """Shows a finished queue job in the Caption and Generate tabs."""
+        if self.current_state in (AppState.MODEL_LOADING, AppState.GENERATING, AppState.API_GENERATING):
+            self.update_status("Busy, wait for the current task to finish.")
+            return
+        if os.path.isfile(job.path):
+            self.process_dropped_image(job.path)
+        self.caption_tab.update_caption_text(job.caption)
+        self.caption_tab.update_tags_text(job.tags)
+        if self.model_handler.model is not None:
+            self.set_state(AppState.READY_FOR_CARD_GENERATION)
+        self.generate_tab.populate_generate_card(job.caption, job.tags)
+        if job.card:
+            self.generate_tab.set_outputs(card=job.card)
+            self.generate_tab.populate_generate_sd(job.caption, job.card, job.tags)
+            self.generate_tab.set_outputs(sd_output=job.sd_output)
+            if self.model_handler.model is not None:
+                self.set_state(AppState.READY_FOR_SD_GENERATION)
+        self._update_generate_buttons_state()
+        self.current_history_id = job.history_id
+        self.tab_control.select(self.caption_tab)
+
+    def _handle_task_message(self, message_type, data):
+        """
+        Handles a message from the generation worker thread and updates the UI.
+        Called by the dispatcher on the Tk thread, for every pending message of a burst.
+        """
+        # Process the message based on its type
+        if message_type == "status":
+            self.update_status(data)
+        elif message_type == "update_caption":
+            self.caption_tab.update_caption_text(data)
+        elif message_type == "update_tags":
+            self.caption_tab.update_tags_text(data)
+        elif message_type == "error":
+            print(data)
+            messagebox.showerror("Generation Error", data)
+        elif message_type == "cancelled":
+            self.cancel_token = None
+            # Back to a state the user can act on: the model is free again
+            if self.model_handler.model is not None and self.image_raw is not None:
+                self.set_state(AppState.READY_TO_GENERATE)
+            else:
+                self.set_state(AppState.MODEL_LOADED)
+            self.update_status("Generation cancelled.")
+        elif message_type == "done":
+            self.cancel_token = None
+            # The chain is finished, populate the next tab
+            final_caption = self.caption_tab.output_caption_text.get("1.0", tk.END).strip()
+            final_tags = self.caption_tab.output_tags_text.get("1.0", tk.END).strip()
+            # Set the state first to enable the text boxes
+            self.set_state(AppState.READY_FOR_CARD_GENERATION)
+            # Now populate them
+            self.generate_tab.populate_generate_card(final_caption, final_tags)
+            # Only a generation that went through both passes is history, the text boxes may be stale
+            if data is not None:
+                image_path, caption, tags = data
+                self._record_caption_history(caption, tags, image_path=image_path)
+
+    def _record_caption_history(self, caption, tags, image_path=None):
+        """
+        Starts a new history entry for a generated caption. Written in the background.
 
-        except queue.Empty:
-            # If the queue is empty, do nothing and check again later
-            pass
+        Args:
+            caption (str): The caption.
+            tags (str): The tags.
+            image_path (str): The image the generation ran on, captured when it started.
+        """
+        if not caption and not tags:
+            return
+        self.current_history_id = self.history.new_entry_id()
+        self.history.record(
+            self.current_history_id,
+            image_path=image_path,
+            model_id=self.loaded_profile.model_id if self.loaded_profile else None,
+            prompt=self.caption_tab.caption_prompt.get("1.0", tk.END).strip(),
+            caption=caption,
+            tags=tags,
+            card_prompt=self.generate_tab.card_text_box.get("1.0", tk.END).strip()
+        )
+
+    def open_history_entry(self, entry: dict):
+        """
+        Re-opens a past generation in the Caption and Generate tabs.
+
+        Args:
+            entry (dict): A row returned by HistoryStore.search().
+        """
+        if self.current_state in (AppState.MODEL_LOADING, AppState.GENERATING, AppState.API_GENERATING):
+            self.update_status("Busy, wait for the current task to finish before opening history.")
+            return
+
+        image_path = entry.get("image_path")
+        if image_path and os.path.isfile(image_path):
+            self.process_dropped_image(image_path)
+
+        self.caption_tab.update_caption_text(entry.get("caption") or "")
+        self.caption_tab.update_tags_text(entry.get("tags") or "")
+        self.generate_tab.load_history_entry(entry)
+        self.current_history_id = entry.get("uid")
+
+        # Only move into the generation states when a model can actually serve them
+        if self.model_handler.model is not None:
+            if entry.get("card"):
+                self.set_state(AppState.READY_FOR_SD_GENERATION)
+            else:
+                self.set_state(AppState.READY_FOR_CARD_GENERATION)
+        else:
+            self._update_generate_buttons_state()
 
-        # Reschedule execution to go over queue again
-        self.after(100, self._process_queue)
+        self.tab_control.select(self.caption_tab)
+        self.update_status("History entry opened.")
 
     def update_status(self, text):
         """Updates the status bar text."""
@@ -0,0 +1,217 @@
+# prompt_index.py
+# Keeps the list of prompt templates up to date while the app runs, so new or removed
+# *_character_card.txt / *_stable_diffusion.txt files show up without a restart.
+import os
+import queue
+import threading
+
+from prompts import resource_path, clear_template_cache
+
+# Optional: native filesystem events. Without watchdog we fall back to cheap polling.
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+CARD_SUFFIX = "_character_card.txt"
+SD_SUFFIX = "_stable_diffusion.txt"
+
+
+def classify_template(filename: str):
+    """
+    Maps a template filename to its kind and prefix.
+
+    Returns:
+        tuple: ("card" | "sd", prefix), or None if the file is not a prompt template.
+    """
+    if filename.endswith(CARD_SUFFIX):
+        return "card", filename[:-len(CARD_SUFFIX)]
+    if filename.endswith(SD_SUFFIX):
+        return "sd", filename[:-len(SD_SUFFIX)]
+    return None
+
+
+class _TemplateEventHandler(FileSystemEventHandler):
+    """Forwards watchdog events for template files to the index."""
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.index._add(os.path.basename(event.src_path))
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.index._remove(os.path.basename(event.src_path))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.index._touch(os.path.basename(event.src_path))
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.index._remove(os.path.basename(event.src_path))
+            self.index._add(os.path.basename(event.dest_path))
+
+
+class PromptTemplateIndex:
+    """
+    A watched index of the prompt templates in the 'prompts' directory.
+
+    The index is updated only from create/modify/delete events (watchdog), or from a
+    polling thread that re-lists the directory only when its mtime changed. Every change
+    of the template lists is published as a dict shaped like the result of
+    discover_prompt_templates(): passed to on_update if given, else put in the `updates` queue.
+    """
+
+    def __init__(self, prompts_dir=None, initial=None, poll_interval=2.0, on_update=None):
+        """
+        Args:
+            prompts_dir (str): Directory to watch, defaults to the bundled 'prompts' folder.
+            initial (dict): Optional result of discover_prompt_templates() to start from,
+                avoids scanning the directory twice at startup.
+            poll_interval (float): Seconds between checks when watchdog is not available.
+            on_update: Optional callable(snapshot), called from the watcher thread on every change.
+        """
+        self.prompts_dir = prompts_dir or resource_path("prompts")
+        self.poll_interval = poll_interval
+        self.updates = queue.Queue()
+        self.on_update = on_update
+
+        self._lock = threading.Lock()
+        self._card_prompts = set((initial or {}).get("card_prompts", []))
+        self._sd_prompts = set((initial or {}).get("sd_prompts", []))
+        self._seeded = initial is not None
+
+        self._stop_event = threading.Event()
+        self._observer = None
+        self._poll_thread = None
+        self._dir_mtime = None
+
+    # --- Public API ---
+
+    def start(self):
+        """Starts watching in the background. Returns immediately."""
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_TemplateEventHandler(self), self.prompts_dir, recursive=False)
+                self._observer.daemon = True
+                self._observer.start()
+                print(f"Watching prompt templates in {self.prompts_dir}")
+                if not self._seeded:
+                    threading.Thread(target=self._rescan, daemon=True).start()
+                return self
+            except Exception as e:
+                # e.g. inotify limits or a network share that does not support events
+                print(f"Filesystem events unavailable ({e}), polling prompt templates instead.")
+                self._observer = None
+
+        self._poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._poll_thread.start()
+        return self
+
+    def stop(self):
+        """Stops the observer or the polling thread."""
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=2)
+        if self._poll_thread is not None:
+            self._poll_thread.join(timeout=2)
+
+    def snapshot(self) -> dict:
+        """Returns the current template lists, same shape as discover_prompt_templates()."""
+        with self._lock:
+            return {"card_prompts": sorted(self._card_prompts), "sd_prompts": sorted(self._sd_prompts)}
+
+    # --- Incremental updates ---
+
+    def _target_set(self, kind):
+        return self._card_prompts if kind == "card" else self._sd_prompts
+
+    def _add(self, filename):
+        entry = classify_template(filename)
+        if not entry:
+            return
+        kind, prefix = entry
+        with self._lock:
+            target = self._target_set(kind)
+            if prefix in target:
+                return
+            target.add(prefix)
+        self._publish()
+
+    def _remove(self, filename):
+        entry = classify_template(filename)
+        if not entry:
+            return
+        kind, prefix = entry
+        with self._lock:
+            target = self._target_set(kind)
+            if prefix not in target:
+                return
+            target.discard(prefix)
+        clear_template_cache()
+        self._publish()
+
+    def _touch(self, filename):
+        # Content changes are picked up by the mtime check of the compiled template cache,
+        # but a file can show up as "modified" first on some platforms (e.g. copy on Windows).
+        self._add(filename)
+
+    def _publish(self):
+        snapshot = self.snapshot()
+        if self.on_update is not None:
+            self.on_update(snapshot)
+        else:
+            self.updates.put(snapshot)
+
+    # --- Polling fallback ---
+
+    def _rescan(self):
+        """Lists the directory once and applies only the differences."""
+        card_prompts, sd_prompts = set(), set()
+        try:
+            with os.scandir(self.prompts_dir) as entries:
+                for entry in entries:
+                    template = classify_template(entry.name)
+                    if template and entry.is_file():
+                        kind, prefix = template
+                        (card_prompts if kind == "card" else sd_prompts).add(prefix)
+        except FileNotFoundError:
+            print(f"ERROR: Prompts directory not found at {self.prompts_dir}")
+            return
+        except OSError as e:
+            print(f"Could not scan prompt templates: {e}")
+            return
+
+        with self._lock:
+            changed = card_prompts != self._card_prompts or sd_prompts != self._sd_prompts
+            self._card_prompts, self._sd_prompts = card_prompts, sd_prompts
+        if changed or not self._seeded:
+            self._seeded = True
+            self._publish()
+
+    def _poll_loop(self):
+        """
+        Checks the directory mtime every poll_interval seconds. Creating, deleting or renaming
+        a file bumps it, so the full listing only happens when something actually changed.
+        """
+        while not self._stop_event.is_set():
+            try:
+                dir_mtime = os.stat(self.prompts_dir).st_mtime_ns
+            except OSError:
+                dir_mtime = None
+
+            if dir_mtime != self._dir_mtime:
+                first_check = self._dir_mtime is None
+                self._dir_mtime = dir_mtime
+                if dir_mtime is not None and not (first_check and self._seeded):
+                    self._rescan()
+
+            self._stop_event.wait(self.poll_interval)
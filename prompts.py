@@ -1,6 +1,8 @@
 # prompts.py (Refactored Version)
 import os
+import re
 import sys
+import threading
 
 
 def resource_path(relative_path):
@@ -31,6 +33,88 @@ def _load_prompt_template(filename: str) -> str:
         return ""
 
 
+# Matches [[[placeholder]]] markers inside the template files
+_PLACEHOLDER_PATTERN = re.compile(r"\[\[\[(\w+)\]\]\]")
+
+
+class PromptTemplate:
+    """
+    A prompt template parsed once into literal text and placeholder segments.
+
+    Rendering walks the segments a single time and joins them, instead of running
+    one full-copy str.replace per placeholder.
+    """
+
+    def __init__(self, text: str):
+        """
+        Parses the template text.
+
+        Args:
+            text (str): The raw template, with placeholders written as [[[name]]].
+        """
+        self.text = text
+        # Segments alternate literal strings and placeholder names: [lit, name, lit, name, ..., lit]
+        self._segments = _PLACEHOLDER_PATTERN.split(text)
+        self.placeholders = frozenset(self._segments[1::2])
+
+    def render(self, **values: str) -> str:
+        """
+        Substitutes the placeholders in a single pass.
+
+        Placeholders without a value are left untouched, same as the old replace chain.
+
+        Args:
+            **values (str): Placeholder name -> replacement text.
+
+        Returns:
+            str: The rendered prompt.
+        """
+        segments = self._segments
+        parts = segments[:]
+        for i in range(1, len(segments), 2):
+            name = segments[i]
+            parts[i] = values[name] if name in values else f"[[[{name}]]]"
+        return "".join(parts)
+
+
+# filename -> (mtime_ns, PromptTemplate). Guarded by a lock, templates are rendered from worker threads too.
+_compiled_templates = {}
+_compiled_templates_lock = threading.Lock()
+
+
+def _load_compiled_template(filename: str) -> PromptTemplate:
+    """
+    Returns the compiled template for a file in the 'prompts' directory.
+
+    The file is only read and parsed again when its modification time changes,
+    so editing a template on disk is still picked up without restarting the app.
+    """
+    template_path = resource_path(os.path.join("prompts", filename))
+
+    try:
+        mtime = os.stat(template_path).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    with _compiled_templates_lock:
+        cached = _compiled_templates.get(filename)
+        if cached and mtime is not None and cached[0] == mtime:
+            return cached[1]
+
+    # Missing or unreadable files are reported by _load_prompt_template and compile to an empty template
+    compiled = PromptTemplate(_load_prompt_template(filename))
+    if mtime is not None:
+        with _compiled_templates_lock:
+            _compiled_templates[filename] = (mtime, compiled)
+    return compiled
+
+
+def clear_template_cache():
+    """Drops every compiled template, the next render reads the files again."""
+    with _compiled_templates_lock:
+        _compiled_templates.clear()
+
+
 def discover_prompt_templates() -> dict:
     """
     Scans the 'prompts' directory for prompt templates and returns their names.
@@ -66,15 +150,15 @@ def generate_character_card_prompt(
     and replacing placeholders.
     """
     filename = f"{template_name}_character_card.txt"
-    template = _load_prompt_template(filename)
+    template = _load_compiled_template(filename)
 
-    prompt = template.replace("[[[character_to_analyze]]]", character_to_analyze)
-    prompt = prompt.replace("[[[user_role]]]", user_role)
-    prompt = prompt.replace("[[[user_placeholder]]]", user_placeholder)
-    prompt = prompt.replace("[[[caption]]]", caption)
-    prompt = prompt.replace("[[[tags]]]", tags)
-
-    return prompt
+    return template.render(
+        character_to_analyze=character_to_analyze,
+        user_role=user_role,
+        user_placeholder=user_placeholder,
+        caption=caption,
+        tags=tags
+    )
 
 
 def generate_stable_diffusion_prompt(
@@ -89,11 +173,11 @@ def generate_stable_diffusion_prompt(
     replacing placeholders.
     """
     filename = f"{template_name}_stable_diffusion.txt"
-    template = _load_prompt_template(filename)
-
-    prompt = template.replace("[[[character_to_analyze]]]", character_to_analyze)
-    prompt = prompt.replace("[[[caption]]]", caption)
-    prompt = prompt.replace("[[[tags]]]", tags)
-    prompt = prompt.replace("[[[character_card]]]", character_card)
-
-    return prompt
\ No newline at end of file
+    template = _load_compiled_template(filename)
+
+    return template.render(
+        character_to_analyze=character_to_analyze,
+        caption=caption,
+        tags=tags,
+        character_card=character_card
+    )
@@ -0,0 +1,124 @@
+# result_cache.py
+# Remembers raw VLM outputs, so an image that was already captioned with the same model,
+# prompt and settings comes back instantly instead of running the model again.
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from persistence_manager import config_dir
+
+
+def image_content_hash(image) -> str:
+    """
+    Hashes the decoded pixels of a PIL image, so the same picture hits the cache
+    no matter its file name or where it was dropped from.
+
+    Args:
+        image (PIL.Image.Image): The image passed to the model.
+
+    Returns:
+        str: Hex digest of mode, size and pixel data.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent cache of raw generation outputs, stored in SQLite next to app_settings.json.
+
+    The database is shared by every PlotCaption process (GUI, server, batch scripts) and
+    evicts least recently used entries once it grows past max_entries.
+    """
+
+    def __init__(self, db_file="result_cache.sqlite3", db_dir=None, max_entries=5000):
+        """
+        Args:
+            db_file (str): Database file name.
+            db_dir (Path): Directory of the database, defaults to the settings folder.
+            max_entries (int): LRU capacity, older entries are evicted past this size.
+        """
+        self.db_path = Path(db_dir or config_dir) / db_file
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    model_id TEXT,
+                    output TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, generations run on worker threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def make_key(image_hash: str, model_id: str, prompt: str, system_prompt: str, generation_params: dict) -> str:
+        """
+        Builds the cache key. Any change of image, model, prompts or generation parameters is a miss.
+
+        Returns:
+            str: Hex digest identifying the request.
+        """
+        payload = json.dumps([image_hash, model_id, prompt, system_prompt, generation_params or {}],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the cached raw output for key, or None. A hit refreshes its LRU position.
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT output FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with connection:
+                connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+        except sqlite3.Error as e:
+            # A broken cache must never break generation
+            print(f"Result cache lookup failed: {e}")
+            return None
+
+    def put(self, key: str, output: str, model_id: str = None):
+        """Stores a raw output and evicts the least recently used entries over capacity."""
+        if output is None:
+            return
+        now = time.time()
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (key, model_id, output, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, model_id, output, now, now))
+                connection.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    "SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        except sqlite3.Error as e:
+            print(f"Result cache write failed: {e}")
+
+    def clear(self):
+        """Removes every cached result."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM results")
@@ -0,0 +1,168 @@
+# tag_normalizer.py
+# Cleans the tag lists coming out of the VLM parsers: one spelling per tag, no duplicates,
+# aliases resolved, invented tags optionally dropped, and the order the tag prompts ask for
+# (artist:, copyright:, character:, meta:, then general tags).
+import json
+import re
+
+from tag_vocabulary import CATEGORY_ARTIST, CATEGORY_COPYRIGHT, CATEGORY_CHARACTER, CATEGORY_META, \
+    CATEGORY_GENERAL, normalize_tag
+
+# Output order of the categories, anything else goes with the general tags
+CATEGORY_ORDER = (CATEGORY_ARTIST, CATEGORY_COPYRIGHT, CATEGORY_CHARACTER, CATEGORY_META, CATEGORY_GENERAL)
+
+# "artist:name" style prefixes the models (and the tag prompts) use
+CATEGORY_PREFIXES = {
+    "artist": CATEGORY_ARTIST,
+    "copyright": CATEGORY_COPYRIGHT,
+    "series": CATEGORY_COPYRIGHT,
+    "character": CATEGORY_CHARACTER,
+    "meta": CATEGORY_META,
+    "general": CATEGORY_GENERAL,
+}
+_PREFIX_OF_CATEGORY = {CATEGORY_ARTIST: "artist:", CATEGORY_COPYRIGHT: "copyright:",
+                       CATEGORY_CHARACTER: "character:", CATEGORY_META: "meta:"}
+
+_SPLIT_PATTERN = re.compile(r"[,\n]+")
+# Decorations models put around tags: bullets, numbering, quotes, trailing dots
+_STRIP_CHARS = " \t\r\"'`*-•.;"
+_NUMBERING_PATTERN = re.compile(r"^\d+[.)]\s+")
+
+
+class TagNormalizer:
+    """
+    Normalizes comma-separated tag lists against an optional TagVocabulary.
+
+    The work is done per distinct raw tag and memoized: real tag lists reuse the same few
+    thousand tags over and over, so a batch of 100k lists boils down to dict lookups
+    (the string equivalent of a vectorized pass). Without a vocabulary, tags are still
+    split, respelled, deduplicated and ordered by their explicit prefixes.
+    """
+
+    def __init__(self, vocabulary=None, drop_unknown=False, category_prefixes=True, memo_size=500_000):
+        """
+        Args:
+            vocabulary (TagVocabulary): Known tags, aliases and categories. Can be set later.
+            drop_unknown (bool): Remove tags the vocabulary doesn't know (invented by the model).
+            category_prefixes (bool): Write "artist:", "character:"... in front of non-general tags.
+            memo_size (int): Distinct raw tags remembered before the memo is reset.
+        """
+        self._vocabulary = vocabulary
+        self.drop_unknown = drop_unknown
+        self.category_prefixes = category_prefixes
+        self.memo_size = memo_size
+        self._memo = {}
+
+    @property
+    def vocabulary(self):
+        return self._vocabulary
+
+    @vocabulary.setter
+    def vocabulary(self, vocabulary):
+        # Resolutions depend on the vocabulary, start over
+        self._vocabulary = vocabulary
+        self._memo = {}
+
+    def _resolve(self, raw_tag):
+        """
+        Maps one raw tag to (category rank, output text, dedup key), or None to drop it.
+        """
+        text = _NUMBERING_PATTERN.sub("", raw_tag.strip(_STRIP_CHARS)).strip(_STRIP_CHARS)
+        if not text:
+            return None
+
+        category = None
+        prefix, separator, rest = text.partition(":")
+        if separator and rest and normalize_tag(prefix) in CATEGORY_PREFIXES:
+            category = CATEGORY_PREFIXES[normalize_tag(prefix)]
+            text = rest
+
+        name = normalize_tag(text)
+        if not name:
+            return None
+
+        vocabulary = self._vocabulary
+        if vocabulary is not None:
+            tag_id = vocabulary.resolve_id(name)
+            if tag_id < 0 and separator and category is None:
+                tag_id = vocabulary.resolve_id(normalize_tag(raw_tag))  # e.g. "re:zero", a real tag with a colon
+            if tag_id >= 0:
+                name = vocabulary.name(tag_id)
+                category = vocabulary.tag_category(tag_id)
+            elif self.drop_unknown:
+                return None
+
+        if category not in _PREFIX_OF_CATEGORY:
+            category = CATEGORY_GENERAL
+        output = _PREFIX_OF_CATEGORY.get(category, "") + name if self.category_prefixes else name
+        return CATEGORY_ORDER.index(category), output, name
+
+    def normalize_list(self, tags):
+        """
+        Normalizes one tag list.
+
+        Args:
+            tags (str | list): Comma or newline separated tags, or already split tags.
+
+        Returns:
+            list: Clean tags, artist/copyright/character/meta first, model order kept inside a category.
+        """
+        raw_tags = _SPLIT_PATTERN.split(tags) if isinstance(tags, str) else tags
+        memo = self._memo
+        if len(memo) > self.memo_size:
+            memo.clear()
+
+        resolved, seen = [], set()
+        for raw_tag in raw_tags:
+            entry = memo.get(raw_tag, False)
+            if entry is False:
+                entry = memo[raw_tag] = self._resolve(raw_tag)
+            if entry is None or entry[2] in seen:
+                continue
+            seen.add(entry[2])
+            resolved.append(entry)
+        # Stable sort: the model's order survives inside each category
+        resolved.sort(key=lambda item: item[0])
+        return [output for _, output, _ in resolved]
+
+    def normalize(self, tags) -> str:
+        """Normalizes one tag list and joins it back as "tag1, tag2, ..."."""
+        return ", ".join(self.normalize_list(tags))
+
+    def normalize_many(self, tag_lists) -> list:
+        """Normalizes a batch of tag lists, sharing the memo across all of them."""
+        normalize_list = self.normalize_list
+        return [", ".join(normalize_list(tags)) for tags in tag_lists]
+
+    def normalize_manifest(self, input_file, output_file, field="tags", batch_size=10_000) -> int:
+        """
+        Normalizes the tag field of every record of a JSONL manifest (one JSON object per line).
+        Records without the field are copied unchanged.
+
+        Args:
+            input_file (str): Source manifest.
+            output_file (str): Destination manifest.
+            field (str): Name of the tag field.
+            batch_size (int): Records processed and written per batch.
+
+        Returns:
+            int: Number of records written.
+        """
+        written = 0
+        with open(input_file, encoding="utf-8") as source, open(output_file, "w", encoding="utf-8") as destination:
+            batch = []
+            for line in source:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    written += self._write_batch(batch, destination, field)
+                    batch = []
+            written += self._write_batch(batch, destination, field)
+        return written
+
+    def _write_batch(self, records, destination, field):
+        with_tags = [record for record in records if isinstance(record.get(field), (str, list))]
+        for record, tags in zip(with_tags, self.normalize_many(record[field] for record in with_tags)):
+            record[field] = tags
+        destination.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        return len(records)
@@ -0,0 +1,387 @@
+# tag_trie.py
+# Vocabulary-constrained decoding of the tags pass. Every tag of the local vocabulary is
+# tokenized with the model's tokenizer into a token trie. During generation a logits processor
+# walks it and only lets through tokens that continue a known tag, a comma after a complete tag,
+# or the end of the list. The output is made of valid tags only, and the model stops spending
+# tokens on tags the normalizer would throw away.
+#
+# Tokenizing 150k tags takes a while, so the trie is flattened into a few uint32 arrays and
+# cached in the settings folder, one file per vocabulary/tokenizer pair, memory-mapped afterwards.
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+
+from config import TAG_TRIE_FOLDER
+
+_MAGIC = b"PCTRIE01"
+# magic, then: nodes, edges, comma token
+_HEADER = struct.Struct("=8s3I")
+_NO_TAG = 0xFFFFFFFF
+_TOKENIZE_CHUNK = 10000
+
+
+class TagTokenTrie:
+    """
+    Read-only token trie of tag spellings.
+
+    Layout (node 0 is the root):
+        child_offsets: uint32 per node + 1, the children of node n are edges child_offsets[n]..[n+1]
+        child_tokens:  uint32 per edge, sorted within a node (binary searched)
+        child_nodes:   uint32 per edge, the node the edge leads to
+        terminal:      uint32 per node, id of the tag ending there (vocabulary id), or _NO_TAG
+
+    Every tag is stored twice: as written at the start of the list ("long_hair") and after a
+    comma (" long_hair"), tokenizers split the two differently.
+    """
+
+    def __init__(self, buffer):
+        """
+        Args:
+            buffer: bytes or mmap in the compiled format, see compile() and load().
+        """
+        self._buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise ValueError("Compiled tag trie file is truncated.")
+        magic, n_nodes, n_edges, comma_token = _HEADER.unpack_from(view, 0)
+        if magic != _MAGIC:
+            raise ValueError("Not a compiled tag trie file.")
+        # The arrays fill the rest of the file exactly, a cut one would fail mid-decode
+        if len(view) != _HEADER.size + 4 * (2 * n_nodes + 1 + 2 * n_edges):
+            raise ValueError("Compiled tag trie file is truncated.")
+        offset = _HEADER.size
+        sections = []
+        for count in (n_nodes + 1, n_edges, n_edges, n_nodes):
+            sections.append(view[offset:offset + 4 * count].cast("I"))
+            offset += 4 * count
+        self.child_offsets, self.child_tokens, self.child_nodes, self.terminal = sections
+        self.n_nodes = n_nodes
+        self.comma_token = comma_token
+
+    # --- Building ---
+
+    @staticmethod
+    def compile(vocabulary, tokenizer, spaces=False) -> bytes:
+        """
+        Tokenizes every tag of the vocabulary and builds the compiled trie.
+
+        Args:
+            vocabulary (TagVocabulary): The tags.
+            tokenizer: The model's tokenizer (a Hugging Face tokenizer).
+            spaces (bool): Spell the tags with spaces instead of underscores ("long hair").
+
+        Returns:
+            bytes: The compiled trie.
+        """
+        comma = tokenizer.encode(",", add_special_tokens=False)
+        if len(comma) != 1:
+            raise ValueError("The tokenizer has no single token for ','.")
+
+        names = [name for name, _, _ in vocabulary.iter_tags()]
+        sequences = []
+        for start in range(0, len(names), _TOKENIZE_CHUNK):
+            chunk = names[start:start + _TOKENIZE_CHUNK]
+            surfaces = [name.replace("_", " ") if spaces else name for name in chunk]
+            bare = tokenizer(surfaces, add_special_tokens=False)["input_ids"]
+            spaced = tokenizer([" " + surface for surface in surfaces], add_special_tokens=False)["input_ids"]
+            for tag_id, bare_ids, spaced_ids in zip(range(start, start + len(chunk)), bare, spaced):
+                sequences.append((tuple(bare_ids), tag_id))
+                sequences.append((tuple(spaced_ids), tag_id))
+        sequences.sort()
+
+        # Sorted sequences share prefixes with their predecessor: walk them like a DFS, one new
+        # node per token past the common prefix. Edge e leads to node e + 1.
+        parents, tokens, terminal = array("I"), array("I"), array("I", [_NO_TAG])
+        path, previous = [0], ()
+        for sequence, tag_id in sequences:
+            if not sequence:
+                continue
+            common = 0
+            limit = min(len(previous), len(sequence))
+            while common < limit and previous[common] == sequence[common]:
+                common += 1
+            del path[common + 1:]
+            for token in sequence[common:]:
+                parents.append(path[-1])
+                tokens.append(token)
+                terminal.append(_NO_TAG)
+                path.append(len(terminal) - 1)
+            if terminal[path[-1]] == _NO_TAG:
+                terminal[path[-1]] = tag_id
+            previous = sequence
+
+        # Group the edges by parent (CSR), tokens stay sorted within a parent
+        n_nodes, n_edges = len(terminal), len(parents)
+        order = sorted(range(n_edges), key=lambda edge: (parents[edge], tokens[edge]))
+        child_offsets = array("I", [0] * (n_nodes + 1))
+        for edge in range(n_edges):
+            child_offsets[parents[edge] + 1] += 1
+        for node in range(n_nodes):
+            child_offsets[node + 1] += child_offsets[node]
+        child_tokens = array("I", (tokens[edge] for edge in order))
+        child_nodes = array("I", (edge + 1 for edge in order))
+
+        header = _HEADER.pack(_MAGIC, n_nodes, n_edges, comma[0])
+        return header + b"".join(part.tobytes() for part in (child_offsets, child_tokens, child_nodes, terminal))
+
+    @classmethod
+    def load(cls, compiled_file):
+        """Memory-maps a compiled trie written by save()."""
+        with open(compiled_file, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def save(self, compiled_file):
+        """Writes the compiled trie, atomically."""
+        compiled_file = Path(compiled_file)
+        temp_file = compiled_file.with_suffix(compiled_file.suffix + ".tmp")
+        with open(temp_file, "wb") as file:
+            file.write(self._buffer)
+        os.replace(temp_file, compiled_file)
+
+    # --- Lookups ---
+
+    def child(self, node: int, token: int) -> int:
+        """Node reached from node through token, or -1."""
+        start, end = self.child_offsets[node], self.child_offsets[node + 1]
+        position = bisect_left(self.child_tokens, token, start, end)
+        if position < end and self.child_tokens[position] == token:
+            return self.child_nodes[position]
+        return -1
+
+    def children_tokens(self, node: int) -> list:
+        """Tokens continuing a tag from node."""
+        return self.child_tokens[self.child_offsets[node]:self.child_offsets[node + 1]].tolist()
+
+    def tag_at(self, node: int) -> int:
+        """Vocabulary id of the tag ending at node, or -1."""
+        tag_id = self.terminal[node]
+        return -1 if tag_id == _NO_TAG else tag_id
+
+
+def load_tag_trie(vocabulary, tokenizer, spaces=False, trie_dir=None):
+    """
+    Loads the trie of a vocabulary/tokenizer pair from the cache, building it the first time.
+
+    Args:
+        vocabulary (TagVocabulary): The tags.
+        tokenizer: The model's tokenizer.
+        spaces (bool): Spell the tags with spaces instead of underscores.
+        trie_dir (Path): Cache folder, TAG_TRIE_FOLDER in the settings folder by default.
+
+    Returns:
+        TagTokenTrie: The trie.
+    """
+    if trie_dir is None:
+        from persistence_manager import config_dir
+        trie_dir = config_dir / TAG_TRIE_FOLDER
+    key = "|".join((_MAGIC.decode(), vocabulary.fingerprint(), type(tokenizer).__name__,
+                    str(getattr(tokenizer, "name_or_path", "")), str(len(tokenizer)), str(spaces)))
+    compiled_file = Path(trie_dir) / f"{hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()}.tagtrie"
+    if compiled_file.is_file():
+        try:
+            return TagTokenTrie.load(compiled_file)
+        except (OSError, ValueError) as e:
+            print(f"Cached tag trie unreadable ({e}), rebuilding it.")
+
+    print(f"Building the tag trie for {len(vocabulary)} tags...")
+    trie = TagTokenTrie(TagTokenTrie.compile(vocabulary, tokenizer, spaces=spaces))
+    try:
+        compiled_file.parent.mkdir(parents=True, exist_ok=True)
+        trie.save(compiled_file)
+    except OSError as e:
+        print(f"Could not cache the tag trie: {e}")
+    return trie
+
+
+@dataclass
+class TagConstraint:
+    """A trie plus where the tag list sits in the profile's output."""
+    trie: TagTokenTrie
+    section_start: str = ""  # Constraints start after this text, "" = from the first token
+    section_end: str = ""  # Text closing the list, "" = the EOS token
+
+
+# Per-row decoding phases
+_FREE, _TAGS, _CLOSING, _DONE = range(4)
+
+
+class TagTrieLogitsProcessor:
+    """
+    Masks the logits so the tag section only contains vocabulary tags, separated by commas.
+    Before the section starts and after it ends the model writes freely. Tags are written once:
+    the branches leading only to tags already written are pruned, for both spellings of a tag.
+
+    The state of every row is rebuilt from the tokens generated so far, reusing what matched
+    the previous call, so it stays right when generate() rolls back tokens (assisted decoding).
+    Duck-types transformers.LogitsProcessor (a plain callable) like the stopping criteria.
+    """
+
+    def __init__(self, constraint: TagConstraint, tokenizer, prompt_length, eos_token_id):
+        """
+        Args:
+            constraint (TagConstraint): Trie and section markers.
+            tokenizer: The processor's tokenizer, finds the section start in the decoded text.
+            prompt_length (int): Length of the (padded) prompt.
+            eos_token_id: int or list of ints, ends the list when the section has no end text.
+        """
+        self.trie = constraint.trie
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.section_start = constraint.section_start
+        self.start_window = 4 * len(self.section_start) + 1  # Same reasoning as StopSequenceCriteria
+        if constraint.section_end:
+            self.end_tokens = tokenizer.encode(constraint.section_end, add_special_tokens=False)
+            self.end_first = [self.end_tokens[0]]
+        else:
+            self.end_tokens = None
+            self.end_first = list(eos_token_id) if isinstance(eos_token_id, (list, tuple)) else [eos_token_id]
+        # row -> (tokens consumed, states after each of them, {tag id: position},
+        #         {terminal node: (position, edges walked to it)})
+        self._rows = {}
+        self._allowed_cache = {}
+
+    def _initial_state(self):
+        # phase, trie node, index in end_tokens, position of the current tag's first token
+        return (_TAGS, 0, 0, 0) if not self.section_start else (_FREE, 0, 0, 0)
+
+    def _advance(self, state, generated, position, used, walked):
+        """State after generated[position], used and walked get the tag completed by it."""
+        phase, node, end_index, tag_start = state
+        token = generated[position]
+        if phase == _FREE:
+            tail = self.tokenizer.decode(generated[max(0, position + 1 - self.start_window):position + 1],
+                                         skip_special_tokens=True)
+            return (_TAGS, 0, 0, position + 1) if self.section_start in tail else state
+        if phase == _TAGS:
+            child = self.trie.child(node, token)
+            if child >= 0:
+                return _TAGS, child, 0, tag_start
+            tag_id = self.trie.tag_at(node)
+            if tag_id >= 0:
+                used.setdefault(tag_id, position)
+                for terminal, edges in self._spellings(generated[tag_start:position], tag_id):
+                    walked.setdefault(terminal, (position, edges))
+            if token == self.trie.comma_token:
+                return _TAGS, 0, 0, position + 1
+            if token in self.end_first:
+                if self.end_tokens and len(self.end_tokens) > 1:
+                    return _CLOSING, 0, 1, tag_start
+                return _DONE, 0, 0, tag_start
+            return _DONE, 0, 0, tag_start  # Can only happen if another processor forced a token, stop constraining
+        if phase == _CLOSING:
+            end_index += 1
+            if end_index >= len(self.end_tokens):
+                return _DONE, 0, 0, tag_start
+            return _CLOSING, 0, end_index, tag_start
+        return state
+
+    def _spellings(self, tokens, tag_id):
+        """
+        Yields (terminal node, edges) of both spellings of a tag just written (see TagTokenTrie),
+        the other one found by encoding the text again. Edges are (parent node, token, child node).
+        """
+        surface = self.tokenizer.decode(tokens, skip_special_tokens=True).strip()
+        spellings = {tuple(tokens)}
+        if surface:
+            spellings.update(tuple(self.tokenizer.encode(text, add_special_tokens=False))
+                             for text in (surface, " " + surface))
+        for spelling in spellings:
+            edges, node = [], 0
+            for token in spelling:
+                child = self.trie.child(node, token)
+                if child < 0:
+                    break
+                edges.append((node, token, child))
+                node = child
+            else:
+                if edges and self.trie.tag_at(node) == tag_id:
+                    yield node, tuple(edges)
+
+    def _row_state(self, row, generated):
+        consumed, states, used, walked = self._rows.get(row, ([], [self._initial_state()], {}, {}))
+        limit = min(len(consumed), len(generated))
+        if consumed[:limit] == generated[:limit]:
+            common = limit  # The usual case: one more token than last time
+        else:
+            common = 0
+            while common < limit and consumed[common] == generated[common]:
+                common += 1
+        if common < len(consumed):  # Rolled back
+            del states[common + 1:]
+            for tag_id in [tag_id for tag_id, position in used.items() if position >= common]:
+                del used[tag_id]
+            for node in [node for node, (position, _) in walked.items() if position >= common]:
+                del walked[node]
+        for position in range(common, len(generated)):
+            states.append(self._advance(states[-1], generated, position, used, walked))
+        self._rows[row] = (generated, states, used, walked)
+        return states[-1], used, walked
+
+    def _only_used(self, node, used) -> bool:
+        """True if every tag below node (node included) was written already."""
+        trie, stack = self.trie, [node]
+        while stack:
+            node = stack.pop()
+            tag_id = trie.tag_at(node)
+            if tag_id >= 0 and tag_id not in used:
+                return False  # Usually right away: the first tag found is new
+            stack.extend(trie.child_nodes[trie.child_offsets[node]:trie.child_offsets[node + 1]])
+        return True
+
+    def _allowed_key(self, state, used, walked):
+        """What the state allows, as a hashable key (see _allowed_tokens), None when anything goes."""
+        phase, node, end_index, _ = state
+        if phase == _CLOSING:
+            return "end", end_index, ()
+        if phase != _TAGS:
+            return None
+        # Only the branches a written tag went through can be used up
+        candidates = {(token, child) for _, edges in walked.values()
+                      for parent, token, child in edges if parent == node}
+        pruned = frozenset(token for token, child in candidates if self._only_used(child, used))
+        return node, self.trie.tag_at(node) >= 0, pruned
+
+    def _allowed_tokens(self, key) -> list:
+        node, complete, pruned = key
+        if node == "end":
+            return [self.end_tokens[complete]]
+        children = [token for token in self.trie.children_tokens(node) if token not in pruned]
+        if complete:  # A tag ends here: continue it, or a comma, or the end of the list
+            return children + [self.trie.comma_token] + self.end_first
+        # Inside a tag: continue it, nowhere left to go but the end otherwise
+        return children or list(self.end_first)
+
+    def _allowed_tensor(self, state, used, walked, device):
+        """Allowed token ids as a tensor, cached: the root (after every comma) has tens of thousands."""
+        import torch
+        key = self._allowed_key(state, used, walked)
+        if key is None:
+            return None
+        if key not in self._allowed_cache:
+            self._allowed_cache[key] = torch.tensor(self._allowed_tokens(key), dtype=torch.long, device=device)
+        return self._allowed_cache[key]
+
+    def __call__(self, input_ids, scores):
+        import torch
+        processed = scores
+        for row in range(input_ids.shape[0]):
+            state, used, walked = self._row_state(row, input_ids[row, self.prompt_length:].tolist())
+            allowed = self._allowed_tensor(state, used, walked, scores.device)
+            if allowed is None:
+                continue
+            if processed is scores:
+                processed = scores.clone()
+            kept = scores[row, allowed]
+            processed[row] = float("-inf")
+            if torch.isinf(kept).all():
+                # Another processor (no_repeat_ngram_size...) banned every allowed token: end the list
+                processed[row, self.end_first if state[0] == _TAGS else allowed] = 0.0
+                continue
+            processed[row, allowed] = kept
+        return processed
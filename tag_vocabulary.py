@@ -0,0 +1,384 @@
+# tag_vocabulary.py
+# Local booru tag vocabulary: names, categories, post counts, aliases and implications,
+# kept in a few flat arrays and UTF-8 blobs instead of hundreds of thousands of Python objects.
+# The compiled form is cached next to the CSV and memory-mapped on the next start.
+import csv
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+
+from config import TAG_VOCABULARY_FILE, TAG_IMPLICATIONS_FILE
+
+# Danbooru tag categories
+CATEGORY_GENERAL = 0
+CATEGORY_ARTIST = 1
+CATEGORY_COPYRIGHT = 3
+CATEGORY_CHARACTER = 4
+CATEGORY_META = 5
+
+CATEGORY_NAMES = {
+    CATEGORY_GENERAL: "general",
+    CATEGORY_ARTIST: "artist",
+    CATEGORY_COPYRIGHT: "copyright",
+    CATEGORY_CHARACTER: "character",
+    CATEGORY_META: "meta",
+}
+
+_MAGIC = b"PCTAGV02"
+# magic, then: tags, name blob bytes, aliases, alias blob bytes, implications, flags
+_HEADER = struct.Struct("=8s6I")
+_FLAG_IMPLICATIONS_FILE = 1  # Built with an implications CSV, stale once that file is gone
+_N_CATEGORIES = 256
+
+
+def normalize_tag(text: str) -> str:
+    """
+    Brings a tag to its Danbooru spelling: lowercase, trimmed, spaces as underscores.
+    "Long Hair" -> "long_hair".
+    """
+    return "_".join(text.strip().lower().split())
+
+
+class _Sections:
+    """Sequential reader/writer of 4-byte aligned sections in a flat buffer."""
+
+    def __init__(self, buffer=None):
+        self.buffer = buffer
+        self.offset = _HEADER.size
+        self.parts = []
+
+    # --- writing ---
+    def add(self, data: bytes):
+        self.parts.append(data)
+        self.parts.append(b"\0" * (-len(data) % 4))
+
+    # --- reading ---
+    def take_bytes(self, length) -> memoryview:
+        if self.offset + length > len(self.buffer):
+            raise ValueError("Compiled file is truncated.")
+        view = self.buffer[self.offset:self.offset + length]
+        self.offset += length + (-length % 4)
+        return view
+
+    def take_uint32(self, count) -> memoryview:
+        return self.take_bytes(4 * count).cast("I")
+
+
+class TagVocabulary:
+    """
+    Read-only tag vocabulary with O(log n) lookups.
+
+    Layout (all sorted by UTF-8 bytes, which is code point order):
+        names:        one UTF-8 blob + offsets, binary searched without decoding every entry
+        categories:   one byte per tag
+        post_counts:  uint32 per tag
+        aliases:      their own blob + offsets, and the tag id each alias points to
+        implications: CSR arrays, tag id -> ids of the tags it implies
+        by category:  tag ids grouped by category, most used first
+
+    Everything lives in one buffer: bytes when built from CSV, a read-only mmap when loaded
+    from a compiled file, so a 300k tag list costs a few MB and starts instantly.
+    The compiled file uses native byte order, it is a local cache, not an exchange format.
+    """
+
+    def __init__(self, buffer):
+        """
+        Args:
+            buffer: bytes or mmap in the compiled format, see compile() and load().
+        """
+        self._buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise ValueError("Compiled tag vocabulary file is truncated.")
+        magic, n_tags, names_size, n_aliases, aliases_size, n_implications, flags = _HEADER.unpack_from(view, 0)
+        if magic != _MAGIC:
+            raise ValueError("Not a compiled tag vocabulary file (or an older format).")
+
+        sections = _Sections(view)
+        self._name_offsets = sections.take_uint32(n_tags + 1)
+        self._names = sections.take_bytes(names_size)
+        self._categories = sections.take_bytes(n_tags)
+        self._post_counts = sections.take_uint32(n_tags)
+        self._alias_offsets = sections.take_uint32(n_aliases + 1)
+        self._alias_names = sections.take_bytes(aliases_size)
+        self._alias_targets = sections.take_uint32(n_aliases)
+        self._implication_offsets = sections.take_uint32(n_tags + 1)
+        self._implication_targets = sections.take_uint32(n_implications)
+        self._category_offsets = sections.take_uint32(_N_CATEGORIES + 1)
+        self._category_members = sections.take_uint32(n_tags)
+        self._n_tags = n_tags
+        self._n_aliases = n_aliases
+        self.built_with_implications_file = bool(flags & _FLAG_IMPLICATIONS_FILE)
+        self._fingerprint = None
+
+    # --- Building ---
+
+    @staticmethod
+    def compile(tags, implications=(), implications_file=False) -> bytes:
+        """
+        Builds the compiled buffer.
+
+        Args:
+            tags (iterable): (name, category, post_count, aliases) tuples, aliases being a list of names.
+            implications (iterable): (antecedent, consequent) name pairs.
+            implications_file (bool): The implications come from a file, recorded for the staleness check.
+
+        Returns:
+            bytes: The compiled vocabulary.
+        """
+        entries = {}
+        for name, category, post_count, aliases in tags:
+            name = normalize_tag(name)
+            if not name:
+                continue
+            previous = entries.get(name)
+            # Duplicate rows: keep the most used one
+            if previous is None or post_count > previous[1]:
+                entries[name] = (int(category) & 0xFF, max(0, int(post_count)), aliases)
+
+        encoded = sorted((name.encode("utf-8"), name) for name in entries)
+        tag_ids = {name: tag_id for tag_id, (_, name) in enumerate(encoded)}
+
+        name_offsets, names = array("I", [0]), bytearray()
+        categories, post_counts = bytearray(), array("I")
+        for raw, name in encoded:
+            names += raw
+            name_offsets.append(len(names))
+            category, post_count, _ = entries[name]
+            categories.append(category)
+            post_counts.append(min(post_count, 0xFFFFFFFF))
+
+        alias_pairs = {}
+        for name, (_, _, aliases) in entries.items():
+            for alias in aliases:
+                alias = normalize_tag(alias)
+                # An alias never shadows a real tag, and the first tag claiming it wins
+                if alias and alias not in tag_ids and alias not in alias_pairs:
+                    alias_pairs[alias] = tag_ids[name]
+        alias_offsets, alias_names, alias_targets = array("I", [0]), bytearray(), array("I")
+        for raw, alias in sorted((alias.encode("utf-8"), alias) for alias in alias_pairs):
+            alias_names += raw
+            alias_offsets.append(len(alias_names))
+            alias_targets.append(alias_pairs[alias])
+
+        implied = {}  # Only a small share of the tags imply anything
+        for antecedent, consequent in implications:
+            source, target = tag_ids.get(normalize_tag(antecedent)), tag_ids.get(normalize_tag(consequent))
+            if source is not None and target is not None and source != target:
+                implied.setdefault(source, set()).add(target)
+        implication_offsets, implication_targets = array("I", [0]), array("I")
+        for tag_id in range(len(encoded)):
+            if tag_id in implied:
+                implication_targets.extend(sorted(implied[tag_id]))
+            implication_offsets.append(len(implication_targets))
+
+        by_category = sorted(range(len(encoded)), key=lambda i: (categories[i], -post_counts[i], i))
+        category_offsets = array("I", [0] * (_N_CATEGORIES + 1))
+        for tag_id in by_category:
+            category_offsets[categories[tag_id] + 1] += 1
+        for category in range(_N_CATEGORIES):
+            category_offsets[category + 1] += category_offsets[category]
+
+        sections = _Sections()
+        for part in (name_offsets, names, categories, post_counts, alias_offsets, alias_names, alias_targets,
+                     implication_offsets, implication_targets, category_offsets, array("I", by_category)):
+            sections.add(part.tobytes() if isinstance(part, array) else bytes(part))
+        header = _HEADER.pack(_MAGIC, len(encoded), len(names), len(alias_targets), len(alias_names),
+                              len(implication_targets), _FLAG_IMPLICATIONS_FILE if implications_file else 0)
+        return header + b"".join(sections.parts)
+
+    @classmethod
+    def from_csv(cls, tags_file, implications_file=None):
+        """
+        Reads a tag CSV (name,category,post_count,"alias1,alias2") and optional implications
+        CSV (antecedent,consequent). Header rows and malformed lines are skipped.
+        """
+        return cls(cls.compile(_read_tags_csv(tags_file),
+                               _read_implications_csv(implications_file) if implications_file else (),
+                               implications_file=bool(implications_file)))
+
+    @classmethod
+    def load(cls, compiled_file):
+        """Memory-maps a compiled vocabulary written by save()."""
+        with open(compiled_file, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def save(self, compiled_file):
+        """Writes the compiled vocabulary, atomically."""
+        compiled_file = Path(compiled_file)
+        temp_file = compiled_file.with_suffix(compiled_file.suffix + ".tmp")
+        with open(temp_file, "wb") as file:
+            file.write(self._buffer)
+        os.replace(temp_file, compiled_file)
+
+    # --- Lookups ---
+
+    def __len__(self):
+        return self._n_tags
+
+    def fingerprint(self) -> str:
+        """Hex digest of the tag names, identifies the vocabulary in derived caches (computed once)."""
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.blake2b(self._names, digest_size=16).hexdigest()
+        return self._fingerprint
+
+    def __contains__(self, name):
+        return self.find(name) >= 0
+
+    @staticmethod
+    def _bisect(offsets, blob, count, key: bytes) -> int:
+        """Index of key in a sorted blob, or -1."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(blob[offsets[mid]:offsets[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < count and blob[offsets[lo]:offsets[lo + 1]] == key:
+            return lo
+        return -1
+
+    def find(self, name: str) -> int:
+        """Id of a canonical tag name (normalized first), or -1. Aliases are not followed."""
+        return self._bisect(self._name_offsets, self._names, self._n_tags, normalize_tag(name).encode("utf-8"))
+
+    def resolve_id(self, name: str) -> int:
+        """Id of a tag or of the tag an alias points to, or -1."""
+        key = normalize_tag(name).encode("utf-8")
+        tag_id = self._bisect(self._name_offsets, self._names, self._n_tags, key)
+        if tag_id >= 0:
+            return tag_id
+        alias_id = self._bisect(self._alias_offsets, self._alias_names, self._n_aliases, key)
+        return self._alias_targets[alias_id] if alias_id >= 0 else -1
+
+    def resolve(self, name: str):
+        """Canonical name of a tag or alias ("Long Hair", "longhair" -> "long_hair"), or None."""
+        tag_id = self.resolve_id(name)
+        return self.name(tag_id) if tag_id >= 0 else None
+
+    def name(self, tag_id: int) -> str:
+        return bytes(self._names[self._name_offsets[tag_id]:self._name_offsets[tag_id + 1]]).decode("utf-8")
+
+    def tag_category(self, tag_id: int) -> int:
+        """Category number of a tag id."""
+        return self._categories[tag_id]
+
+    def category(self, name: str):
+        """Category number of a tag or alias, or None if unknown."""
+        tag_id = self.resolve_id(name)
+        return self._categories[tag_id] if tag_id >= 0 else None
+
+    def post_count(self, name: str) -> int:
+        """Post count of a tag or alias, 0 if unknown."""
+        tag_id = self.resolve_id(name)
+        return self._post_counts[tag_id] if tag_id >= 0 else 0
+
+    def implications(self, name: str, transitive=True) -> list:
+        """
+        Tags implied by a tag, e.g. "cat_ears" -> ["animal_ears"].
+
+        Args:
+            name (str): Tag or alias.
+            transitive (bool): Follow implications of implications.
+
+        Returns:
+            list: Canonical names, without the tag itself.
+        """
+        tag_id = self.resolve_id(name)
+        if tag_id < 0:
+            return []
+        seen, pending = {tag_id}, [tag_id]
+        result = []
+        while pending:
+            current = pending.pop()
+            for position in range(self._implication_offsets[current], self._implication_offsets[current + 1]):
+                implied = self._implication_targets[position]
+                if implied not in seen:
+                    seen.add(implied)
+                    result.append(implied)
+                    if transitive:
+                        pending.append(implied)
+        return [self.name(implied) for implied in result]
+
+    def tags_in_category(self, category: int, limit=None) -> list:
+        """Names of a category, most used first."""
+        start, end = self._category_offsets[category], self._category_offsets[category + 1]
+        if limit is not None:
+            end = min(end, start + limit)
+        return [self.name(self._category_members[position]) for position in range(start, end)]
+
+    def category_size(self, category: int) -> int:
+        return self._category_offsets[category + 1] - self._category_offsets[category]
+
+    def iter_tags(self):
+        """Yields (name, category, post_count) in name order."""
+        for tag_id in range(self._n_tags):
+            yield self.name(tag_id), self._categories[tag_id], self._post_counts[tag_id]
+
+
+def _read_tags_csv(tags_file):
+    with open(tags_file, newline="", encoding="utf-8") as file:
+        for row in csv.reader(file):
+            if len(row) < 2:
+                continue
+            try:
+                category = int(row[1])
+                post_count = int(float(row[2])) if len(row) > 2 and row[2] else 0
+            except ValueError:
+                continue  # Header line
+            aliases = [alias for alias in row[3].split(",") if alias.strip()] if len(row) > 3 else []
+            yield row[0], category, post_count, aliases
+
+
+def _read_implications_csv(implications_file):
+    with open(implications_file, newline="", encoding="utf-8") as file:
+        for row in csv.reader(file):
+            if len(row) >= 2 and row[0] != "antecedent_name":
+                yield row[0], row[1]
+
+
+def load_tag_vocabulary(tags_dir=None):
+    """
+    Loads the user's tag vocabulary from the settings folder, using the compiled cache when
+    it is newer than the CSV files and was built from the same ones. An unreadable cache is rebuilt.
+
+    Args:
+        tags_dir (Path): Folder holding TAG_VOCABULARY_FILE, defaults to the settings folder.
+
+    Returns:
+        TagVocabulary: The vocabulary, or None if there is no tag list.
+    """
+    if tags_dir is None:
+        from persistence_manager import config_dir
+        tags_dir = config_dir
+    tags_file = Path(tags_dir) / TAG_VOCABULARY_FILE
+    implications_file = Path(tags_dir) / TAG_IMPLICATIONS_FILE
+    compiled_file = tags_file.with_suffix(".tagvocab")
+    if not tags_file.is_file():
+        return None
+
+    sources = [tags_file] + ([implications_file] if implications_file.is_file() else [])
+    newest_source = max(source.stat().st_mtime_ns for source in sources)
+    if compiled_file.is_file() and compiled_file.stat().st_mtime_ns >= newest_source:
+        try:
+            vocabulary = TagVocabulary.load(compiled_file)
+        except (OSError, ValueError) as e:
+            print(f"Compiled tag vocabulary unreadable ({e}), rebuilding it.")
+        else:
+            # An implications file added with an old mtime, or removed, doesn't show in the mtimes
+            if vocabulary.built_with_implications_file == implications_file.is_file():
+                return vocabulary
+            print("Tag implications file added or removed, rebuilding the tag vocabulary.")
+
+    print(f"Compiling tag vocabulary from {tags_file}...")
+    vocabulary = TagVocabulary.from_csv(tags_file, implications_file if implications_file.is_file() else None)
+    try:
+        vocabulary.save(compiled_file)
+    except OSError as e:
+        print(f"Could not cache the compiled tag vocabulary: {e}")
+    return vocabulary
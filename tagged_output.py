@@ -0,0 +1,105 @@
+# tagged_output.py
+# Incremental parser for outputs made of tagged sections, like ToriiGate's
+#   <analysis>...</analysis> <tags>...</tags> <convenient_description>...</convenient_description>
+# Text is fed in chunks as it is generated (a streamer, a stopping criteria) and every section is
+# handed out the moment its closing tag arrives. Only the section being written (and a possible
+# half-written tag) is buffered, sections that were handed out are not kept.
+# Like r"<name>(.*?)</name>" with re.DOTALL, the first closing tag ends a section and tags inside
+# an open section are just text. Sections are read one after the other: the regexes also find a
+# section after one that never closes, this parser stops at the unclosed one.
+import re
+
+_OPEN_TAG = re.compile(r"<([A-Za-z_][\w-]*)>")
+_MAX_TAG_LENGTH = 64  # A "<" followed by more than this without ">" is not the start of a tag
+
+
+class TaggedOutputParser:
+    """
+    Consumes text chunks and returns the sections that were completed by each one.
+
+    Example:
+        parser = TaggedOutputParser()
+        for chunk in chunks:
+            for name, content in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self, sections=None):
+        """
+        Args:
+            sections: Names of the sections to parse (e.g. ("tags", "convenient_description")).
+                Other tags are ignored like plain text. Every tag name if None.
+        """
+        self.sections = frozenset(sections) if sections is not None else None
+        self._open = None  # Name of the section being written
+        self._close_tag = ""
+        self._buffer = ""  # Content of the open section, or the unparsed tail outside sections
+        self._scanned = 0  # Start of the part of _buffer not searched for the closing tag yet
+
+    @property
+    def open_section(self):
+        """Name of the section being written, None between sections."""
+        return self._open
+
+    @property
+    def pending(self) -> str:
+        """What the open section holds so far (may end with part of its closing tag)."""
+        return self._buffer if self._open is not None else ""
+
+    def feed(self, text: str) -> list:
+        """
+        Adds generated text.
+
+        Returns:
+            list: (name, content) of the sections closed by this text, in order. Content is stripped.
+        """
+        self._buffer += text
+        completed = []
+        while True:
+            if self._open is None:
+                if not self._find_open_tag():
+                    return completed
+            else:
+                end = self._buffer.find(self._close_tag, self._scanned)
+                if end < 0:
+                    # The closing tag may be cut in two, its start is searched again with the next chunk
+                    self._scanned = max(0, len(self._buffer) - len(self._close_tag) + 1)
+                    return completed
+                completed.append((self._open, self._buffer[:end].strip()))
+                self._buffer = self._buffer[end + len(self._close_tag):]
+                self._open = None
+
+    def _find_open_tag(self) -> bool:
+        """Opens the next section in the buffer, drops the text before it. False if there is none yet."""
+        position = 0
+        while True:
+            match = _OPEN_TAG.search(self._buffer, position)
+            if match is None:
+                break
+            if self.sections is None or match.group(1) in self.sections:
+                self._open = match.group(1)
+                self._close_tag = f"</{self._open}>"
+                self._buffer = self._buffer[match.end():]
+                self._scanned = 0
+                return True
+            position = match.end()
+        # Text outside sections is dropped, except a "<" that may start a tag in the next chunk
+        start = self._buffer.rfind("<")
+        if start < 0 or ">" in self._buffer[start:] or len(self._buffer) - start > _MAX_TAG_LENGTH:
+            self._buffer = ""
+        else:
+            self._buffer = self._buffer[start:]
+        return False
+
+
+def parse_tagged_output(raw_output: str, sections=None) -> dict:
+    """
+    Parses a finished output with TaggedOutputParser.
+
+    Returns:
+        dict: Section name -> stripped content of its first complete occurrence.
+    """
+    fields = {}
+    for name, content in TaggedOutputParser(sections).feed(raw_output):
+        fields.setdefault(name, content)
+    return fields
@@ -1,7 +1,177 @@
+import heapq
+import threading
 import tkinter as tk
+from array import array
+from bisect import bisect_left
 from tkinter import ttk
 from config import FIELD_BACK_COLOR, FIELD_FOREGROUND_COLOR, SELECT_BACKGROUND_COLOR
 
+# Characters that start a new word inside a completion, e.g. "long_hair" or "artist:name"
+WORD_SEPARATORS = frozenset(" _-:(/")
+
+# Match quality, lower ranks first
+_TIER_EXACT, _TIER_PREFIX, _TIER_WORD_PREFIX, _TIER_SUBSTRING = range(4)
+
+
+class _RangeMin:
+    """
+    Min segment tree over an array of ints. iter_smallest() yields the values of a range
+    in increasing order, lazily: the top K of a huge range cost O(K log n), not a full scan.
+    """
+
+    _EMPTY = 0xFFFFFFFF
+
+    def __init__(self, values):
+        size = 1
+        while size < max(1, len(values)):
+            size *= 2
+        tree = array('I', [self._EMPTY]) * (2 * size)
+        tree[size:size + len(values)] = array('I', values)
+        for node in range(size - 1, 0, -1):
+            left, right = tree[2 * node], tree[2 * node + 1]
+            tree[node] = left if left < right else right
+        self._size = size
+        self._tree = tree
+
+    def iter_smallest(self, lo, hi):
+        tree, size = self._tree, self._size
+        # Nodes exactly covering [lo, hi), then expanded best first
+        heap = []
+        left, right = lo + size, hi + size
+        while left < right:
+            if left & 1:
+                heap.append((tree[left], left))
+                left += 1
+            if right & 1:
+                right -= 1
+                heap.append((tree[right], right))
+            left >>= 1
+            right >>= 1
+        heapq.heapify(heap)
+        while heap:
+            value, node = heapq.heappop(heap)
+            if node >= size:
+                yield value
+                continue
+            for child in (2 * node, 2 * node + 1):
+                if tree[child] != self._EMPTY:
+                    heapq.heappush(heap, (tree[child], child))
+
+
+class CompletionIndex:
+    """
+    Search index over a (possibly huge) list of completions, e.g. a booru tag vocabulary.
+
+    Every entry gets a global rank: higher weight (e.g. post count) first, then shorter,
+    then alphabetical. Matches are grouped exact > prefix > word prefix > substring and
+    ranked inside each group, only the top `limit` are produced.
+
+    - Prefix matches: bisect in the sorted lowercase keys, then the best ranks of that
+      range come from a min segment tree, so "a" on 150k tags costs about as much as "long_ha".
+    - Word-prefix matches ("ha" -> "long_hair"): same thing over the suffixes that start
+      after a word separator.
+    - Other substrings (3+ characters, shorter ones match almost everything): the rarest
+      trigram of the query gives a short candidate list, verified with a plain `in`.
+    """
+
+    def __init__(self, completions=(), weights=None):
+        """
+        Args:
+            completions (iterable): The strings to search.
+            weights (iterable): Optional popularity of each completion, same order. Higher ranks first.
+        """
+        self.entries = list(completions)
+        self.keys = [entry.lower() for entry in self.entries]
+        weights = list(weights) if weights is not None else [0] * len(self.entries)
+
+        # Global rank of every entry, and back
+        self._by_rank = sorted(range(len(self.keys)),
+                               key=lambda i: (-weights[i], len(self.keys[i]), self.keys[i]))
+        rank_of = array('I', bytes(4 * len(self.keys)))
+        for rank, entry_id in enumerate(self._by_rank):
+            rank_of[entry_id] = rank
+        self._rank_of = rank_of
+
+        # Whole keys, sorted
+        key_order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self._prefix_keys = [self.keys[i] for i in key_order]
+        self._prefix_ranks = _RangeMin([rank_of[i] for i in key_order])
+
+        # Suffixes starting a word inside a key, sorted
+        word_starts = []
+        for entry_id, key in enumerate(self.keys):
+            for position in range(1, len(key)):
+                if key[position - 1] in WORD_SEPARATORS and key[position] not in WORD_SEPARATORS:
+                    word_starts.append((key[position:], rank_of[entry_id]))
+        word_starts.sort()
+        self._word_keys = [suffix for suffix, _ in word_starts]
+        self._word_ranks = _RangeMin([rank for _, rank in word_starts])
+
+        # Trigram -> ids of the entries containing it
+        postings = {}
+        for entry_id, key in enumerate(self.keys):
+            for gram in {key[i:i + 3] for i in range(len(key) - 2)}:
+                postings.setdefault(gram, []).append(entry_id)
+        self._trigrams = {gram: array('I', ids) for gram, ids in postings.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _range(sorted_keys, query):
+        lo = bisect_left(sorted_keys, query)
+        return lo, bisect_left(sorted_keys, query + "\uffff", lo)
+
+    def search(self, text, limit=50) -> list:
+        """
+        Returns the best completions containing text (case-insensitive).
+
+        Args:
+            text (str): What the user typed.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list: Completions, best first.
+        """
+        query = text.lower().strip()
+        if not query or not self.entries or limit <= 0:
+            return []
+
+        results, seen = [], set()
+
+        def take(ranks):
+            for rank in ranks:
+                if rank not in seen:
+                    seen.add(rank)
+                    results.append(self._by_rank[rank])
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        # Exact, then prefix
+        lo, hi = self._range(self._prefix_keys, query)
+        exact_hi = lo
+        while exact_hi < hi and self._prefix_keys[exact_hi] == query:
+            exact_hi += 1
+        if take(self._prefix_ranks.iter_smallest(lo, exact_hi)) or \
+                take(self._prefix_ranks.iter_smallest(exact_hi, hi)):
+            return [self.entries[i] for i in results]
+
+        # Word prefix
+        lo, hi = self._range(self._word_keys, query)
+        if take(self._word_ranks.iter_smallest(lo, hi)):
+            return [self.entries[i] for i in results]
+
+        # Substring in the middle of a word
+        if len(query) >= 3:
+            grams = [query[i:i + 3] for i in range(len(query) - 2)]
+            candidates = min((self._trigrams.get(gram, ()) for gram in grams), key=len)
+            ranks = [self._rank_of[i] for i in candidates if query in self.keys[i]]
+            take(heapq.nsmallest(limit, ranks))
+
+        return [self.entries[i] for i in results]
+
+
 class AutocompleteEntry(ttk.Frame):
     """
     A tkinter widget that features a text entry box with an autocomplete dropdown.
@@ -9,20 +179,30 @@ class AutocompleteEntry(ttk.Frame):
     The dropdown list appears as the user types and suggests completions from a
     provided list of options. The user can navigate the suggestions with arrow
     keys and select one with Enter or a mouse click.
+
+    Lookups go through a CompletionIndex and are debounced: a burst of keystrokes
+    triggers a single search, once typing pauses for debounce_ms.
     """
 
-    def __init__(self, parent, completions=None, **kwargs):
+    def __init__(self, parent, completions=None, max_results=50, debounce_ms=60, **kwargs):
         """
         Initializes the AutocompleteEntry widget.
 
         Args:
             parent: The parent tkinter widget.
             completions (list): A list of strings to be used as autocomplete suggestions.
+            max_results (int): Number of suggestions shown, best first.
+            debounce_ms (int): Quiet time after the last keystroke before searching.
             **kwargs: Keyword arguments to be passed to the underlying tk.Entry widget.
         """
         super().__init__(parent)
 
         self.completions = sorted(completions) if completions else []
+        self.index = CompletionIndex(self.completions)
+        self.max_results = max_results
+        self.debounce_ms = debounce_ms
+        self._pending_search = None
+        self.listbox_active = False
         self.var = tk.StringVar()
 
         self.entry = ttk.Entry(self, textvariable=self.var, style='Dark.TEntry', **kwargs)
@@ -47,15 +227,21 @@ class AutocompleteEntry(ttk.Frame):
         """
         Handles the event when the text in the entry box changes.
 
-        Filters the completion list based on the current text and updates the
-        suggestion listbox.
+        Schedules a lookup of the current text, replacing any lookup still pending.
         """
-        text = self.var.get().lower()
-        if not text:
+        if self._pending_search is not None:
+            self.after_cancel(self._pending_search)
+        self._pending_search = self.after(self.debounce_ms, self._update_suggestions)
+
+    def _update_suggestions(self):
+        """Searches the index for the current text and updates the suggestion listbox."""
+        self._pending_search = None
+        text = self.var.get()
+        if not text.strip():
             self.hide_listbox()
             return
 
-        matches = [comp for comp in self.completions if text in comp.lower()]
+        matches = self.index.search(text, self.max_results)
         if matches:
             self.show_listbox(matches)
         else:
@@ -68,11 +254,12 @@ class AutocompleteEntry(ttk.Frame):
         Args:
             completions (list): The list of strings to display.
         """
-        if not hasattr(self, 'listbox_active') or not self.listbox_active:
+        # Refresh the items on every search, one insert call for the whole list
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *completions)
+
+        if not self.listbox_active:
             self.listbox_active = True
-            self.listbox.delete(0, tk.END)
-            for item in completions:
-                self.listbox.insert(tk.END, item)
 
             # Calculate position relative to the toplevel window
             x = self.winfo_rootx() - self.winfo_toplevel().winfo_rootx()
@@ -85,7 +272,7 @@ class AutocompleteEntry(ttk.Frame):
 
     def hide_listbox(self, event=None):
         """Hides the autocomplete listbox."""
-        if hasattr(self, 'listbox_active') and self.listbox_active:
+        if self.listbox_active:
             self.listbox.place_forget()
             self.listbox_active = False
 
@@ -155,11 +342,24 @@ class AutocompleteEntry(ttk.Frame):
         """Inserts text into the entry widget."""
         self.var.set(text)
 
-    def set_completions(self, completions):
+    def set_completions(self, completions, weights=None, background=False):
         """
         Updates the list of autocomplete suggestions.
 
         Args:
             completions (list): The new list of strings for suggestions.
+            weights (list): Optional popularity of each completion (same order), used for ranking.
+            background (bool): Build the index in a worker thread, for very large vocabularies.
+                The previous suggestions keep working until the new index is ready.
         """
-        self.completions = sorted(completions)
+        completions = list(completions)
+
+        def build():
+            index = CompletionIndex(completions, weights)
+            # A single attribute swap, the Tk thread sees either the old or the new index
+            self.completions, self.index = sorted(completions), index
+
+        if background:
+            threading.Thread(target=build, daemon=True).start()
+        else:
+            build()
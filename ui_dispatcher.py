@@ -0,0 +1,112 @@
+# ui_dispatcher.py
+# Event-driven worker -> UI messaging. Worker threads post messages and wake the Tk loop
+# with a virtual event; the Tk thread then drains everything that is pending in one go.
+import queue
+import threading
+import tkinter as tk
+
+
+class _ChannelPoster:
+    """
+    Queue-like handle for a single channel, so worker code can keep doing q.put((type, data)).
+    """
+
+    def __init__(self, dispatcher, channel):
+        self.dispatcher = dispatcher
+        self.channel = channel
+
+    def put(self, message):
+        message_type, data = message
+        self.dispatcher.post(self.channel, message_type, data)
+
+
+class UIDispatcher:
+    """
+    Delivers messages from worker threads to handlers running on the Tk thread.
+
+    Nothing polls: a post wakes the Tk loop through a virtual event (at most one pending
+    wake-up at a time), and every wake-up drains all queued messages in order.
+    Worker threads must never touch widgets directly, they post messages instead.
+    """
+
+    WAKE_EVENT = "<<WorkerMessages>>"
+
+    def __init__(self, root: tk.Misc):
+        """
+        Args:
+            root: The Tk root window, owner of the event loop.
+        """
+        self.root = root
+        self._queue = queue.SimpleQueue()
+        self._handlers = {}
+        self._wake_lock = threading.Lock()
+        self._wake_pending = False
+        self._closed = False
+        self.root.bind(self.WAKE_EVENT, self._drain, add="+")
+
+    def register(self, channel: str, handler):
+        """
+        Registers the handler of a channel.
+
+        Args:
+            channel (str): Channel name, e.g. "vlm" or "api".
+            handler: Callable(message_type, data), always called on the Tk thread.
+        """
+        self._handlers[channel] = handler
+
+    def channel(self, channel: str) -> _ChannelPoster:
+        """Returns a queue-like poster bound to a channel, to hand to worker threads."""
+        return _ChannelPoster(self, channel)
+
+    def post(self, channel: str, message_type: str, data=None):
+        """
+        Queues a message and wakes the Tk loop. Safe to call from any thread.
+        """
+        if self._closed:
+            return
+        self._queue.put((channel, message_type, data))
+        self._wake()
+
+    def close(self):
+        """Stops delivering messages, call before destroying the root window."""
+        self._closed = True
+
+    def _wake(self):
+        with self._wake_lock:
+            if self._wake_pending:
+                return  # The Tk thread will drain this message with the others
+            self._wake_pending = True
+
+        try:
+            # "tail" queues the event behind pending ones instead of processing it inline
+            self.root.event_generate(self.WAKE_EVENT, when="tail")
+        except (RuntimeError, tk.TclError):
+            # The main loop is not running yet (or anymore). Retry shortly so nothing gets stuck.
+            with self._wake_lock:
+                self._wake_pending = False
+            if not self._closed:
+                retry = threading.Timer(0.1, self._wake)
+                retry.daemon = True
+                retry.start()
+
+    def _drain(self, event=None):
+        """Runs on the Tk thread: dispatches every pending message."""
+        with self._wake_lock:
+            self._wake_pending = False
+
+        while True:
+            try:
+                channel, message_type, data = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if self._closed:
+                continue
+            handler = self._handlers.get(channel)
+            if handler is None:
+                print(f"No UI handler registered for channel '{channel}', message '{message_type}' dropped.")
+                continue
+            try:
+                handler(message_type, data)
+            except Exception as e:
+                # A failing handler must not swallow the rest of the burst
+                print(f"Error handling UI message {channel}/{message_type}: {e}")
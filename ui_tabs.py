@@ -1,14 +1,16 @@
+import os
 import queue
 import threading
+import time
 import tkinter as tk
 
-from sympy.physics.units import temperature
 from tkinterdnd2 import DND_FILES
 
 import ai_utils
 import config
 from tkinter import ttk, messagebox
 
+from caption_queue import JOB_DONE
 from config import *
 from prompts import generate_stable_diffusion_prompt, generate_character_card_prompt
 from vlm_profiles import VLM_PROFILES
@@ -107,12 +109,21 @@ class CaptionTab(ttk.Frame):
         # self.caption_prompt.insert(tk.END, DEFAULT_PROMPT) # This is now handled by _on_model_selected
         self._on_model_selected()  # Call this now that caption_prompt exists
 
-        # Row 2: Generate Button (fixed height)
-        self.generate_button = ttk.Button(right_panel, text="Generate Description", command=self.controller.generate_threaded,
+        # Row 2: Generate and Cancel Buttons (fixed height)
+        generate_frame = ttk.Frame(right_panel, style='Dark.TFrame')
+        generate_frame.grid(row=2, column=0, sticky="ew", pady=(0, 10))
+        generate_frame.columnconfigure(0, weight=1)
+
+        self.generate_button = ttk.Button(generate_frame, text="Generate Description", command=self.controller.generate_threaded,
                                           style='Dark.TButton')
-        self.generate_button.grid(row=2, column=0, sticky="ew", pady=(0, 10))
+        self.generate_button.grid(row=0, column=0, sticky="ew")
         self.generate_button.config(state=tk.DISABLED)
 
+        self.cancel_button = ttk.Button(generate_frame, text="Cancel", command=self.controller.cancel_generation,
+                                        style='Dark.TButton')
+        self.cancel_button.grid(row=0, column=1, sticky="e", padx=(5, 0))
+        self.cancel_button.config(state=tk.DISABLED)
+
         # --- NEW: Output Caption Label with Copy Button ---
         caption_label_frame = ttk.Frame(right_panel, style='Dark.TFrame')
         caption_label_frame.grid(row=3, column=0, sticky="ew")
@@ -182,14 +193,31 @@ class CaptionTab(ttk.Frame):
         button_container = ttk.Frame(right_panel, style='Dark.TFrame')
         button_container.grid(row=7, column=0, sticky="ew", pady=(10, 0))
 
+        # Cached results are reused by default, this forces the model to run again
+        self.force_regenerate_var = tk.BooleanVar(value=False)
+        self.force_regenerate_check = tk.Checkbutton(button_container, text="Force regenerate (ignore cache)",
+                                                     variable=self.force_regenerate_var,
+                                                     bg=DARK_COLOR, fg=FIELD_FOREGROUND_COLOR,
+                                                     selectcolor=FIELD_BACK_COLOR,
+                                                     activebackground=DARK_COLOR,
+                                                     activeforeground=FIELD_FOREGROUND_COLOR,
+                                                     highlightthickness=0, borderwidth=0)
+        self.force_regenerate_check.pack(side=tk.LEFT)
+
         print("Caption Tab initialized!") # Placeholder
 
     def handle_drop(self, event):
         """
         Handles the drag-and-drop file event.
+        A single image is opened here, several files or a folder go to the caption queue.
         """
-        filepath = event.data.strip('{}')
-        self.controller.process_dropped_image(filepath)
+        # splitlist understands Tcl's {braced paths with spaces}
+        paths = list(self.tk.splitlist(event.data))
+        if len(paths) == 1 and not os.path.isdir(paths[0]):
+            self.controller.process_dropped_image(paths[0])
+        elif paths:
+            self.controller.enqueue_paths(paths)
+            self.controller.tab_control.select(self.controller.queue_tab)
         # if filepath.lower().endswith(ACCEPTED_IMAGE_EXTENSIONS):
         #     #self.image_path = filepath
         #     #self.load_and_display_image()
@@ -284,6 +312,8 @@ class GenerateTab(ttk.Frame):
         """
         super().__init__(parent)
         self.controller = controller
+        self._api_output_widgets = {}  # task_type -> output Text of the running API task
+        self.controller.dispatcher.register("api", self._handle_api_message)
 
         self.copy_icon = copy_icon  # <-- Store the icon
         self.copy_icon_hover = copy_icon_hover  # <-- Store the hover icon
@@ -389,56 +419,65 @@ class GenerateTab(ttk.Frame):
         """
         Handles the 'Generate Card' button click event in a separate thread.
         """
-        self.controller.start_api_generation_task()
-
-        self.task_queue = queue.Queue()
-        threading.Thread(
-            target=self._api_call_task,
-            args=(
-                self.card_text_box,
-                self.card_output_text_box,
-                self.task_queue,
-                'card'
-            ),
-            daemon=True
-        ).start()
-        self.after(100, self._process_api_queue)
+        self._start_api_task(self.card_text_box, self.card_output_text_box, 'card')
 
     def _generate_sd_prompt_threaded(self):
         """
         Handles the 'Generate SD' button click event in a separate thread.
         """
+        self._start_api_task(self.sd_text_box, self.sd_output_text_box, 'sd')
+
+    def build_api_request(self) -> dict:
+        """
+        Reads the API settings and the selected templates. Must run on the Tk thread,
+        the returned dict of plain values can then be handed to any worker.
+        """
+        settings_tab = self.controller.settings_tab
+        return {
+            "api_key": settings_tab.llm_key_entry.get().strip(),
+            "base_url": settings_tab.llm_url_entry.get().strip(),
+            "model_name": settings_tab.llm_model_entry.get().strip(),
+            # Values rounded to avoid long floats
+            "temperature": round(settings_tab.temperature_slider.get(), 2),
+            "frequency_penalty": round(settings_tab.frequency_penalty_slider.get(), 2),
+            "presence_penalty": round(settings_tab.presence_penalty_slider.get(), 2),
+            "card_template": self.card_template_combo.get(),
+            "sd_template": self.sd_template_combo.get(),
+        }
+
+    def _start_api_task(self, input_widget, output_widget, task_type):
+        """
+        Reads the prompt and API settings on the Tk thread and hands plain values to the worker.
+        """
         self.controller.start_api_generation_task()
 
-        self.task_queue = queue.Queue()
+        request = self.build_api_request()
+        request["prompt"] = input_widget.get("1.0", tk.END).strip()
+        self._api_output_widgets[task_type] = output_widget
+
         threading.Thread(
             target=self._api_call_task,
             args=(
-                self.sd_text_box,
-                self.sd_output_text_box,
-                self.task_queue,
-                'sd'
+                request,
+                self.controller.dispatcher.channel("api"),
+                task_type
             ),
             daemon=True
         ).start()
-        self.after(100, self._process_api_queue)
 
-
-
-    def _api_call_task(self, input_widget, output_widget, q, task_type):
+    def _api_call_task(self, request, q, task_type):
         """
         A generic worker thread for making API calls.
+        Gets plain values only and reports back through q, it never touches a widget.
         """
         try:
-            # Get credentials and prompt
-            api_key = self.controller.settings_tab.llm_key_entry.get().strip()
-            base_url = self.controller.settings_tab.llm_url_entry.get().strip()
-            model_name = self.controller.settings_tab.llm_model_entry.get().strip()
-            prompt = input_widget.get("1.0", tk.END).strip()
-            # Values rounded to avoid long floats
-            temperature = round(self.controller.settings_tab.temperature_slider.get(), 2)
-            frequency_penalty = round(self.controller.settings_tab.frequency_penalty_slider.get(), 2)
-            presence_penalty = round(self.controller.settings_tab.presence_penalty_slider.get(), 2)
+            api_key = request["api_key"]
+            base_url = request["base_url"]
+            model_name = request["model_name"]
+            prompt = request["prompt"]
+            temperature = request["temperature"]
+            frequency_penalty = request["frequency_penalty"]
+            presence_penalty = request["presence_penalty"]
 
             if not all([api_key, base_url, model_name, prompt]):
                 q.put(("error", "API credentials, model, url and prompt cannot be empty."))
@@ -459,7 +498,7 @@ class GenerateTab(ttk.Frame):
 
             # Update the UI with the result of the task
             if response:
-                q.put(("update_output", (output_widget, response)))
+                q.put(("update_output", (task_type, response)))
                 q.put(("status", "API call successful."))
             else:
                 q.put(("error", "API call failed!"))
@@ -469,40 +508,66 @@ class GenerateTab(ttk.Frame):
         finally:
             q.put(("done", task_type))
 
-    def _process_api_queue(self):
+    def _handle_api_message(self, message_type, data):
         """
-        Checks the queue for messages from the API worker thread and updates the UI.
+        Handles a message from the API worker thread and updates the UI.
+        Called by the dispatcher on the Tk thread.
         """
-        try:
-            message_type, data = self.task_queue.get_nowait()
-
-            if message_type == "status": # status update, we display it
-                self.controller.update_status(data)
-            elif message_type == "update_output": # updates the control text
-                widget, text = data
-                widget.config(state=tk.NORMAL)
-                widget.delete("1.0", tk.END)
-                widget.insert(tk.END, text)
-                widget.config(state=tk.DISABLED)
-            elif message_type == "error":
-                messagebox.showerror("API Error", data)
-            elif message_type == "done":
-                task_type = data  # This will be 'card' or 'sd'
-                if task_type == 'card':
-                    # The card is finished, NOW we populate the SD prompt
-                    final_caption = self.controller.caption_tab.output_caption_text.get("1.0", tk.END).strip()
-                    final_tags = self.controller.caption_tab.output_tags_text.get("1.0", tk.END).strip()
-                    final_card = self.card_output_text_box.get("1.0", tk.END).strip()
-                    self.populate_generate_sd(final_caption, final_card, final_tags)
-                    self.controller.end_api_generation_task() # change controller state
-                else:  # The SD prompt finished
-                    self.controller.end_api_generation_task() # change controller state
-                return  # Stop the queue-checking loop. We finished card or sd prompt
-
-        except queue.Empty:
-            pass
-
-        self.after(100, self._process_api_queue) # Schedule again the queue process until done
+        if message_type == "status": # status update, we display it
+            self.controller.update_status(data)
+        elif message_type == "update_output": # updates the control text
+            task_type, text = data
+            widget = self._api_output_widgets[task_type]
+            widget.config(state=tk.NORMAL)
+            widget.delete("1.0", tk.END)
+            widget.insert(tk.END, text)
+            widget.config(state=tk.DISABLED)
+        elif message_type == "error":
+            messagebox.showerror("API Error", data)
+        elif message_type == "done":
+            task_type = data  # This will be 'card' or 'sd'
+            if task_type == 'card':
+                # The card is finished, NOW we populate the SD prompt
+                final_caption = self.controller.caption_tab.output_caption_text.get("1.0", tk.END).strip()
+                final_tags = self.controller.caption_tab.output_tags_text.get("1.0", tk.END).strip()
+                final_card = self.card_output_text_box.get("1.0", tk.END).strip()
+                self.populate_generate_sd(final_caption, final_card, final_tags)
+                self._record_history(
+                    card_prompt=self.card_text_box.get("1.0", tk.END).strip(),
+                    card=final_card,
+                    sd_prompt=self.sd_text_box.get("1.0", tk.END).strip())
+                self.controller.end_api_generation_task() # change controller state
+            else:  # The SD prompt finished
+                self._record_history(
+                    sd_prompt=self.sd_text_box.get("1.0", tk.END).strip(),
+                    sd_output=self.sd_output_text_box.get("1.0", tk.END).strip())
+                self.controller.end_api_generation_task() # change controller state
+
+    def _record_history(self, **fields):
+        """Adds the API results to the history entry of the current image, if there is one."""
+        if self.controller.current_history_id:
+            self.controller.history.record(self.controller.current_history_id, **fields)
+
+    def load_history_entry(self, entry: dict):
+        """Fills the prompt and output boxes from a history entry."""
+        for widget, key in ((self.card_text_box, "card_prompt"), (self.card_output_text_box, "card"),
+                            (self.sd_text_box, "sd_prompt"), (self.sd_output_text_box, "sd_output")):
+            previous_state = widget.cget("state")
+            widget.config(state=tk.NORMAL)
+            widget.delete("1.0", tk.END)
+            widget.insert(tk.END, entry.get(key) or "")
+            widget.config(state=previous_state)
+
+    def set_outputs(self, card: str = None, sd_output: str = None):
+        """Shows results produced elsewhere (e.g. by the caption queue) in the output boxes."""
+        for widget, text in ((self.card_output_text_box, card), (self.sd_output_text_box, sd_output)):
+            if text is None:
+                continue
+            previous_state = widget.cget("state")
+            widget.config(state=tk.NORMAL)
+            widget.delete("1.0", tk.END)
+            widget.insert(tk.END, text)
+            widget.config(state=previous_state)
 
     def populate_generate_card(self, caption: str, tags: str):
         """
@@ -542,6 +607,14 @@ class GenerateTab(ttk.Frame):
 
 
 
+    def update_template_lists(self, card_prompts, sd_prompts):
+        """
+        Refreshes the template combo boxes with a new list of discovered templates.
+        The current selection is kept, even if its file was removed.
+        """
+        self.card_template_combo.config(values=card_prompts)
+        self.sd_template_combo.config(values=sd_prompts)
+
     def _on_prompt_template_selected(self, event, prompt_type):
         """
         Handles the event when a new prompt template is selected.
@@ -611,10 +684,240 @@ class GenerateTab(ttk.Frame):
         event.widget.config(image=self.controller.copy_icon)
 
 
+class QueueTab(ttk.Frame):
+    def __init__(self, parent, controller):
+        """
+        Background captioning queue: one row per dropped image with its status.
+
+        Args:
+            parent: The parent widget (the ttk.Notebook).
+            controller: The main VLM_GUI application instance.
+        """
+        super().__init__(parent, style='Dark.TFrame')
+        self.controller = controller
+
+        main_frame = ttk.Frame(self, style='Dark.TFrame', padding=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        main_frame.columnconfigure(0, weight=1)
+        main_frame.rowconfigure(1, weight=1)
+
+        # Row 0: Controls
+        button_frame = ttk.Frame(main_frame, style='Dark.TFrame')
+        button_frame.grid(row=0, column=0, sticky="ew", pady=(0, 10))
+
+        self.pause_button = ttk.Button(button_frame, text="Pause", command=self._toggle_pause, style='Dark.TButton')
+        self.pause_button.pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="Move Up", command=lambda: self._move_selected(-1),
+                   style='Dark.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Move Down", command=lambda: self._move_selected(1),
+                   style='Dark.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Cancel", command=self._cancel_selected,
+                   style='Dark.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Cancel All", command=self.controller.caption_queue.cancel_all,
+                   style='Dark.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Clear Finished", command=self.controller.caption_queue.clear_finished,
+                   style='Dark.TButton').pack(side=tk.LEFT, padx=5)
+
+        self.summary_label = ttk.Label(button_frame, text="Drop images or folders here.", style='Dark.TLabel')
+        self.summary_label.pack(side=tk.RIGHT)
+
+        # Row 2: Pipeline options and figures
+        options_frame = ttk.Frame(main_frame, style='Dark.TFrame')
+        options_frame.grid(row=2, column=0, sticky="ew", pady=(10, 0))
+
+        # Card + SD prompt over the API, overlapped with the captioning of the next image
+        self.api_stage_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(options_frame, text="Also generate card and SD prompt (API) for new jobs",
+                       variable=self.api_stage_var, bg=DARK_COLOR, fg=FIELD_FOREGROUND_COLOR,
+                       selectcolor=FIELD_BACK_COLOR, activebackground=DARK_COLOR,
+                       activeforeground=FIELD_FOREGROUND_COLOR, highlightthickness=0).pack(side=tk.LEFT)
+
+        self.pipeline_label = ttk.Label(options_frame, text="", style='Dark.TLabel')
+        self.pipeline_label.pack(side=tk.RIGHT)
+
+        # Row 1: Job list
+        tree_frame = ttk.Frame(main_frame, style='Border.TFrame')
+        tree_frame.grid(row=1, column=0, sticky="nsew")
+        tree_frame.columnconfigure(0, weight=1)
+        tree_frame.rowconfigure(0, weight=1)
+
+        self.job_tree = ttk.Treeview(tree_frame, columns=("file", "status", "folder"), show="headings",
+                                     style='Dark.Treeview', selectmode="browse")
+        self.job_tree.heading("file", text="Image")
+        self.job_tree.heading("status", text="Status")
+        self.job_tree.heading("folder", text="Folder")
+        self.job_tree.column("file", width=220)
+        self.job_tree.column("status", width=90, stretch=False)
+        self.job_tree.column("folder", width=350)
+        tree_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", style='Dark.Vertical.TScrollbar',
+                                       command=self.job_tree.yview)
+        self.job_tree.config(yscrollcommand=tree_scrollbar.set)
+        self.job_tree.grid(row=0, column=0, sticky="nsew", padx=2, pady=2)
+        tree_scrollbar.grid(row=0, column=1, sticky="ns")
+        self.job_tree.bind("<Double-Button-1>", self._open_selected)
+
+        self.job_tree.drop_target_register(DND_FILES)
+        self.job_tree.dnd_bind('<<Drop>>', self._handle_drop)
+
+        self.status_counts = {}
+
+        print("Queue Tab initialized!") # Placeholder
+
+    def _handle_drop(self, event):
+        paths = list(self.tk.splitlist(event.data))
+        if paths:
+            self.controller.enqueue_paths(paths)
+
+    def apply_event(self, event_type, data):
+        """Mirrors a CaptionJobQueue event in the job list. Called on the Tk thread."""
+        if event_type in ("added", "updated"):
+            job = data
+            item_id = str(job.job_id)
+            status = job.status if not job.error else f"{job.status}: {job.error}"
+            values = (os.path.basename(job.path), status, os.path.dirname(job.path))
+            if self.job_tree.exists(item_id):
+                self.job_tree.item(item_id, values=values)
+            else:
+                self.job_tree.insert("", tk.END, iid=item_id, values=values)
+            self.status_counts[job.job_id] = job.status
+        elif event_type == "removed":
+            item_id = str(data)
+            if self.job_tree.exists(item_id):
+                self.job_tree.delete(item_id)
+            self.status_counts.pop(data, None)
+        elif event_type == "order":
+            for index, job_id in enumerate(data):
+                if self.job_tree.exists(str(job_id)):
+                    self.job_tree.move(str(job_id), "", index)
+        self._update_summary()
+
+    def _update_summary(self):
+        counts = {}
+        for status in self.status_counts.values():
+            counts[status] = counts.get(status, 0) + 1
+        summary = ", ".join(f"{count} {status.lower()}" for status, count in sorted(counts.items()))
+        if self.controller.caption_queue.paused:
+            summary = f"Paused | {summary}"
+        self.summary_label.config(text=summary or "Drop images or folders here.")
+
+        stats = self.controller.caption_queue.stats()
+        if stats["jobs_finished"]:
+            stages = stats["stages"]
+            self.pipeline_label.config(
+                text=f"VLM busy {stages['vlm']['utilisation']:.0%} | API busy {stages['api']['utilisation']:.0%} | "
+                     f"{stats['jobs_per_minute']:.1f} images/min")
+
+    def _selected_job_id(self):
+        selection = self.job_tree.selection()
+        return int(selection[0]) if selection else None
+
+    def _toggle_pause(self):
+        if self.controller.caption_queue.paused:
+            self.controller.caption_queue.resume()
+            self.pause_button.config(text="Pause")
+        else:
+            self.controller.caption_queue.pause()
+            self.pause_button.config(text="Resume")
+        self._update_summary()
+
+    def _move_selected(self, offset):
+        job_id = self._selected_job_id()
+        if job_id is not None:
+            self.controller.caption_queue.move(job_id, offset)
+
+    def _cancel_selected(self):
+        job_id = self._selected_job_id()
+        if job_id is not None:
+            self.controller.caption_queue.cancel(job_id)
+
+    def _open_selected(self, event=None):
+        job_id = self._selected_job_id()
+        if job_id is None:
+            return
+        job = self.controller.caption_queue.get(job_id)
+        if job and job.status == JOB_DONE:
+            self.controller.open_job_result(job)
+
+
+class HistoryTab(ttk.Frame):
+    def __init__(self, parent, controller):
+        """
+        Search and re-open past generations.
+
+        Args:
+            parent: The parent widget (the ttk.Notebook).
+            controller: The main VLM_GUI application instance.
+        """
+        super().__init__(parent, style='Dark.TFrame')
+        self.controller = controller
+        self.results = []
+
+        main_frame = ttk.Frame(self, style='Dark.TFrame', padding=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        main_frame.columnconfigure(1, weight=1)
+        main_frame.rowconfigure(1, weight=1)
+
+        # Row 0: Search box and buttons
+        search_label = ttk.Label(main_frame, text="Search:", style='Dark.TLabel')
+        search_label.grid(row=0, column=0, padx=(0, 5), pady=5, sticky="w")
+        self.search_entry = ttk.Entry(main_frame, style='Dark.TEntry')
+        self.search_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        self.search_entry.bind("<Return>", lambda event: self.refresh())
+
+        search_button = ttk.Button(main_frame, text="Search", command=self.refresh, style='Dark.TButton')
+        search_button.grid(row=0, column=2, padx=5, pady=5)
+        self.open_button = ttk.Button(main_frame, text="Open", command=self._open_selected, style='Dark.TButton')
+        self.open_button.grid(row=0, column=3, padx=(5, 0), pady=5)
+
+        # Row 1: Results
+        list_frame = ttk.Frame(main_frame, style='Border.TFrame')
+        list_frame.grid(row=1, column=0, columnspan=4, sticky="nsew", pady=(5, 0))
+        list_frame.columnconfigure(0, weight=1)
+        list_frame.rowconfigure(0, weight=1)
+
+        self.results_listbox = tk.Listbox(list_frame, bg=TEXT_BG_COLOR, fg=FIELD_FOREGROUND_COLOR,
+                                          selectbackground=SELECT_BACKGROUND_COLOR,
+                                          selectforeground=FIELD_FOREGROUND_COLOR,
+                                          highlightthickness=0, borderwidth=0, relief=tk.FLAT)
+        results_scrollbar = ttk.Scrollbar(list_frame, orient="vertical", style='Dark.Vertical.TScrollbar',
+                                          command=self.results_listbox.yview)
+        self.results_listbox.config(yscrollcommand=results_scrollbar.set)
+        self.results_listbox.grid(row=0, column=0, sticky="nsew", padx=2, pady=2)
+        results_scrollbar.grid(row=0, column=1, sticky="ns")
+        self.results_listbox.bind("<Double-Button-1>", lambda event: self._open_selected())
+
+        # Refresh every time the tab is shown, new generations may have been recorded
+        self.bind("<Visibility>", lambda event: self.refresh())
+
+        print("History Tab initialized!") # Placeholder
+
+    def refresh(self):
+        """Runs the search (or lists the latest entries) and fills the results list."""
+        try:
+            self.results = self.controller.history.search(self.search_entry.get().strip(), limit=200)
+        except Exception as e:
+            print(f"History search failed: {e}")
+            self.results = []
+
+        self.results_listbox.delete(0, tk.END)
+        for entry in self.results:
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["created_at"]))
+            image_name = os.path.basename(entry.get("image_path") or "") or "(no image)"
+            snippet = " ".join((entry.get("caption") or "").split())[:120]
+            self.results_listbox.insert(tk.END, f"{created} | {image_name} | {snippet}")
+
+    def _open_selected(self):
+        selection = self.results_listbox.curselection()
+        if not selection:
+            return
+        self.controller.open_history_entry(self.results[selection[0]])
+
+
 class SettingsTab(ttk.Frame):
     def __init__(self, parent, controller):
         super().__init__(parent, style='Dark.TFrame')
         self.controller = controller
+        self.controller.dispatcher.register("api_test", self._handle_test_message)
 
         # The main container frame that holds everything
         main_frame = ttk.Frame(self, style='Dark.TFrame', padding=15)
@@ -663,8 +966,8 @@ class SettingsTab(ttk.Frame):
         temp_slider_frame.grid(row=3, column=1, columnspan=4, sticky="ew")
 
         self.temperature_slider = ttk.Scale(temp_slider_frame, from_=0.0, to=2.0, orient=tk.HORIZONTAL,
-                                            command=lambda val: self.temperature_value_label.config(
-                                                text=f"{float(val):.2f}"))
+                                            command=lambda val: self._on_slider_changed(
+                                                'temperature', self.temperature_value_label, val))
         self.temperature_slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
         self.temperature_value_label = ttk.Label(temp_slider_frame, text="0.70", style='Dark.TLabel', width=5)
@@ -682,8 +985,8 @@ class SettingsTab(ttk.Frame):
         freq_slider_frame.grid(row=4, column=1, columnspan=4, sticky="ew")
 
         self.frequency_penalty_slider = ttk.Scale(freq_slider_frame, from_=-2.0, to=2.0, orient=tk.HORIZONTAL,
-                                                  command=lambda val: self.freq_pen_value_label.config(
-                                                      text=f"{float(val):.2f}"))
+                                                  command=lambda val: self._on_slider_changed(
+                                                      'frequency_penalty', self.freq_pen_value_label, val))
         self.frequency_penalty_slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
         self.freq_pen_value_label = ttk.Label(freq_slider_frame, text="0.00", style='Dark.TLabel', width=5)
@@ -701,8 +1004,8 @@ class SettingsTab(ttk.Frame):
         pres_slider_frame.grid(row=5, column=1, columnspan=4, sticky="ew")
 
         self.presence_penalty_slider = ttk.Scale(pres_slider_frame, from_=-2.0, to=2.0, orient=tk.HORIZONTAL,
-                                                 command=lambda val: self.pres_pen_value_label.config(
-                                                     text=f"{float(val):.2f}"))
+                                                 command=lambda val: self._on_slider_changed(
+                                                     'presence_penalty', self.pres_pen_value_label, val))
         self.presence_penalty_slider.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
         self.pres_pen_value_label = ttk.Label(pres_slider_frame, text="0.00", style='Dark.TLabel', width=5)
@@ -735,6 +1038,16 @@ class SettingsTab(ttk.Frame):
 
         print("Settings Tab initialized!") # Placeholder
 
+    def _on_slider_changed(self, setting_key, value_label, val):
+        """
+        Updates the value label of a slider and stores the new value.
+        Persistence is write-behind, so dragging a slider only costs a dict update here.
+        """
+        value = float(val)
+        value_label.config(text=f"{value:.2f}")
+        self.controller.settings[setting_key] = value
+        self.controller.persistence.update_setting(setting_key, value)
+
     def _save_api_settings(self, silent=False):
         """Handles the Save button click event in the Settings tab."""
         self.controller.settings['api_key'] = self.llm_key_entry.get().strip()
@@ -758,8 +1071,21 @@ class SettingsTab(ttk.Frame):
     def _test_api_connection_threaded(self):
         """
         Tests the API connection in a separate thread.
+        The fields are read here, on the Tk thread, the worker only gets plain values.
         """
-        threading.Thread(target=self._test_api_task, daemon=True).start()
+        api_key = self.llm_key_entry.get().strip()
+        base_url = self.llm_url_entry.get().strip()
+        model_name = self.llm_model_entry.get().strip()
+
+        if not all([api_key, base_url, model_name]):
+            messagebox.showerror("Input Error", "Please fill in all API fields before testing.")
+            self.controller.update_status("Test failed: Missing credentials.")
+            return
+
+        self.controller.update_status("Testing API connection...")
+        threading.Thread(target=self._test_api_task,
+                         args=(api_key, base_url, model_name, self.controller.dispatcher.channel("api_test")),
+                         daemon=True).start()
 
     def center_window(self, parent):
         """Calculates the coordinates to center this window over its parent."""
@@ -783,21 +1109,11 @@ class SettingsTab(ttk.Frame):
         # Set the geometry
         self.geometry(f"+{pos_x}+{pos_y}")
 
-    def _test_api_task(self):
+    def _test_api_task(self, api_key, base_url, model_name, q):
         """
-        The actual task of testing the API connection.
+        The actual task of testing the API connection. Runs in a worker thread, reports through q.
         """
-        self.controller.update_status("Testing API connection...")
         try:
-            api_key = self.llm_key_entry.get().strip()
-            base_url = self.llm_url_entry.get().strip()
-            model_name = self.llm_model_entry.get().strip()
-
-            if not all([api_key, base_url, model_name]):
-                messagebox.showerror("Input Error", "Please fill in all API fields before testing.")
-                self.controller.update_status("Test failed: Missing credentials.")
-                return
-
             response = ai_utils.call_text_model(
                 api_key=api_key,
                 base_url=base_url,
@@ -806,12 +1122,18 @@ class SettingsTab(ttk.Frame):
             )
 
             if response:
-                messagebox.showinfo("Success", "API connection successful!")
-                self.controller.update_status("API connection test successful.")
+                q.put(("success", None))
             else:
-                messagebox.showerror("Failure", "API call failed. Check console for details.")
-                self.controller.update_status("API connection test failed.")
+                q.put(("failure", "API call failed. Check console for details."))
 
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during the test: {e}")
+            q.put(("failure", f"An error occurred during the test: {e}"))
+
+    def _handle_test_message(self, message_type, data):
+        """Shows the API test result. Called by the dispatcher on the Tk thread."""
+        if message_type == "success":
+            messagebox.showinfo("Success", "API connection successful!")
+            self.controller.update_status("API connection test successful.")
+        else:
+            messagebox.showerror("Failure", data)
             self.controller.update_status("API connection test failed.")
@@ -1,16 +1,20 @@
 # vlm_profiles.py
 import os
 import sys
-from dataclasses import dataclass
-from typing import Callable, Dict, Tuple, Any
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Tuple, Any, List, Optional
 from warnings import catch_warnings
 
-import torch, re
-from qwen_vl_utils import process_vision_info
-from transformers import AutoProcessor, LlavaForConditionalGeneration, AutoModelForVision2Seq, AutoConfig, \
-    Qwen2VLProcessor, Qwen2VLForConditionalGeneration
+import time
 from assets_utils import resource_path
+from config import NO_TAGS_FOUND
+from cancellation import CancellationToken
+from decode_stats import DecodeStats, DecodeStepCounter
+from ngram_blocking import NoRepeatNGramBlocker
+from tagged_output import parse_tagged_output
 
+# torch, transformers and qwen_vl_utils are only imported inside the loader/generation functions,
+# so the profile table (and the whole GUI) can be imported without paying seconds for them.
 
 
 # This defines the structure for a model's "forensic file"
@@ -27,9 +31,32 @@ class VLMProfile:
     generation_function: Callable[[any, any, any, str, str, any], str]
     loader_function: Callable[[str, str], Tuple[Any, Any]]
     required_vram_gb: int
+    # Sampling/decoding settings passed to model.generate, part of the result cache key too
+    generation_params: Dict[str, Any] = field(default_factory=dict)
+    # Same as generation_function, but for lists of prompts/images run as one padded generate().
+    # Profiles without one are never batched.
+    batch_generation_function: Optional[Callable[..., List[str]]] = None
+    # Optional small model sharing the tokenizer: it drafts tokens and the big model only verifies
+    # them (assisted/speculative decoding), several tokens per big-model step when it guesses well.
+    draft_model_id: Optional[str] = None
+    draft_loader_function: Optional[Callable[[str, str], Any]] = None
+    # "greedy": same output as greedy decoding without a draft, the fastest.
+    # "sampled": speculative sampling, keeps generation_params' sampling settings.
+    draft_decoding: str = "greedy"
+    # Generation ends as soon as the output contains one of these (it stays in the output), for
+    # models that keep writing after everything their parser reads, e.g. ToriiGate after </tags>
+    stop_sequences: Tuple[str, ...] = ()
+    # Vocabulary-constrained tags pass (see tag_trie): where the tag list starts and ends in the
+    # output ("" = from the first token / until the EOS token), and how the model spells the tags.
+    tags_section_start: str = ""
+    tags_section_end: str = ""
+    tags_with_spaces: bool = False
 
 def load_joycaption_model(model_name: str, device: str) -> Tuple[Any, Any]:
     """Loads a LLaVA-based VLM model and processor."""
+    import torch
+    from transformers import AutoProcessor, LlavaForConditionalGeneration
+
     print("Loading JoyCaption model...")
     processor = AutoProcessor.from_pretrained(model_name, trust_remote_code=True)
     model = LlavaForConditionalGeneration.from_pretrained(
@@ -43,6 +70,9 @@ def load_joycaption_model(model_name: str, device: str) -> Tuple[Any, Any]:
 
 def load_toriigate_model(model_name: str, device: str) -> Tuple[Any, Any]:
     """Loads the Minthy/ToriiGate-v0.4-7B model and processor."""
+    import torch
+    from transformers import AutoConfig, Qwen2VLProcessor, Qwen2VLForConditionalGeneration
+
     print("Loading Toriigate model...")
     config = AutoConfig.from_pretrained(model_name, trust_remote_code=True)
     config.num_attention_heads = 28  # This custom logic now lives with the model!
@@ -66,12 +96,174 @@ def load_toriigate_model(model_name: str, device: str) -> Tuple[Any, Any]:
     model.eval()
     return model, processor
 
+def load_qwen2_vl_draft_model(model_name: str, device: str) -> Any:
+    """
+    Loads a small Qwen2-VL (e.g. Qwen/Qwen2-VL-2B-Instruct) as draft model for ToriiGate: same
+    tokenizer and image tokens, so it can draft from the very same inputs.
+    """
+    import torch
+    from transformers import Qwen2VLForConditionalGeneration
+
+    print(f"Loading draft model {model_name}...")
+    model = Qwen2VLForConditionalGeneration.from_pretrained(model_name, device_map=device, torch_dtype=torch.bfloat16)
+    model.eval()
+    return model
+
+# --- Default Generation Parameters ---
+# Profiles can override any of these through VLMProfile.generation_params.
+
+JOYCAPTION_GENERATION_PARAMS = {
+    "max_new_tokens": 512,
+    "repetition_penalty": 1.05,  # <<< Gentle penalty
+    "no_repeat_ngram_size": 3,  # <<< The loop buster
+}
+
+TORIIGATE_GENERATION_PARAMS = {
+    "max_new_tokens": 1024,
+    "do_sample": True,
+    #"temperature": 0.1,
+    #"repetition_penalty": 1.05,
+    "no_repeat_ngram_size": 3,  # <<< THE LOOP BUSTER!
+}
+TORIIGATE_SECTIONS = ("tags", "convenient_description")  # Sections of its tags-pass output we keep
+
+class CancellationStoppingCriteria:
+    """
+    Stops model.generate() as soon as the token is cancelled. generate() checks its stopping
+    criteria after every decoded token, so the model is released within one decode step.
+    In a batch every row has its own token (or None): only the cancelled rows stop.
+    Duck-types transformers.StoppingCriteria (a plain callable) so this module doesn't import transformers.
+    """
+
+    def __init__(self, cancel_tokens):
+        """
+        Args:
+            cancel_tokens: One CancellationToken for the whole generation, or a list with one per batch row.
+        """
+        self.cancel_tokens = list(cancel_tokens) if isinstance(cancel_tokens, (list, tuple)) else [cancel_tokens]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        flags = [token is not None and token.cancelled for token in self.cancel_tokens]
+        if len(flags) != input_ids.shape[0]:
+            flags = [any(flags)] * input_ids.shape[0]
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+
+class StopSequenceCriteria:
+    """
+    Stops a row as soon as its generated text contains one of the stop sequences.
+    Only the last few generated tokens are decoded at every step (enough to hold the longest stop
+    sequence), so a check costs the same at token 10 and token 1000.
+    Duck-types transformers.StoppingCriteria like CancellationStoppingCriteria.
+    """
+
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        """
+        Args:
+            tokenizer: The processor's tokenizer.
+            stop_sequences: Strings ending the generation.
+            prompt_length (int): Length of the (padded) prompt, the prompt itself is never searched.
+        """
+        self.tokenizer = tokenizer
+        self.stop_sequences = tuple(sequence for sequence in stop_sequences if sequence)
+        self.prompt_length = prompt_length
+        # A character is at most 4 byte-level tokens, +1 for a token straddling the start of the match
+        self.window = 4 * max((len(sequence) for sequence in self.stop_sequences), default=0) + 1
+        self.stopped_at = {}  # row -> number of generated tokens when its stop sequence showed up
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        generated = input_ids.shape[1] - self.prompt_length
+        flags = []
+        for row in range(input_ids.shape[0]):
+            if row not in self.stopped_at:
+                start = max(self.prompt_length, input_ids.shape[1] - self.window)
+                tail = self.tokenizer.decode(input_ids[row, start:], skip_special_tokens=True)
+                if any(sequence in tail for sequence in self.stop_sequences):
+                    self.stopped_at[row] = generated
+            flags.append(row in self.stopped_at)
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+
+def _stopping_criteria(cancel_tokens):
+    """StoppingCriteriaList for generate(), without criteria when the task can't be cancelled."""
+    from transformers import StoppingCriteriaList
+    tokens = cancel_tokens if isinstance(cancel_tokens, (list, tuple)) else [cancel_tokens]
+    if all(token is None for token in tokens):
+        return StoppingCriteriaList()
+    return StoppingCriteriaList([CancellationStoppingCriteria(cancel_tokens)])
+
+
+def _run_generate(model, model_inputs, cancel_tokens=None, run_stats: DecodeStats = None, assistant_model=None,
+                  stop_sequences=(), tokenizer=None, tag_constraint=None, degeneration=None, **generate_kwargs):
+    """
+    model.generate() with the cancellation criteria, an optional draft model (assisted decoding),
+    optional stop sequences (decoded with tokenizer), an optional TagConstraint on the tag list,
+    optional DegenerationSettings (looping runs are stopped early and reported in run_stats)
+    and optional DecodeStats to fill.
+    no_repeat_ngram_size is handled by NoRepeatNGramBlocker instead of the stock processor (same bans,
+    constant cost per step).
+    """
+    from transformers import LogitsProcessorList
+
+    prompt_length = model_inputs["input_ids"].shape[1]
+    stopping_criteria = _stopping_criteria(cancel_tokens)
+    if stop_sequences:
+        stopping_criteria.append(StopSequenceCriteria(tokenizer, stop_sequences, prompt_length))
+    # Custom processors run before the sampling warpers (temperature, top_p...), like the stock n-gram one.
+    # The n-gram blocker comes first: the tag constraint falls back to ending the list if it bans everything.
+    logits_processor = LogitsProcessorList()
+    detector = None
+    if degeneration is not None:
+        from degeneration import DegenerationDetector
+        detector = DegenerationDetector(tokenizer, prompt_length, degeneration)
+        stopping_criteria.append(detector)
+        if assistant_model is None:  # The draft's generate() would run the probe too
+            logits_processor.append(detector.entropy_probe)  # First, it measures the model's own distribution
+    ngram_size = generate_kwargs.pop("no_repeat_ngram_size", 0)
+    if ngram_size:
+        logits_processor.append(NoRepeatNGramBlocker(ngram_size))
+    if tag_constraint is not None:
+        from tag_trie import TagTrieLogitsProcessor
+        logits_processor.append(TagTrieLogitsProcessor(tag_constraint, tokenizer, prompt_length,
+                                                       generate_kwargs.get("eos_token_id")))
+    if logits_processor:
+        generate_kwargs["logits_processor"] = logits_processor
+    if run_stats is not None:
+        stopping_criteria.append(DecodeStepCounter(run_stats))
+    if assistant_model is not None:
+        generate_kwargs["assistant_model"] = assistant_model
+
+    start = time.perf_counter()
+    output = model.generate(**model_inputs, stopping_criteria=stopping_criteria, **generate_kwargs)
+    if run_stats is not None:
+        run_stats.seconds += time.perf_counter() - start
+        run_stats.new_tokens += (output.shape[1] - prompt_length) * output.shape[0]
+        if detector is not None and detector.reasons:
+            run_stats.degeneration = "; ".join(sorted(set(detector.reasons.values())))
+            max_new_tokens = generate_kwargs.get("max_new_tokens") or 0
+            run_stats.tokens_saved += sum(max(0, max_new_tokens - stopped_at)
+                                          for stopped_at in detector.stopped_at.values())
+    return output
+
+
 # --- Define the Generation Functions ---
 # We've moved these from ModelHandler. They are now standalone functions.
 # They need the model, processor, and device passed to them as arguments.
 
-def generate_joycaption_description(model, processor, device, prompt, system_prompt, image_raw):
-    """Generates a text description for a LLaVA model."""
+def generate_joycaption_description(model, processor, device, prompt, system_prompt, image_raw, cancel_token=None,
+                                    assistant_model=None, run_stats=None, stop_sequences=(), tag_constraint=None,
+                                    degeneration=None, **generation_params):
+    """
+    Generates a text description for a LLaVA model.
+    Raises GenerationCancelled if cancel_token was cancelled, the partial output is dropped.
+    assistant_model (a draft model) turns on assisted decoding, run_stats (DecodeStats) collects counters,
+    stop_sequences end the generation early, tag_constraint (TagConstraint) limits the tags to a vocabulary,
+    degeneration (DegenerationSettings) stops a looping run early (reported in run_stats).
+    """
+    import torch
+
     with torch.no_grad():
         # I updated this to use the system_prompt from your profile!
         convo = [
@@ -82,21 +274,79 @@ def generate_joycaption_description(model, processor, device, prompt, system_pro
         inputs = processor(text=[convo_string], images=[image_raw], return_tensors="pt").to(device)
         inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
 
-        # Updated generate call with our loop-busting parameters
-        output = model.generate(
-            **inputs,
-            max_new_tokens=512,
+        # Updated generate call with our loop-busting parameters (see JOYCAPTION_GENERATION_PARAMS)
+        output = _run_generate(
+            model,
+            inputs,
+            cancel_tokens=cancel_token,
+            run_stats=run_stats,
+            assistant_model=assistant_model,
+            stop_sequences=stop_sequences,
+            tokenizer=processor.tokenizer,
+            tag_constraint=tag_constraint,
+            degeneration=degeneration,
             eos_token_id=processor.tokenizer.eos_token_id,  # <<< The dynamic stop sign!
-            repetition_penalty=1.05,  # <<< Gentle penalty
-            no_repeat_ngram_size=3  # <<< The loop buster
+            **{**JOYCAPTION_GENERATION_PARAMS, **generation_params}
         )
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
 
         decoded_output = processor.batch_decode(output, skip_special_tokens=True)[0]
         assistant_response = decoded_output.split("assistant\n")[-1].strip()
         return assistant_response
 
-def generate_toriigate_description(model, processor, device, prompt, system_prompt, image_raw):
-    """Generates a text description for the Minthy/ToriiGate-v0.4-7B model."""
+def generate_joycaption_batch(model, processor, device, prompts, system_prompt, images, cancel_tokens=None,
+                              run_stats=None, stop_sequences=(), **generation_params):
+    """
+    Batched generate_joycaption_description: one padded generate() for several prompt/image pairs.
+    Cancelled rows stop early and their (partial) output is returned, the caller drops it.
+
+    Returns:
+        list: One assistant response per prompt.
+    """
+    import torch
+
+    with torch.no_grad():
+        convo_strings = [
+            processor.apply_chat_template([
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"<image>\n{prompt}"}
+            ], tokenize=False, add_generation_prompt=True)
+            for prompt in prompts
+        ]
+        # generate() continues from the last position, so shorter prompts are padded on the left
+        processor.tokenizer.padding_side = "left"
+        inputs = processor(text=convo_strings, images=list(images), padding=True, return_tensors="pt").to(device)
+        inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
+
+        output = _run_generate(
+            model,
+            inputs,
+            cancel_tokens=cancel_tokens,
+            run_stats=run_stats,
+            stop_sequences=stop_sequences,
+            tokenizer=processor.tokenizer,
+            eos_token_id=processor.tokenizer.eos_token_id,
+            pad_token_id=processor.tokenizer.pad_token_id,
+            **{**JOYCAPTION_GENERATION_PARAMS, **generation_params}
+        )
+
+        decoded_outputs = processor.batch_decode(output, skip_special_tokens=True)
+        return [decoded_output.split("assistant\n")[-1].strip() for decoded_output in decoded_outputs]
+
+def generate_toriigate_description(model, processor, device, prompt, system_prompt, image_raw, cancel_token=None,
+                                   assistant_model=None, run_stats=None, stop_sequences=(), tag_constraint=None,
+                                   degeneration=None, **generation_params):
+    """
+    Generates a text description for the Minthy/ToriiGate-v0.4-7B model.
+    Raises GenerationCancelled if cancel_token was cancelled, the partial output is dropped.
+    assistant_model (a draft model) turns on assisted decoding, run_stats (DecodeStats) collects counters,
+    stop_sequences end the generation early, tag_constraint (TagConstraint) limits the tags to a vocabulary,
+    degeneration (DegenerationSettings) stops a looping run early (reported in run_stats).
+    """
+    import torch
+    from qwen_vl_utils import process_vision_info
+
     with torch.no_grad():
         messages = [
             {"role": "system", "content": system_prompt},
@@ -107,16 +357,22 @@ def generate_toriigate_description(model, processor, device, prompt, system_prom
         model_inputs = processor(text=[text_input], images=image_inputs, videos=None, padding=True,
                                  return_tensors="pt").to(device)
 
-        # Updated generate call with the new parameters
-        generated_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=1024,
-            do_sample=True,
-            #temperature=0.1,
+        # Updated generate call with the new parameters (see TORIIGATE_GENERATION_PARAMS)
+        generated_ids = _run_generate(
+            model,
+            model_inputs,
+            cancel_tokens=cancel_token,
+            run_stats=run_stats,
+            assistant_model=assistant_model,
+            stop_sequences=stop_sequences,
+            tokenizer=processor.tokenizer,
+            tag_constraint=tag_constraint,
+            degeneration=degeneration,
             eos_token_id=[151645, 151643],
-            #repetition_penalty=1.05,
-            no_repeat_ngram_size=3  # <<< THE LOOP BUSTER!
+            **{**TORIIGATE_GENERATION_PARAMS, **generation_params}
         )
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
 
 
         trimmed_generated_ids = [out_ids[len(in_ids):] for in_ids, out_ids in
@@ -125,40 +381,65 @@ def generate_toriigate_description(model, processor, device, prompt, system_prom
         processor.batch_decode(trimmed_generated_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0]
         return assistant_response
 
+def generate_toriigate_batch(model, processor, device, prompts, system_prompt, images, cancel_tokens=None,
+                             run_stats=None, stop_sequences=(), **generation_params):
+    """
+    Batched generate_toriigate_description: one padded generate() for several prompt/image pairs.
+    Cancelled rows stop early and their (partial) output is returned, the caller drops it.
 
+    Returns:
+        list: One assistant response per prompt.
+    """
+    import torch
+    from qwen_vl_utils import process_vision_info
 
+    with torch.no_grad():
+        text_inputs, image_inputs = [], []
+        for prompt, image_raw in zip(prompts, images):
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": [{"type": "image", "image": image_raw}, {"type": "text", "text": prompt}]}
+            ]
+            text_inputs.append(processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True))
+            image_inputs.extend(process_vision_info(messages)[0])
+        # generate() continues from the last position, so shorter prompts are padded on the left
+        processor.tokenizer.padding_side = "left"
+        model_inputs = processor(text=text_inputs, images=image_inputs, videos=None, padding=True,
+                                 return_tensors="pt").to(device)
 
-# --- Define Parser Functions ---
-# Each model might have a different output format, so they get their own parser.
+        generated_ids = _run_generate(
+            model,
+            model_inputs,
+            cancel_tokens=cancel_tokens,
+            run_stats=run_stats,
+            stop_sequences=stop_sequences,
+            tokenizer=processor.tokenizer,
+            eos_token_id=[151645, 151643],
+            pad_token_id=processor.tokenizer.pad_token_id,
+            **{**TORIIGATE_GENERATION_PARAMS, **generation_params}
+        )
 
+        trimmed_generated_ids = [out_ids[len(in_ids):] for in_ids, out_ids in
+                                 zip(model_inputs.input_ids, generated_ids)]
+        return processor.batch_decode(trimmed_generated_ids, skip_special_tokens=True,
+                                      clean_up_tokenization_spaces=False)
 
-def parse_toriigate_tags(raw_output: str) -> Dict[str, str]:
-    """Parses the specific text output from ToriiGate."""
 
-    # Define the regex patterns to find content inside our custom tags.
-    # The r"" makes it a raw string, which is best practice for regex.
-    # The (.*?) is a non-greedy capturing group for the content inside.
-    tags_pattern = r"<tags>(.*?)</tags>"
-    desc_pattern = r"<convenient_description>(.*?)</convenient_description>"
 
-    # Use re.search() to find the first match for each pattern.
-    # The re.DOTALL flag allows '.' to match newline characters.
-    tags_match = re.search(tags_pattern, raw_output, re.DOTALL)
-    desc_match = re.search(desc_pattern, raw_output, re.DOTALL)
 
-    # Extract the captured group (the content) if a match was found.
-    # .group(1) gets the content of the first (...) in the pattern.
-    tags = ""
-    description = ""
-    try:
-        tags = tags_match.group(1).strip() if tags_match else "No tags found."
-        description = desc_match.group(1).strip() if desc_match else "No description found."
-    except Exception as e:
-        print("Failed to parse tags output of ToriiGate:", e)
+# --- Define Parser Functions ---
+# Each model might have a different output format, so they get their own parser.
 
-    if not tags_match:
-        print(raw_output)
-    return {"output": tags, "description": description}
+
+def parse_toriigate_tags(raw_output: str) -> Dict[str, str]:
+    """Parses the specific text output from ToriiGate."""
+    # <tags>...</tags> and <convenient_description>...</convenient_description>, see TaggedOutputParser
+    # for feeding the output while it is generated
+    fields = parse_tagged_output(raw_output, TORIIGATE_SECTIONS)
+    if "tags" not in fields:
+        print(f"No <tags> section in the ToriiGate output ({len(raw_output)} characters).")
+    return {"output": fields.get("tags", NO_TAGS_FOUND),
+            "description": fields.get("convenient_description", "No description found.")}
 
 
 
@@ -180,7 +461,9 @@ VLM_PROFILES = {
         generation_function=generate_joycaption_description,  # Assign the generate function
         loader_function=load_joycaption_model,  # Assign the loader function
         # VRAM THRESHOLD: Model size (~15.6GB) + safety buffer
-        required_vram_gb = 17 # Will determine the target for loading "auto" or "cuda"
+        required_vram_gb = 17, # Will determine the target for loading "auto" or "cuda"
+        generation_params=dict(JOYCAPTION_GENERATION_PARAMS),
+        batch_generation_function=generate_joycaption_batch
     ),
     "ToriiGate-v0.4-7B": VLMProfile(
         model_id="Minthy/ToriiGate-v0.4-7B",
@@ -199,7 +482,18 @@ Here are grounding tags for better understanding: <tags></tags>.""", # Default p
         generation_function=generate_toriigate_description,  # Assign the generate function
         loader_function=load_toriigate_model, # Assign the loader function
         # VRAM THRESHOLD: Model size (~15.4GB) + safety buffer
-        required_vram_gb = 18 # Will determine the target for loading "auto" or "cuda"
+        required_vram_gb = 18, # Will determine the target for loading "auto" or "cuda"
+        generation_params=dict(TORIIGATE_GENERATION_PARAMS),
+        batch_generation_function=generate_toriigate_batch,
+        # prompt_tags asks for <analysis>, <NSFW> then <tags>: parse_toriigate_tags has it all at </tags>
+        stop_sequences=("</tags>",),
+        # Constrained tags: the list sits between <tags> and </tags>, tags spelled with spaces ("long hair")
+        tags_section_start="<tags>",
+        tags_section_end="</tags>",
+        tags_with_spaces=True,
+        # Assisted decoding, opt-in (the draft costs ~5 GB more): uncomment to draft with Qwen2-VL-2B
+        # draft_model_id="Qwen/Qwen2-VL-2B-Instruct",
+        # draft_loader_function=load_qwen2_vl_draft_model,
     )
 
 }
\ No newline at end of file